@@ -252,6 +252,9 @@ export default function LiveControlPage() {
                         </p>
                         <p className="text-xs text-muted-foreground mt-1">
                           Started at: {formatTime(liveStatus.currentContent.startedAt)}
+                          {liveStatus.currentContent.duration
+                            ? ` · ${Math.round(liveStatus.currentContent.duration)}s`
+                            : ""}
                         </p>
                       </div>
                     )}
@@ -1,21 +1,47 @@
 "use client"
 
-import { useState } from "react"
+import { useEffect, useState } from "react"
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card"
 import { Input } from "@/components/ui/input"
 import { Button } from "@/components/ui/button"
 import { Search, Download, AlertCircle, CheckCircle, Info, AlertTriangle } from "lucide-react"
 import { useAuth } from "@/hooks/use-auth"
 import { useActivities } from "@/hooks/use-activities"
+import { useDisplays } from "@/hooks/use-displays"
+import { useDisplayLogs } from "@/hooks/use-display-logs"
+import { DisplayLogEntry } from "@/lib/types"
+import {
+  Select,
+  SelectContent,
+  SelectItem,
+  SelectTrigger,
+  SelectValue,
+} from "@/components/ui/select"
 import { ProtectedRoute } from "@/components/protected-route"
 
 type LogType = "all" | "info" | "warning" | "error" | "success"
 
+// Device log lines shown at most (newest first)
+const DEVICE_LOG_LIMIT = 200
+
 export default function LogsPage() {
   const { user } = useAuth()
   const { activities, loading } = useActivities(user?.uid, 100)
   const [searchTerm, setSearchTerm] = useState("")
   const [filterType, setFilterType] = useState<LogType>("all")
+  const { displays } = useDisplays(user?.uid)
+  const [selectedDisplay, setSelectedDisplay] = useState<string>("")
+  const { entries: deviceLogs, loading: deviceLogsLoading } = useDisplayLogs(
+    user?.uid,
+    selectedDisplay || undefined
+  )
+
+  // Show the first display's logs until another one is picked
+  useEffect(() => {
+    if (!selectedDisplay && displays.length > 0) {
+      setSelectedDisplay(displays[0].id)
+    }
+  }, [displays, selectedDisplay])
 
   // Map activity type to log type
   const getLogType = (activityType: string): "info" | "warning" | "error" | "success" => {
@@ -34,6 +60,22 @@ export default function LogsPage() {
     return 'info'
   }
 
+  // Map device log level to log type
+  const getDeviceLogType = (entry: DisplayLogEntry): "info" | "warning" | "error" => {
+    if (entry.level === "ERROR") return "error"
+    if (entry.level === "WARN") return "warning"
+    return "info"
+  }
+
+  const filteredDeviceLogs = deviceLogs
+    .filter((entry) => {
+      const matchesSearch = entry.msg.toLowerCase().includes(searchTerm.toLowerCase())
+      const matchesFilter = filterType === "all" || getDeviceLogType(entry) === filterType
+      return matchesSearch && matchesFilter
+    })
+    .slice(-DEVICE_LOG_LIMIT)
+    .reverse()
+
   const filteredLogs = activities.filter((activity) => {
     const logType = getLogType(activity.action + activity.description)
     const matchesSearch =
@@ -132,6 +174,13 @@ export default function LogsPage() {
             >
               Success
             </Button>
+            <Button
+              variant={filterType === "info" ? "default" : "outline"}
+              onClick={() => setFilterType("info")}
+              className="bg-card/50 backdrop-blur-sm border-border/50 whitespace-nowrap"
+            >
+              Info
+            </Button>
             <Button
               variant={filterType === "warning" ? "default" : "outline"}
               onClick={() => setFilterType("warning")}
@@ -210,6 +259,68 @@ export default function LogsPage() {
             </div>
           </CardContent>
         </Card>
+
+        {/* Device Logs */}
+        <Card className="border-border/50 bg-card/50 backdrop-blur-sm shadow-lg">
+          <CardHeader>
+            <div className="flex flex-col sm:flex-row sm:items-start sm:justify-between gap-3">
+              <div>
+                <CardTitle>Device Logs</CardTitle>
+                <CardDescription>
+                  Showing {filteredDeviceLogs.length} of {deviceLogs.length} lines uploaded by the display
+                </CardDescription>
+              </div>
+              <Select value={selectedDisplay} onValueChange={setSelectedDisplay}>
+                <SelectTrigger className="w-full sm:w-56">
+                  <SelectValue placeholder="Choose a display" />
+                </SelectTrigger>
+                <SelectContent>
+                  {displays.map((display) => (
+                    <SelectItem key={display.id} value={display.id}>
+                      {display.name}
+                    </SelectItem>
+                  ))}
+                </SelectContent>
+              </Select>
+            </div>
+          </CardHeader>
+          <CardContent>
+            <div className="space-y-2">
+              {deviceLogsLoading ? (
+                <div className="text-center py-8">
+                  <p className="text-muted-foreground">Loading device logs...</p>
+                </div>
+              ) : filteredDeviceLogs.length > 0 ? (
+                filteredDeviceLogs.map((entry, index) => {
+                  const logType = getDeviceLogType(entry)
+                  return (
+                    <div
+                      key={`${entry.t}-${index}`}
+                      className="flex items-start gap-3 p-3 rounded-lg border border-border/30 bg-background/30"
+                    >
+                      <div className="flex items-center gap-2 pt-0.5">
+                        {getTypeIcon(logType)}
+                      </div>
+                      <div className={`px-2 py-0.5 rounded-full text-xs font-semibold border ${getTypeColor(logType)}`}>
+                        {entry.level}
+                      </div>
+                      <p className="flex-1 min-w-0 text-sm font-mono text-foreground break-words">{entry.msg}</p>
+                      <span className="text-xs text-muted-foreground whitespace-nowrap">
+                        {formatTime(new Date(entry.t))}
+                      </span>
+                    </div>
+                  )
+                })
+              ) : (
+                <div className="text-center py-8">
+                  <p className="text-muted-foreground">
+                    {selectedDisplay ? "No device logs found matching your criteria" : "No displays configured yet"}
+                  </p>
+                </div>
+              )}
+            </div>
+          </CardContent>
+        </Card>
       </div>
     </div>
     </ProtectedRoute>
@@ -0,0 +1,31 @@
+import { useState, useEffect } from 'react'
+import { DisplayLogEntry } from '@/lib/types'
+import { listenToDisplayLogs } from '@/lib/realtime-db'
+
+export function useDisplayLogs(userId: string | undefined, displayId: string | undefined) {
+  const [entries, setEntries] = useState<DisplayLogEntry[]>([])
+  const [loading, setLoading] = useState(false)
+
+  useEffect(() => {
+    setEntries([])
+    if (!userId || !displayId) {
+      setLoading(false)
+      return
+    }
+
+    setLoading(true)
+
+    // Subscribe to the batches uploaded by the device
+    const unsubscribe = listenToDisplayLogs(userId, displayId, (logEntries) => {
+      setEntries(logEntries)
+      setLoading(false)
+    })
+
+    return () => unsubscribe()
+  }, [userId, displayId])
+
+  return {
+    entries,
+    loading,
+  }
+}
@@ -11,7 +11,7 @@ import {
   DatabaseReference,
   Unsubscribe,
 } from 'firebase/database'
-import { LivePlaybackStatus, PlaybackCommand, DeviceRegistration } from './types'
+import { LivePlaybackStatus, PlaybackCommand, DeviceRegistration, DisplayLogEntry } from './types'
 
 // Realtime Database paths
 const PATHS = {
@@ -21,6 +21,9 @@ const PATHS = {
   commands: (userId: string, displayId: string) =>
     `users/${userId}/displays/${displayId}/commands`,
   devices: (userId: string) => `users/${userId}/devices`,
+  // Kept outside `displays` so listening to all displays doesn't fetch logs
+  displayLogs: (userId: string, displayId: string) =>
+    `users/${userId}/displayLogs/${displayId}`,
   // Device registration paths (independent of user)
   deviceRegistry: () => `device_registry`,
   deviceAuth: (deviceId: string) => `device_registry/${deviceId}`,
@@ -118,6 +121,24 @@ export function listenToCommands(
   })
 }
 
+// Listen to log lines uploaded by a display (batched by the device), newest last
+export function listenToDisplayLogs(
+  userId: string,
+  displayId: string,
+  callback: (entries: DisplayLogEntry[]) => void
+): Unsubscribe {
+  const logsRef = ref(realtimeDb, PATHS.displayLogs(userId, displayId))
+  return onValue(logsRef, (snapshot) => {
+    const batches = snapshot.exists() ? snapshot.val() : {}
+    const entries: DisplayLogEntry[] = []
+    // Push keys sort chronologically
+    Object.keys(batches).sort().forEach((key) => {
+      entries.push(...(batches[key].entries || []))
+    })
+    callback(entries)
+  })
+}
+
 // Update command status (when device executes it)
 export async function updateCommandStatus(
   userId: string,
@@ -30,6 +30,7 @@ export interface ContentItem {
   uploadDate: string
   category: string
   thumbnail?: string
+  duration?: number // Seconds an image, or each page of a document, stays on screen (player default when unset)
   url: string
   storageRef: string
   createdAt: string
@@ -87,7 +88,7 @@ export interface LivePlaybackStatus {
     type: "image" | "video" | "document"
     url: string
     startedAt: number
-    duration?: number
+    duration?: number // seconds
   } | null
   schedule: {
     id: string
@@ -99,6 +100,35 @@ export interface LivePlaybackStatus {
   volume: number
   brightness?: number
   errorMessage?: string
+  lastDownload?: {
+    bytes: number
+    seconds: number
+    mbps: number
+    segments: number
+  }
+  // Command-to-first-frame latency of the display's recent play/skip commands
+  transitions?: {
+    count: number
+    p50Ms: number
+    p95Ms: number
+    lastMs: number
+    // Milliseconds per stage of the last transition, e.g. delivery, schedule,
+    // metadata, fetch, download, engine, first-frame
+    lastSpans: Record<string, number>
+  }
+}
+
+// Log lines uploaded by a display, in batches under users/{uid}/displayLogs/{displayId}
+export interface DisplayLogEntry {
+  t: number
+  level: "DEBUG" | "INFO" | "WARN" | "ERROR"
+  msg: string
+}
+
+export interface DisplayLogBatch {
+  timestamp: number
+  entries: DisplayLogEntry[]
+  dropped?: number
 }
 
 // Device registration types
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Fake `vlc` for benchmarks: "plays" a file for the duration written in its
+bench header (see fakes.media_bytes), or BENCH_VLC_DURATION seconds, then exits
+"""
+
+import os
+import sys
+import time
+
+
+def media_duration(path):
+    """Duration from the bench header, or the default"""
+    default = float(os.environ.get('BENCH_VLC_DURATION', '5'))
+    try:
+        with open(path, 'rb') as f:
+            header = f.readline(128).decode('ascii', 'replace')
+    except OSError:
+        sys.exit(1)
+    if header.startswith('PANELSENA-BENCH'):
+        for field in header.split()[1:]:
+            name, _, value = field.partition('=')
+            if name == 'duration':
+                return float(value)
+    return default
+
+
+def main():
+    files = [arg for arg in sys.argv[1:] if not arg.startswith('-')]
+    if not files:
+        sys.exit(1)
+    time.sleep(media_duration(files[-1]))
+
+
+if __name__ == '__main__':
+    main()
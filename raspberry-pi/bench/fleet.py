@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+"""
+PanelSena Fleet Simulator
+Estimates the Realtime Database load of N displays (and their owners'
+dashboards) by running them all in one process against the in-memory RTDB.
+
+    python3 bench/fleet.py --displays 5000 --duration 600
+    python3 bench/fleet.py --displays 5000 --ramp 0          # everyone reboots at once
+    python3 bench/fleet.py --displays 200 --players 5 --realtime
+
+Displays are wire-level models of the player: they make the same reads, writes
+and listens (registry and link reads, status set then deltas built with
+status_writer.status_delta, 10 s heartbeats, a status delta per content change,
+batched command acks and their later deletion, batched log uploads). They run on
+one scheduler, on a simulated clock by default, so thousands of them fit in one
+process and ten minutes take seconds.
+
+`--players N` adds N real PanelSenaPlayer instances as virtual devices
+(injected transport, virtual renderer and controls, one shared event loop) on
+the same database, which needs `--realtime`. Their per-display rates are reported next to the
+model's so the two can be checked against each other.
+"""
+
+import os
+import sys
+import time
+import heapq
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import Counter, defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLAYER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PLAYER_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import (FakeRealtimeDatabase, FakeFirestore, BlobStore, LocalTransport,
+                   VirtualEngine, media_bytes)
+from status_writer import status_delta
+from commands import ACK_BATCH_DELAY
+from core import EventLoop
+
+# Player behaviour the model follows
+HEARTBEAT_INTERVAL = 10
+STATUS_DEBOUNCE = 0.25
+COMMAND_RETENTION = 60
+LOG_UPLOAD_INTERVAL = 60
+COMMAND_EXECUTE_TIME = 0.05
+
+# Dashboard command mix: (type, weight)
+COMMAND_MIX = [('play', 4), ('skip', 3), ('volume', 2), ('pause', 1)]
+
+MODEL_USER_PREFIX = "sim-user-"
+PLAYER_USER_PREFIX = "player-user-"
+
+
+class Scheduler:
+    """Single-threaded event loop on a simulated or a real clock
+
+    `call_at`/`call_later` may be used from any thread. On the simulated clock
+    time jumps straight to the next event, so nothing may block on real time.
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self._now = 0.0
+        self._epoch = time.time()
+        self._started = time.monotonic()
+        self._queue = []
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def now(self):
+        """Seconds since the simulation started"""
+        if self.realtime:
+            return time.monotonic() - self._started
+        return self._now
+
+    def wall_ms(self):
+        """Epoch milliseconds on the simulation clock (for payload timestamps)"""
+        return int((self._epoch + self.now()) * 1000)
+
+    def call_at(self, at, fn, *args):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._queue, (at, self._seq, fn, args))
+            self._cond.notify()
+
+    def call_later(self, delay, fn, *args):
+        self.call_at(self.now() + max(0.0, delay), fn, *args)
+
+    def run(self, until):
+        """Run events until the clock reaches `until`"""
+        while True:
+            with self._cond:
+                while True:
+                    if self._queue and self._queue[0][0] <= until:
+                        at = self._queue[0][0]
+                        if not self.realtime:
+                            break
+                        delay = at - self.now()
+                        if delay <= 0:
+                            break
+                        self._cond.wait(min(delay, until - self.now()))
+                    elif self.realtime and self.now() < until:
+                        self._cond.wait(until - self.now())
+                    else:
+                        if not self.realtime:
+                            self._now = until
+                        return
+                at, _, fn, args = heapq.heappop(self._queue)
+                if not self.realtime:
+                    self._now = max(self._now, at)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[fleet] Event failed: {e}")
+
+
+class LoadRecorder:
+    """Aggregate RTDB operations by category and by simulated second"""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.totals = Counter()          # (group, kind, category) -> ops
+        self.bytes = Counter()           # (group, kind, category) -> bytes
+        self.per_second = Counter()      # second -> write ops (all groups)
+        self._lock = threading.Lock()
+
+    def observe(self, kind, parts, size):
+        group, category = classify(parts)
+        key = (group, kind, category)
+        with self._lock:
+            self.totals[key] += 1
+            self.bytes[key] += size
+            if kind in ('set', 'update'):
+                self.per_second[int(self.scheduler.now())] += 1
+
+
+def classify(parts):
+    """(group, category) of an RTDB path: group is model/player/shared"""
+    parts = list(parts)
+    if not parts:
+        return 'shared', 'root'
+    if parts[0] in ('device_registry', 'device_links'):
+        group = 'player' if len(parts) > 1 and parts[1].startswith('player-') else 'model'
+        return group, 'registry'
+    if parts[0] == 'users' and len(parts) > 1:
+        group = 'player' if parts[1].startswith(PLAYER_USER_PREFIX) else 'model'
+        if len(parts) > 2 and parts[2] == 'displayLogs':
+            return group, 'logs'
+        if len(parts) == 3:
+            return group, 'dashboard'          # users/{uid}/displays
+        if len(parts) > 4:
+            return group, parts[4]             # status / commands
+        return group, 'display'
+    return 'shared', parts[0]
+
+
+class Dashboard:
+    """One user's dashboard: listens to all their displays and sends commands"""
+
+    def __init__(self, sim, user_id, display_ids, online):
+        self.sim = sim
+        self.user_id = user_id
+        self.display_ids = display_ids
+        if online:
+            sim.rtdb.reference(f'users/{user_id}/displays').listen(lambda event: None)
+
+    def schedule_commands(self, rate_per_hour):
+        if rate_per_hour <= 0:
+            return
+        for display_id in self.display_ids:
+            self._next(display_id, rate_per_hour)
+
+    def _next(self, display_id, rate_per_hour):
+        delay = self.sim.random.expovariate(rate_per_hour / 3600.0)
+        self.sim.scheduler.call_later(delay, self._send, display_id, rate_per_hour)
+
+    def _send(self, display_id, rate_per_hour):
+        types, weights = zip(*COMMAND_MIX)
+        command_type = self.sim.random.choices(types, weights)[0]
+        payload = {}
+        if command_type == 'play':
+            payload = {'scheduleId': f"schedule-{self.sim.random.randrange(3)}"}
+        elif command_type == 'volume':
+            payload = {'volume': self.sim.random.randrange(0, 101, 5)}
+        ref = self.sim.rtdb.reference(
+            f'users/{self.user_id}/displays/{display_id}/commands/{self.sim.rtdb.push_id()}')
+        command = {'commandId': ref.key, 'type': command_type, 'status': 'pending',
+                   'timestamp': self.sim.scheduler.wall_ms()}
+        if payload:
+            command['payload'] = payload
+        ref.set(command)
+        self._next(display_id, rate_per_hour)
+
+
+class ModelDisplay:
+    """Wire-level model of one player (see the module docstring)"""
+
+    def __init__(self, sim, index, user_id):
+        self.sim = sim
+        self.device_id = f"sim-device-{index}"
+        self.display_id = f"sim-display-{index}"
+        self.user_id = user_id
+        self.base = f'users/{user_id}/displays/{self.display_id}'
+        self.acked = None
+        self.write_due = False
+        self.state = None
+        self.generation = 0
+        self.queue = []
+        self.index = 0
+        self.pending_logs = 0
+        self.log_batches = 0
+
+    def boot(self):
+        sim = self.sim
+        db = sim.rtdb
+        db.reference(f'device_registry/{self.device_id}').get()
+        db.reference(f'device_links/{self.device_id}').get()
+        db.reference(f'device_registry/{self.device_id}').update(
+            {'lastSeen': sim.scheduler.wall_ms()})
+
+        self.state = {
+            'displayId': self.display_id,
+            'displayName': f"Display {self.display_id}",
+            'status': 'online',
+            'lastHeartbeat': sim.scheduler.wall_ms(),
+            'volume': 80,
+            'brightness': 100,
+            'currentContent': None,
+            'schedule': None,
+        }
+        if sim.random.random() >= sim.args.idle_fraction:
+            self._load_schedule(f"schedule-{sim.random.randrange(3)}", publish=False)
+        self._write()
+
+        # Compaction (shallow read) before listening, as CommandDispatcher does
+        db.reference(f'{self.base}/commands').get(shallow=True)
+        db.reference(f'{self.base}/commands').listen(self._on_commands)
+
+        sim.scheduler.call_later(HEARTBEAT_INTERVAL, self._heartbeat)
+        if sim.args.warnings_per_hour > 0:
+            self._next_warning()
+
+    # Status
+
+    def _publish(self):
+        """StatusWriter.publish: coalesce changes within the debounce window"""
+        if not self.write_due:
+            self.write_due = True
+            self.sim.scheduler.call_later(STATUS_DEBOUNCE, self._write)
+
+    def _write(self):
+        self.write_due = False
+        ref = self.sim.rtdb.reference(f'{self.base}/status')
+        if self.acked is None:
+            ref.set(self.state)
+        else:
+            delta = status_delta(self.acked, self.state)
+            if not delta:
+                return
+            ref.update(delta)
+        self.acked = dict(self.state)
+        for key in ('currentContent', 'schedule'):
+            if isinstance(self.acked[key], dict):
+                self.acked[key] = dict(self.acked[key])
+
+    def _touch(self):
+        self.state['lastHeartbeat'] = self.sim.scheduler.wall_ms()
+
+    def _heartbeat(self):
+        self._touch()
+        self._publish()
+        self.sim.scheduler.call_later(HEARTBEAT_INTERVAL, self._heartbeat)
+
+    # Playback
+
+    def _load_schedule(self, schedule_id, publish=True):
+        items = self.sim.args.items
+        self.queue = [f"{schedule_id}-item-{i}" for i in range(items)]
+        self.index = 0
+        self.state['schedule'] = {'id': schedule_id, 'name': schedule_id,
+                                  'contentQueue': list(self.queue), 'currentIndex': 0}
+        self._play_current(publish)
+
+    def _play_current(self, publish=True):
+        content_id = self.queue[self.index]
+        self.state['status'] = 'playing'
+        self.state['currentContent'] = {
+            'id': content_id, 'name': content_id, 'type': 'video',
+            'url': f"users/{self.user_id}/videos/{content_id}.mp4",
+            'startedAt': self.sim.scheduler.wall_ms(),
+        }
+        self.state['schedule']['currentIndex'] = self.index
+        self._touch()
+        if publish:
+            self._publish()
+        self.generation += 1
+        duration = self.sim.args.item_seconds * self.sim.random.uniform(0.8, 1.2)
+        self.sim.scheduler.call_later(duration, self._item_ended, self.generation)
+
+    def _item_ended(self, generation):
+        if generation != self.generation or self.state['status'] != 'playing':
+            return
+        self._advance()
+
+    def _advance(self):
+        if not self.queue:
+            return
+        self.index = (self.index + 1) % len(self.queue)
+        self._play_current()
+
+    # Commands
+
+    def _on_commands(self, event):
+        data = event.data
+        if not isinstance(data, dict):
+            return
+        if 'status' in data:
+            commands = {event.path.strip('/'): data}
+        else:
+            commands = {cid: c for cid, c in data.items() if isinstance(c, dict)}
+        for command_id, command in commands.items():
+            if command.get('status') == 'pending':
+                self.sim.scheduler.call_later(COMMAND_EXECUTE_TIME, self._execute,
+                                              command_id, command)
+
+    def _execute(self, command_id, command):
+        command_type = command.get('type')
+        payload = command.get('payload') or {}
+        if command_type == 'play' and 'scheduleId' in payload:
+            self._load_schedule(payload['scheduleId'])
+        elif command_type == 'skip':
+            self._advance()
+        elif command_type == 'volume':
+            self.state['volume'] = payload.get('volume', 80)
+            self._touch()
+            self._publish()
+        elif command_type == 'pause' and self.state['currentContent']:
+            paused = self.state['status'] == 'playing'
+            self.state['status'] = 'paused' if paused else 'playing'
+            self._touch()
+            self._publish()
+            if not paused:
+                self._advance()
+        self.sim.scheduler.call_later(ACK_BATCH_DELAY, self._ack, command_id)
+
+    def _ack(self, command_id):
+        ref = self.sim.rtdb.reference(f'{self.base}/commands')
+        ref.update({f"{command_id}/status": 'executed',
+                    f"{command_id}/result": 'Command executed successfully'})
+        self.sim.scheduler.call_later(COMMAND_RETENTION, ref.update, {command_id: None})
+
+    # Logs
+
+    def _next_warning(self):
+        delay = self.sim.random.expovariate(self.sim.args.warnings_per_hour / 3600.0)
+        self.sim.scheduler.call_later(delay, self._warning)
+
+    def _warning(self):
+        self.pending_logs += 1
+        if self.pending_logs == 1:
+            self.sim.scheduler.call_later(LOG_UPLOAD_INTERVAL, self._upload_logs)
+        self._next_warning()
+
+    def _upload_logs(self):
+        entries = [{'t': self.sim.scheduler.wall_ms(), 'level': 'WARN',
+                    'msg': "Simulated warning from the fleet model"}] * self.pending_logs
+        self.pending_logs = 0
+        logs_ref = self.sim.rtdb.reference(f'users/{self.user_id}/displayLogs/{self.display_id}')
+        logs_ref.push({'timestamp': self.sim.scheduler.wall_ms(), 'entries': entries})
+        self.log_batches += 1
+        if self.log_batches % 10 == 0:
+            logs_ref.get(shallow=True)
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.scheduler = Scheduler(realtime=args.realtime)
+        self.recorder = LoadRecorder(self.scheduler)
+        self.rtdb = FakeRealtimeDatabase(dispatch=self._dispatch, keep_writes=False,
+                                         observer=self.recorder.observe)
+        self.firestore = FakeFirestore()
+        self.blobs = BlobStore()
+        self.displays = []
+        self.dashboards = []
+        self.players = []
+        self.player_loop = None
+        self._workdir = None
+
+    def _dispatch(self, callback, event):
+        """Listener events are delivered on the scheduler, after the RTDB latency"""
+        self.scheduler.call_later(self.args.rtdb_latency, callback, event)
+
+    def setup(self):
+        args = self.args
+        users = max(1, -(-args.displays // args.displays_per_user))
+        for u in range(users):
+            user_id = f"{MODEL_USER_PREFIX}{u}"
+            displays = [ModelDisplay(self, i, user_id)
+                        for i in range(u * args.displays_per_user,
+                                       min(args.displays, (u + 1) * args.displays_per_user))]
+            self.displays.extend(displays)
+            for display in displays:
+                self.rtdb.root.setdefault('device_registry', {})[display.device_id] = {
+                    'deviceId': display.device_id, 'deviceKey': 'sim'}
+                self.rtdb.root.setdefault('device_links', {})[display.device_id] = {
+                    'userId': user_id, 'displayId': display.display_id}
+            online = self.random.random() < args.dashboards_online
+            dashboard = Dashboard(self, user_id, [d.display_id for d in displays], online)
+            dashboard.schedule_commands(args.commands_per_hour)
+            self.dashboards.append(dashboard)
+
+        for display in self.displays:
+            self.scheduler.call_later(self.random.uniform(0, args.ramp), display.boot)
+
+        if args.players:
+            self._setup_players()
+
+    def _setup_players(self):
+        """Real players as virtual devices, sharing the simulated database"""
+        import player
+        from controls import VirtualControls
+
+        args = self.args
+        self._workdir = tempfile.mkdtemp(prefix="panelsena-fleet-")
+        content_ids = []
+        for i in range(args.items):
+            content_id = f"player-item-{i}"
+            name = self.blobs.add(f"videos/{content_id}.mp4",
+                                  media_bytes(args.item_seconds, 4096))
+            self.firestore.put('content', content_id, {
+                'name': content_id, 'type': 'video', 'url': name, 'storageRef': name,
+                'updatedAt': '1'})
+            content_ids.append(content_id)
+        self.firestore.put('schedules', 'player-schedule', {
+            'name': 'player-schedule', 'contentIds': content_ids})
+
+        # All players share one event loop and its executor
+        self.player_loop = EventLoop(args.player_workers)
+
+        user_id = f"{PLAYER_USER_PREFIX}0"
+        display_ids = []
+        for i in range(args.players):
+            device_id = f"player-device-{i}"
+            display_id = f"player-display-{i}"
+            display_ids.append(display_id)
+            self.rtdb.root.setdefault('device_registry', {})[device_id] = {
+                'deviceId': device_id, 'deviceKey': 'sim'}
+            self.rtdb.root.setdefault('device_links', {})[device_id] = {
+                'userId': user_id, 'displayId': display_id}
+            config = {
+                'device_id': device_id, 'device_key': 'sim', 'display_name': display_id,
+                'log_level': 'error', 'log_upload_level': 'off',
+            }
+            transport = LocalTransport(self.rtdb, self.firestore, self.blobs.bucket())
+
+            def engine_factory(name, on_end=None, on_start=None, **options):
+                return VirtualEngine(on_end, on_start, call_later=self.scheduler.call_later)
+
+            instance = player.PanelSenaPlayer(
+                config=config, transport=transport, engine_factory=engine_factory,
+                controls=VirtualControls(), base_dir=os.path.join(self._workdir, device_id),
+                loop=self.player_loop)
+            self.players.append(instance)
+            self.scheduler.call_later(self.random.uniform(0, args.ramp), self._start_player,
+                                      instance, user_id, display_id)
+
+        online = self.random.random() < args.dashboards_online
+        dashboard = Dashboard(self, user_id, display_ids, online)
+        dashboard.schedule_commands(args.commands_per_hour)
+        self.dashboards.append(dashboard)
+
+    def _start_player(self, instance, user_id, display_id):
+        online = instance.start()
+        if self.random.random() >= self.args.idle_fraction:
+            online.add_done_callback(lambda _: self._play(user_id, display_id))
+
+    def _play(self, user_id, display_id):
+        ref = self.rtdb.reference(
+            f'users/{user_id}/displays/{display_id}/commands/{self.rtdb.push_id()}')
+        ref.set({'commandId': ref.key, 'type': 'play', 'status': 'pending',
+                 'timestamp': self.scheduler.wall_ms(),
+                 'payload': {'scheduleId': 'player-schedule'}})
+
+    def run(self):
+        started = time.monotonic()
+        self.scheduler.run(self.args.duration)
+        elapsed = time.monotonic() - started
+        for instance in self.players:
+            instance.cleanup()
+        if self.player_loop is not None:
+            self.player_loop.close()
+        if self._workdir:
+            shutil.rmtree(self._workdir, ignore_errors=True)
+        return elapsed
+
+
+def report(sim, elapsed):
+    args = sim.args
+    duration = args.duration
+    recorder = sim.recorder
+    print(f"\nFleet: {args.displays} modelled displays"
+          + (f" + {args.players} real players" if args.players else "")
+          + f", {len(sim.dashboards)} users"
+          + f", {duration:.0f} s {'real time' if args.realtime else 'simulated'}"
+          + f" in {elapsed:.1f} s")
+    print(f"Active listeners at the end: {sim.rtdb.listener_count()}")
+
+    def rows(group):
+        table = defaultdict(lambda: [0, 0])
+        for (g, kind, category), count in recorder.totals.items():
+            if g == group:
+                table[(kind, category)][0] += count
+                table[(kind, category)][1] += recorder.bytes[(g, kind, category)]
+        return table
+
+    for group, count in (('model', args.displays), ('player', args.players)):
+        if not count:
+            continue
+        table = rows(group)
+        print(f"\n{group} displays ({count}):")
+        print(f"  {'operation':<10}{'category':<12}{'ops/s':>10}{'KB/s':>10}"
+              f"{'ops/display/min':>18}")
+        for (kind, category), (ops, size) in sorted(table.items()):
+            print(f"  {kind:<10}{category:<12}{ops / duration:>10.1f}"
+                  f"{size / duration / 1024:>10.1f}{ops * 60 / duration / count:>18.2f}")
+
+    writes = sum(c for (g, k, _), c in recorder.totals.items() if k in ('set', 'update'))
+    write_bytes = sum(b for (g, k, _), b in recorder.bytes.items() if k in ('set', 'update'))
+    events = sum(c for (g, k, _), c in recorder.totals.items() if k == 'event')
+    event_bytes = sum(b for (g, k, _), b in recorder.bytes.items() if k == 'event')
+    reads = sum(c for (g, k, _), c in recorder.totals.items() if k == 'get')
+    peak = max(recorder.per_second.values()) if recorder.per_second else 0
+    print(f"\nTotal: {writes / duration:.1f} writes/s ({write_bytes / duration / 1024:.1f} KB/s), "
+          f"{reads / duration:.1f} reads/s, "
+          f"{events / duration:.1f} listener events/s ({event_bytes / duration / 1024:.1f} KB/s), "
+          f"peak {peak} writes in one second")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the RTDB load of a fleet of displays")
+    parser.add_argument('--displays', type=int, default=5000, help="modelled displays")
+    parser.add_argument('--players', type=int, default=0,
+                        help="real players run as virtual devices (needs --realtime)")
+    parser.add_argument('--player-workers', type=int, default=8,
+                        help="executor threads shared by the real players")
+    parser.add_argument('--duration', type=float, default=600, help="seconds to simulate")
+    parser.add_argument('--realtime', action='store_true', help="run on the wall clock")
+    parser.add_argument('--ramp', type=float, default=60, help="seconds over which displays boot")
+    parser.add_argument('--displays-per-user', type=int, default=10)
+    parser.add_argument('--dashboards-online', type=float, default=0.2,
+                        help="fraction of users with a dashboard open")
+    parser.add_argument('--commands-per-hour', type=float, default=2,
+                        help="dashboard commands per display per hour")
+    parser.add_argument('--warnings-per-hour', type=float, default=1,
+                        help="uploaded warnings per display per hour")
+    parser.add_argument('--items', type=int, default=5, help="items per schedule")
+    parser.add_argument('--item-seconds', type=float, default=15, help="average item duration")
+    parser.add_argument('--idle-fraction', type=float, default=0.2,
+                        help="displays not playing a schedule")
+    parser.add_argument('--rtdb-latency', type=float, default=0.05,
+                        help="listener delivery delay in seconds")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.players and not args.realtime:
+        parser.error("--players needs --realtime (real players run on the wall clock)")
+
+    sim = Simulation(args)
+    sim.setup()
+    elapsed = sim.run()
+    report(sim, elapsed)
+
+
+if __name__ == '__main__':
+    main()
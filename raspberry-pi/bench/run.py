@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+PanelSena Player Benchmarks
+Runs the real PanelSenaPlayer against the local stand-ins in fakes.py through
+scripted scenarios and reports command-to-play latency, transition gaps, status
+write rate and download throughput.
+
+    python3 bench/run.py                          # all scenarios
+    python3 bench/run.py warm-skip --repeat 3     # one scenario, median of 3 runs
+    python3 bench/run.py --output before.json
+    python3 bench/run.py --output after.json --compare before.json
+
+Each scenario runs in a fresh interpreter and a scratch directory, with fixed
+latency, bandwidth and media, so results can be compared between commits.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from statistics import mean, median
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLAYER_DIR = os.path.dirname(BENCH_DIR)
+
+USER_ID = "bench-user"
+DISPLAY_ID = "bench-display"
+DEVICE_ID = "bench-device"
+DEVICE_KEY = "bench-key"
+
+# Simulated network, the same for every run
+RTDB_LATENCY = 0.03
+FIRESTORE_LATENCY = 0.05
+STORAGE_LATENCY = 0.02
+BANDWIDTH_MBPS = 200
+
+MB = 1024 * 1024
+
+
+def stats(values):
+    """count/mean/p50/p95/max of a list of numbers"""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    p95 = ordered[max(0, -(-len(ordered) * 95 // 100) - 1)]
+    return {
+        'count': len(ordered),
+        'mean': round(mean(ordered), 2),
+        'p50': round(median(ordered), 2),
+        'p95': round(p95, 2),
+        'max': round(ordered[-1], 2),
+    }
+
+
+class Bench:
+    """One player wired to fresh stand-ins, plus helpers to script a scenario"""
+
+    def __init__(self, config=None):
+        from fakes import FakeRealtimeDatabase, FakeFirestore, BlobStore
+
+        self.rtdb = FakeRealtimeDatabase({
+            'device_registry': {DEVICE_ID: {'deviceId': DEVICE_ID, 'deviceKey': DEVICE_KEY}},
+            'device_links': {DEVICE_ID: {'userId': USER_ID, 'displayId': DISPLAY_ID}},
+        }, latency=RTDB_LATENCY)
+        self.firestore = FakeFirestore(latency=FIRESTORE_LATENCY)
+        self.blobs = BlobStore(mbps=BANDWIDTH_MBPS, latency=STORAGE_LATENCY)
+        self.config = dict({
+            'device_id': DEVICE_ID,
+            'device_key': DEVICE_KEY,
+            'display_name': 'Bench Display',
+            'playback_engine': 'subprocess',
+            'log_level': 'warn',
+            'log_upload_level': 'off',
+        }, **(config or {}))
+        self.player = None
+        self.controls = None
+        self.plays = 0
+        self.connectivity = {}         # Measurements of the connectivity scenarios
+        self._plays_cond = threading.Condition()
+        self._started = None
+
+    # Setup
+
+    def add_media(self, count, duration, size, transport='http', prefix='item'):
+        """Create `count` content documents with media of `size` bytes. Returns their IDs"""
+        from fakes import media_bytes
+
+        ids = []
+        for i in range(count):
+            content_id = f"{prefix}-{i}"
+            name = self.blobs.add(f"users/{USER_ID}/videos/{content_id}.mp4",
+                                  media_bytes(duration, size))
+            url = self.blobs.url(name) if transport == 'http' else name
+            self.firestore.put('content', content_id, {
+                'name': content_id, 'type': 'video', 'url': url, 'storageRef': name,
+                'sizeBytes': size, 'updatedAt': '1',
+            })
+            ids.append(content_id)
+        return ids
+
+    def add_schedule(self, schedule_id, content_ids):
+        self.firestore.put('schedules', schedule_id, {
+            'name': schedule_id, 'contentIds': list(content_ids),
+        })
+
+    def start(self, wait=True):
+        """Create the player and bring it online. Returns a Future that is done
+        once it is online (already done with `wait`)"""
+        from fakes import LocalTransport, install_fake_vlc
+        from controls import VirtualControls
+
+        install_fake_vlc(os.path.abspath('bin'))
+
+        import player
+        bench = self
+
+        class BenchPlayer(player.PanelSenaPlayer):
+            def handle_content_start(self):
+                super().handle_content_start()
+                with bench._plays_cond:
+                    bench.plays += 1
+                    bench._plays_cond.notify_all()
+
+        transport = LocalTransport(self.rtdb, self.firestore, self.blobs.bucket())
+        self.controls = VirtualControls()
+        self.player = BenchPlayer(config=self.config, transport=transport,
+                                  controls=self.controls)
+        online = self.player.start()
+        self._started = time.monotonic()
+        if wait:
+            online.result()
+        return online
+
+    # Driving
+
+    def command(self, command_type, **payload):
+        """Send a command the way the dashboard does"""
+        ref = self.rtdb.reference(f'users/{USER_ID}/displays/{DISPLAY_ID}/commands')
+        new_ref = ref.child(self.rtdb.push_id())
+        command = {
+            'commandId': new_ref.key,
+            'type': command_type,
+            'timestamp': int(time.time() * 1000),
+            'status': 'pending',
+        }
+        if payload:
+            command['payload'] = payload
+        new_ref.set(command)
+        return new_ref.key
+
+    def wait_for_plays(self, count, timeout=120):
+        """Wait until `count` items in total have started playing"""
+        deadline = time.monotonic() + timeout
+        with self._plays_cond:
+            while self.plays < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"only {self.plays} of {count} items played")
+                self._plays_cond.wait(remaining)
+
+    def wait_until_cached(self, content_ids, timeout=120):
+        """Wait until the prefetcher has everything on disk"""
+        deadline = time.monotonic() + timeout
+        while any(self.player.content_cache.lookup(cid) is None for cid in content_ids):
+            if time.monotonic() > deadline:
+                raise TimeoutError("content was not cached in time")
+            time.sleep(0.05)
+
+    # Results
+
+    def results(self):
+        """Measurements of the run so far"""
+        elapsed = time.monotonic() - self._started
+        traces = [t for t in self.player.tracer.recent() if t['status'] == 'ok']
+        latency = {}
+        for trigger in sorted({t['trigger'] for t in traces}):
+            latency[trigger] = stats([t['totalMs'] for t in traces if t['trigger'] == trigger])
+
+        status_path = f'users/{USER_ID}/displays/{DISPLAY_ID}/status'
+        status_writes, status_bytes = self.rtdb.writes_under(status_path)
+        downloads = list(self.player.downloader.history)
+
+        return {
+            'seconds': round(elapsed, 2),
+            'plays': self.plays,
+            'commandToPlayMs': latency,
+            'transitionGapMs': stats(list(self.player.engine.transition_gaps)),
+            'statusWrites': {
+                'count': status_writes,
+                'perMinute': round(status_writes * 60 / elapsed, 2) if elapsed else 0,
+                'bytes': status_bytes,
+            },
+            'downloads': {
+                'count': len(downloads),
+                'bytes': sum(d['bytes'] for d in downloads),
+                'mbps': stats([d['mbps'] for d in downloads]),
+            },
+            'rtdbWrites': len(self.rtdb.writes),
+            'firestoreReads': self.firestore.reads,
+            'connectivity': dict(self.connectivity),
+        }
+
+    def close(self):
+        if self.player is not None:
+            self.player.cleanup()
+        self.blobs.close()
+
+
+# Scenarios: each takes a Bench, scripts it and returns nothing
+
+def cold_schedule_http(bench):
+    """Play a 4-item schedule with nothing cached, downloading over HTTP"""
+    items = bench.add_media(4, duration=1.0, size=16 * MB, transport='http')
+    bench.add_schedule('cold', items)
+    bench.start()
+    bench.command('play', scheduleId='cold')
+    bench.wait_for_plays(6)
+
+
+def cold_schedule_blob(bench):
+    """Play a 4-item schedule with nothing cached, downloading storage blobs"""
+    items = bench.add_media(4, duration=1.0, size=16 * MB, transport='blob')
+    bench.add_schedule('cold', items)
+    bench.start()
+    bench.command('play', scheduleId='cold')
+    bench.wait_for_plays(6)
+
+
+def warm_skip(bench):
+    """Skip through a fully cached schedule with 20 skip commands"""
+    items = bench.add_media(5, duration=60.0, size=1 * MB)
+    bench.add_schedule('warm', items)
+    bench.config['prefetch_count'] = len(items)
+    bench.start()
+    bench.command('play', scheduleId='warm')
+    bench.wait_for_plays(1)
+    bench.wait_until_cached(items)
+    for i in range(20):
+        bench.command('skip')
+        bench.wait_for_plays(2 + i)
+        time.sleep(0.2)
+
+
+def play_single(bench):
+    """Switch between single content items with play commands"""
+    items = bench.add_media(3, duration=60.0, size=4 * MB)
+    bench.start()
+    for i in range(9):
+        bench.command('play', contentId=items[i % len(items)])
+        bench.wait_for_plays(1 + i)
+        time.sleep(0.2)
+
+
+def autoplay_loop(bench):
+    """Loop a cached schedule of short items for 15 seconds"""
+    items = bench.add_media(3, duration=0.5, size=256 * 1024)
+    bench.add_schedule('loop', items)
+    bench.config['prefetch_count'] = len(items)
+    bench.start()
+    bench.command('play', scheduleId='loop')
+    bench.wait_for_plays(1)
+    bench.wait_until_cached(items)
+    time.sleep(15)
+
+
+def late_link(bench):
+    """Boot unlinked and get linked from the dashboard a second later"""
+    del bench.rtdb.root['device_links']
+    online = bench.start(wait=False)
+    time.sleep(1)
+    linked = time.monotonic()
+    bench.rtdb.reference(f'device_links/{DEVICE_ID}').set(
+        {'userId': USER_ID, 'displayId': DISPLAY_ID})
+    online.result(timeout=60)
+    bench.connectivity['linkToOnlineMs'] = round((time.monotonic() - linked) * 1000)
+
+
+def outage(bench):
+    """Lose the network for 20 seconds while a cached schedule plays"""
+    items = bench.add_media(3, duration=0.5, size=256 * 1024)
+    bench.add_schedule('loop', items)
+    bench.config.update(prefetch_count=len(items), reconnect_min_seconds=0.5,
+                        reconnect_max_seconds=4)
+    bench.start()
+    bench.command('play', scheduleId='loop')
+    bench.wait_for_plays(1)
+    bench.wait_until_cached(items)
+
+    bench.rtdb.offline = True
+    time.sleep(20)
+    bench.rtdb.offline = False
+    restored = time.monotonic()
+    bench.connectivity['failedOps'] = bench.rtdb.ops['failed']
+
+    status_path = f'users/{USER_ID}/displays/{DISPLAY_ID}/status'
+    while bench.rtdb.writes_under(status_path, since=restored)[0] == 0:
+        if time.monotonic() - restored > 60:
+            raise TimeoutError("status was not written after the outage")
+        time.sleep(0.05)
+    bench.connectivity['reconnectMs'] = round((time.monotonic() - restored) * 1000)
+
+
+def offline_boot(bench):
+    """Boot online, then offline, then online again with a cached schedule playing"""
+    items = bench.add_media(3, duration=0.5, size=256 * 1024)
+    bench.add_schedule('loop', items)
+    bench.config.update(prefetch_count=len(items), reconnect_min_seconds=0.5,
+                        reconnect_max_seconds=2)
+    bench.start()
+    bench.command('play', scheduleId='loop')
+    bench.wait_for_plays(1)
+    bench.wait_until_cached(items)
+    bench.player.cleanup()
+
+    # Transitions while offline save the playback state before the link is resolved
+    bench.rtdb.offline = True
+    bench.start(wait=False)
+    bench.wait_for_plays(bench.plays + 3)
+    bench.player.cleanup()
+
+    bench.rtdb.offline = False
+    bench.start()
+    time.sleep(1)
+    if not bench.player.is_playing or not bench.player.current_schedule:
+        raise AssertionError("resumed playback was stopped after an offline boot")
+
+
+def restart(bench):
+    """Restart from the dashboard, then boot again on the same database and cache"""
+    bench.start()
+    command_id = bench.command('restart')
+    deadline = time.monotonic() + 30
+    while bench.controls.reboots == 0:
+        if time.monotonic() > deadline:
+            raise TimeoutError("the restart command was not run")
+        time.sleep(0.05)
+    command = bench.rtdb.reference(
+        f'users/{USER_ID}/displays/{DISPLAY_ID}/commands/{command_id}').get()
+    if not command or command.get('status') != 'executed':
+        raise AssertionError(f"restart was not acknowledged: {command}")
+
+    # The next boot must not find the restart pending and reboot again
+    bench.start()
+    time.sleep(3)
+    if bench.controls.reboots:
+        raise AssertionError("the restart command was replayed after the reboot")
+
+
+SCENARIOS = {
+    'cold-schedule-http': cold_schedule_http,
+    'cold-schedule-blob': cold_schedule_blob,
+    'warm-skip': warm_skip,
+    'play-single': play_single,
+    'autoplay-loop': autoplay_loop,
+    'late-link': late_link,
+    'outage': outage,
+    'offline-boot': offline_boot,
+    'restart': restart,
+}
+
+
+def run_worker(name, result_path):
+    """Run one scenario in this process (called in a fresh interpreter)"""
+    sys.path.insert(0, PLAYER_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    workdir = tempfile.mkdtemp(prefix=f"panelsena-bench-{name}-")
+    os.chdir(workdir)
+    bench = Bench()
+    try:
+        SCENARIOS[name](bench)
+        results = bench.results()
+        results['ok'] = True
+    except Exception as e:
+        results = bench.results() if bench.player is not None else {}
+        results.update({'ok': False, 'error': str(e)})
+    finally:
+        bench.close()
+        os.chdir('/')
+        shutil.rmtree(workdir, ignore_errors=True)
+    with open(result_path, 'w') as f:
+        json.dump(results, f)
+
+
+def run_scenario(name, verbose=False):
+    """Run a scenario in a child interpreter and return its results"""
+    fd, result_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--worker', name, '--result', result_path],
+            stdout=None if verbose else subprocess.DEVNULL,
+            stderr=None if verbose else subprocess.DEVNULL,
+            timeout=600,
+        )
+        with open(result_path, 'r') as f:
+            return json.load(f)
+    except (subprocess.TimeoutExpired, ValueError) as e:
+        return {'ok': False, 'error': f"scenario did not finish: {e}"}
+    finally:
+        os.remove(result_path)
+
+
+def merge_runs(runs):
+    """Median of every number across repeated runs"""
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: merge_runs([run.get(key) for run in runs if isinstance(run, dict)])
+                for key in first}
+    if isinstance(first, (int, float)) and not isinstance(first, bool):
+        values = [run for run in runs if isinstance(run, (int, float))]
+        return round(median(values), 2)
+    return first
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=PLAYER_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Headline numbers printed and compared: (label, path into the results)
+HEADLINES = [
+    ('play latency p50 ms', ('commandToPlayMs', 'play', 'p50')),
+    ('play latency p95 ms', ('commandToPlayMs', 'play', 'p95')),
+    ('skip latency p50 ms', ('commandToPlayMs', 'skip', 'p50')),
+    ('skip latency p95 ms', ('commandToPlayMs', 'skip', 'p95')),
+    ('transition gap p50 ms', ('transitionGapMs', 'p50')),
+    ('transition gap p95 ms', ('transitionGapMs', 'p95')),
+    ('status writes/min', ('statusWrites', 'perMinute')),
+    ('status bytes', ('statusWrites', 'bytes')),
+    ('download Mbit/s p50', ('downloads', 'mbps', 'p50')),
+    ('link to online ms', ('connectivity', 'linkToOnlineMs')),
+    ('failed RTDB ops offline', ('connectivity', 'failedOps')),
+    ('reconnect ms', ('connectivity', 'reconnectMs')),
+]
+
+
+def lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict):
+            return None
+        results = results.get(key)
+    return results
+
+
+def print_report(report, baseline=None):
+    print(f"PanelSena benchmarks at {report['commit'] or 'unknown commit'}"
+          + (f", compared with {baseline['commit']}" if baseline else ""))
+    for name, results in report['scenarios'].items():
+        status = "" if results.get('ok') else f"  FAILED: {results.get('error')}"
+        print(f"\n{name} ({results.get('seconds', 0)} s, {results.get('plays', 0)} plays){status}")
+        before_results = (baseline or {}).get('scenarios', {}).get(name, {})
+        for label, path in HEADLINES:
+            value = lookup(results, path)
+            if value is None:
+                continue
+            line = f"  {label:<24}{value:>12}"
+            before = lookup(before_results, path)
+            if isinstance(before, (int, float)):
+                change = f"{(value - before) / before * 100:+.1f}%" if before else ""
+                line += f"{before:>12}  {change}"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the player against local stand-ins")
+    parser.add_argument('scenarios', nargs='*', help=f"scenarios to run: {', '.join(SCENARIOS)}")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per scenario (median is reported)")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--compare', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--verbose', action='store_true', help="show player output")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.result)
+        return
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'scenarios': {},
+    }
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        runs = [run_scenario(name, args.verbose) for _ in range(max(1, args.repeat))]
+        report['scenarios'][name] = merge_runs(runs)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if not all(results.get('ok') for results in report['scenarios'].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+PanelSena Command Dispatcher
+Queues dashboard commands off the Firebase listener thread, coalesces superseded
+ones, runs each commandId at most once, batches acknowledgements and keeps the
+commands node small
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict, deque
+import log
+import metrics
+
+# Commands where only the most recent one matters
+LATEST_WINS = ('volume', 'brightness')
+
+# Commands that end the process: acknowledged and journaled before they run,
+# or the next boot would find them pending and run them again
+ACK_FIRST = ('restart',)
+
+# How long acknowledgements are collected before one batched update
+ACK_BATCH_DELAY = 0.2
+
+# Pause before retrying a failed acknowledgement batch
+ACK_RETRY_DELAY = 5
+
+# Remembered command IDs for idempotency
+SEEN_LIMIT = 1000
+
+# Acknowledgements held while offline; beyond this the oldest become deletions
+MAX_PENDING_ACKS = 200
+
+COMMAND_ACK_SECONDS = metrics.histogram(
+    "panelsena_command_ack_seconds",
+    "Time from receiving a command to writing its acknowledgement",
+    labels=("type", "status"), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+
+# Alphabet of Firebase push IDs; the first 8 characters encode the creation time
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+
+def push_id_time(key):
+    """Creation time (epoch seconds) encoded in a Firebase push ID, or None"""
+    if not isinstance(key, str) or len(key) != 20:
+        return None
+    millis = 0
+    for char in key[:8]:
+        index = PUSH_CHARS.find(char)
+        if index < 0:
+            return None
+        millis = millis * 64 + index
+    return millis / 1000.0
+
+
+def command_time(command):
+    """Creation time (epoch seconds) of a command from its `timestamp`, or None"""
+    timestamp = command.get('timestamp')
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        return timestamp / 1000.0
+    return None
+
+
+class CommandJournal:
+    """Local record of acknowledged commands
+
+    Remembers which command IDs were acknowledged and when, so a restarted
+    player neither replays nor re-downloads commands it already handled, and
+    the timestamp of the newest one, below which pending commands in a listener
+    snapshot are dropped. Entries are dropped once the commands are pruned from
+    the database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        data = self._load()
+        self.last_timestamp = data.get('lastTimestamp', 0)
+        self._acked = data.get('acked', {})   # command_id -> acknowledged at (epoch s)
+
+    def acked_ids(self):
+        """IDs of acknowledged commands not yet pruned"""
+        with self._lock:
+            return list(self._acked)
+
+    def record(self, command_id, timestamp=None):
+        """Note a command as acknowledged now"""
+        with self._lock:
+            self._acked[command_id] = time.time()
+            if timestamp is not None and timestamp > self.last_timestamp:
+                self.last_timestamp = timestamp
+
+    def forget(self, command_ids):
+        """Drop commands that no longer exist in the database"""
+        with self._lock:
+            for command_id in command_ids:
+                self._acked.pop(command_id, None)
+
+    def due(self, retention):
+        """IDs acknowledged more than `retention` seconds ago"""
+        cutoff = time.time() - retention
+        with self._lock:
+            return [cid for cid, acked_at in self._acked.items() if acked_at <= cutoff]
+
+    def next_due_in(self, retention):
+        """Seconds until the oldest entry is due for pruning, or None when empty"""
+        with self._lock:
+            if not self._acked:
+                return None
+            oldest = min(self._acked.values())
+        return oldest + retention - time.time()
+
+    def save(self):
+        """Atomically write the journal"""
+        with self._lock:
+            data = {
+                'lastTimestamp': self.last_timestamp,
+                'acked': dict(self._acked),
+            }
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warn(f"Failed to save command journal: {e}")
+
+    def _load(self):
+        """Load the on-disk journal"""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warn(f"Command journal unreadable ({e}), starting empty")
+            return {}
+
+
+class CommandDispatcher:
+    """Run commands on a worker thread in arrival order
+
+    - `volume`/`brightness`: a queued command of the same type is replaced by the
+      newer one, so only the latest value is applied.
+    - `play`: replaces queued `play` commands and cancels an in-flight one.
+    - `stop`: drops queued `play` commands and cancels an in-flight one.
+
+    Cancelling sets the command's `cancel` event, which downloads started on its
+    behalf watch. `execute(command, cancel)` returns a result string or raises.
+    Acknowledgements (executed/failed/superseded) are collected and written as one
+    multi-path update of the commands node.
+
+    ACK_FIRST commands (`restart`) are acknowledged, journaled and flushed before
+    they run, since running them ends the process.
+
+    Pending commands older than `ttl` seconds are deleted instead of executed.
+    Acknowledged commands are recorded in the `journal` and deleted `retention`
+    seconds later, so the snapshot the listener receives on (re)connect only holds
+    recent commands.
+
+    With a `connectivity` (see connectivity.py) nothing is written while the
+    display is offline; at most MAX_PENDING_ACKS acknowledgements are held (older
+    ones are turned into deletions) and sent as one batch once it is back.
+    """
+
+    def __init__(self, execute, commands_ref, journal=None, ttl=600, retention=60,
+                 connectivity=None):
+        self.execute = execute
+        self.commands_ref = commands_ref
+        self.journal = journal
+        self.ttl = ttl
+        self.retention = retention
+        self.connectivity = connectivity
+
+        self._cond = threading.Condition()
+        self._queue = deque()          # (command_id, command, cancel)
+        self._seen = OrderedDict()     # command_id -> True, oldest first
+        self._current = None           # (command_id, command, cancel) being executed
+        self._acks = {}                # command_id -> (status, result, timestamp)
+        self._deletes = set()          # command IDs to remove from the database
+        self._received = {}            # command_id -> (type, monotonic receive time)
+        self._running = True
+
+        if journal is not None:
+            for command_id in journal.acked_ids():
+                self._remember(command_id)
+
+        self._worker = threading.Thread(target=self._work)
+        self._worker.daemon = True
+        self._worker.start()
+        self._acker = threading.Thread(target=self._ack_loop)
+        self._acker.daemon = True
+        self._acker.start()
+        if connectivity is not None:
+            connectivity.on_change(self._connectivity_changed)
+
+    def compact(self):
+        """Prune the commands node before listening to it
+
+        Lists the command IDs without their data (a shallow read) and deletes
+        those already acknowledged according to the journal and those whose push
+        ID is older than the TTL. Returns the number of commands deleted.
+        """
+        try:
+            keys = self.commands_ref.get(shallow=True) or {}
+        except Exception as e:
+            log.warn(f"Could not list commands for compaction: {e}")
+            return 0
+
+        acked = set(self.journal.acked_ids()) if self.journal is not None else set()
+        cutoff = time.time() - self.ttl
+        stale = []
+        for command_id in keys:
+            created = push_id_time(command_id)
+            if command_id in acked or (created is not None and created < cutoff):
+                stale.append(command_id)
+
+        if self.journal is not None:
+            # Journal entries for commands already gone from the database
+            self.journal.forget([cid for cid in acked if cid not in keys])
+        if stale:
+            try:
+                self.commands_ref.update({command_id: None for command_id in stale})
+            except Exception as e:
+                log.warn(f"Failed to prune old commands: {e}")
+                return 0
+            if self.journal is not None:
+                self.journal.forget(stale)
+        if self.journal is not None:
+            self.journal.save()
+        log.info(f"Commands node: {len(keys)} entries, pruned {len(stale)}")
+        return len(stale)
+
+    def submit_all(self, commands):
+        """Submit several pending commands (a listener snapshot) oldest first
+
+        The listener sends the whole node when it (re)connects; pending commands
+        created before the newest one the journal has seen acknowledged were
+        left over from an earlier run and are deleted instead of executed.
+        """
+        since = self.journal.last_timestamp if self.journal is not None else 0
+        ordered = sorted(commands.items(),
+                         key=lambda item: (command_time(item[1]) or 0, item[0]))
+        for command_id, command in ordered:
+            timestamp = command.get('timestamp')
+            if since and isinstance(timestamp, (int, float)) and timestamp < since:
+                with self._cond:
+                    if command_id in self._seen:
+                        continue
+                    self._remember(command_id)
+                    self._deletes.add(command_id)
+                    self._cond.notify_all()
+                log.info(f"Dropping command older than the last processed one: "
+                         f"{command.get('type')} ({command_id})")
+                continue
+            self.submit(command_id, command)
+
+    def submit(self, command_id, command):
+        """Accept a pending command from the listener; returns immediately"""
+        command_type = command.get('type')
+        with self._cond:
+            if command_id in self._seen:
+                log.debug(f"Ignoring duplicate command {command_id}")
+                return
+            self._remember(command_id)
+            self._received[command_id] = (command_type, time.monotonic())
+
+            created = command_time(command)
+            if self.ttl and created is not None and created < time.time() - self.ttl:
+                log.info(f"Dropping expired command: {command_type} ({command_id})")
+                self._received.pop(command_id, None)
+                self._deletes.add(command_id)
+                self._cond.notify_all()
+                return
+
+            if command_type in LATEST_WINS:
+                self._supersede(command_id, lambda c: c.get('type') == command_type)
+            elif command_type in ('play', 'stop'):
+                self._supersede(command_id, lambda c: c.get('type') == 'play')
+                if self._current and self._current[1].get('type') == 'play':
+                    log.info(f"Cancelling in-flight play {self._current[0]} for {command_type}")
+                    self._current[2].set()
+
+            self._queue.append((command_id, command, threading.Event()))
+            self._cond.notify_all()
+        log.info(f"Queued command: {command_type} ({command_id})")
+
+    def stop(self):
+        """Stop the worker (pending acknowledgements are flushed)"""
+        with self._cond:
+            self._running = False
+            if self._current:
+                self._current[2].set()
+            self._cond.notify_all()
+        self.flush_acks()
+
+    def flush_acks(self):
+        """Write collected acknowledgements and deletions now.
+
+        Returns False if the write failed.
+        """
+        with self._cond:
+            acks, self._acks = self._acks, {}
+            deletes, self._deletes = self._deletes, set()
+        if not acks and not deletes:
+            return True
+        updates = {}
+        for command_id, (status, result, _) in acks.items():
+            if command_id not in deletes:
+                updates[f"{command_id}/status"] = status
+                updates[f"{command_id}/result"] = result
+        for command_id in deletes:
+            updates[command_id] = None
+        try:
+            self.commands_ref.update(updates)
+            log.debug(f"Acknowledged {len(acks)} command(s), pruned {len(deletes)}")
+        except Exception as e:
+            if self.connectivity is not None:
+                self.connectivity.failed(e)
+            log.error(f"Failed to acknowledge commands: {e}")
+            # Keep them for the next batch unless newer acks replaced them
+            with self._cond:
+                merged = dict(acks)
+                merged.update(self._acks)
+                self._acks = merged
+                self._deletes |= deletes
+                self._bound_acks()
+            return False
+        if self.connectivity is not None:
+            self.connectivity.succeeded()
+
+        now = time.monotonic()
+        with self._cond:
+            for command_id, (status, _, _) in acks.items():
+                received = self._received.pop(command_id, None)
+                if received is not None:
+                    COMMAND_ACK_SECONDS.observe(now - received[1], type=received[0], status=status)
+
+        if self.journal is not None:
+            for command_id, (_, _, timestamp) in acks.items():
+                if command_id not in deletes:
+                    self.journal.record(command_id, timestamp)
+            self.journal.forget(deletes)
+            self.journal.save()
+        return True
+
+    def _remember(self, command_id):
+        """Record a command ID as seen (bounded)"""
+        self._seen[command_id] = True
+        while len(self._seen) > SEEN_LIMIT:
+            self._seen.popitem(last=False)
+
+    def _supersede(self, by_id, matches):
+        """Drop queued commands matching `matches`, acknowledging them as superseded"""
+        kept = deque()
+        for queued in self._queue:
+            if matches(queued[1]):
+                log.info(f"Command {queued[0]} ({queued[1].get('type')}) superseded by {by_id}")
+                self._ack(queued[0], queued[1], 'executed', f"Superseded by {by_id}")
+            else:
+                kept.append(queued)
+        self._queue = kept
+
+    def _ack(self, command_id, command, status, result):
+        """Queue an acknowledgement for the next batch (lock held by caller)"""
+        self._acks[command_id] = (status, result, command.get('timestamp'))
+        self._bound_acks()
+        self._cond.notify_all()
+
+    def _bound_acks(self):
+        """Turn the oldest held acknowledgements into deletions (lock held)"""
+        while len(self._acks) > MAX_PENDING_ACKS:
+            command_id = next(iter(self._acks))
+            del self._acks[command_id]
+            self._received.pop(command_id, None)
+            self._deletes.add(command_id)
+
+    def _offline(self):
+        return self.connectivity is not None and not self.connectivity.online
+
+    def _connectivity_changed(self, online):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _work(self):
+        """Worker thread: execute queued commands one at a time"""
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                self._current = self._queue.popleft()
+                command_id, command, cancel = self._current
+
+            command_type = command.get('type')
+            acked_first = command_type in ACK_FIRST
+            if acked_first:
+                self._ack_now(command_id, command)
+            try:
+                log.info(f"Executing command: {command_type}")
+                result = self.execute(command, cancel) or 'Command executed successfully'
+                if cancel.is_set():
+                    status, result = 'executed', 'Cancelled by a newer command'
+                else:
+                    status = 'executed'
+                log.info(f"Command {command_type} done: {result}")
+            except Exception as e:
+                log.error(f"Failed to execute command: {e}", exc_info=True)
+                status, result = 'failed', str(e)
+
+            with self._cond:
+                self._current = None
+                if not (acked_first and status == 'executed'):
+                    self._ack(command_id, command, status, result)
+
+    def _ack_now(self, command_id, command):
+        """Journal and acknowledge a command before it runs (worker thread)"""
+        if self.journal is not None:
+            self.journal.record(command_id, command.get('timestamp'))
+            self.journal.save()
+        with self._cond:
+            self._ack(command_id, command, 'executed', 'Command executed successfully')
+        # Held for the next batch if this fails; the journal still stops a replay
+        self.flush_acks()
+
+    def _ack_loop(self):
+        """Acknowledgement thread: batch acks arriving close together and prune
+        acknowledged commands once their retention has passed"""
+        while True:
+            with self._cond:
+                while self._running:
+                    if self._offline():
+                        # Woken when the display is back online
+                        self._cond.wait()
+                        continue
+                    if self._acks or self._deletes:
+                        break
+                    due_in = None
+                    if self.journal is not None:
+                        due_in = self.journal.next_due_in(self.retention)
+                    if due_in is not None and due_in <= 0:
+                        self._deletes.update(self.journal.due(self.retention))
+                        break
+                    self._cond.wait(due_in)
+                if not self._running:
+                    return
+            time.sleep(ACK_BATCH_DELAY)
+            if not self.flush_acks() and self.connectivity is None:
+                time.sleep(ACK_RETRY_DELAY)
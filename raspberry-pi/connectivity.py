@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+PanelSena Connectivity
+Online/offline state of the connection to Firebase, shared by everything that
+writes to it, with jittered exponential backoff for reconnecting
+"""
+
+import time
+import random
+import asyncio
+import threading
+import log
+import metrics
+
+ONLINE = metrics.gauge(
+    "panelsena_online", "1 while Firebase writes succeed, 0 while the display is offline")
+CONNECTION_LOSSES = metrics.counter(
+    "panelsena_connection_losses_total", "Times the connection to Firebase was lost")
+OFFLINE_SECONDS = metrics.counter(
+    "panelsena_offline_seconds_total", "Time spent offline (counted when back online)")
+
+
+class Backoff:
+    """Exponential backoff with full jitter
+
+    The n-th `next()` returns a random delay between `base * 2**n / 2` and
+    `base * 2**n` seconds, capped at `cap`, so displays that lost the network
+    together don't all come back in the same second.
+    """
+
+    def __init__(self, base=1.0, cap=300.0, rng=None):
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+        self._random = rng or random.Random()
+
+    def next(self):
+        """Delay before the next attempt"""
+        ceiling = min(self.cap, self.base * (2 ** self.attempts))
+        self.attempts += 1
+        return self._random.uniform(ceiling / 2, ceiling)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class Connectivity:
+    """Whether Firebase is reachable, as seen by the writers
+
+    Writers report each attempt with `succeeded()` or `failed(error)`. The
+    first failure marks the display offline: writers then hold their latest
+    state (see `wait_online()` and `on_change()`) instead of retrying on their
+    own, and a single `probe()` is retried on the event loop with jittered
+    backoff until it succeeds, which marks the display online again. Starts
+    online, i.e. optimistic until a write fails.
+    """
+
+    def __init__(self, loop, probe, backoff=None):
+        self.loop = loop
+        self.probe = probe
+        self.backoff = backoff or Backoff()
+        self._lock = threading.Lock()
+        self._online = threading.Event()
+        self._online.set()
+        self._offline_since = None
+        self._callbacks = []
+        self._closed = False
+        ONLINE.set(1)
+
+    @property
+    def online(self):
+        return self._online.is_set()
+
+    def on_change(self, callback):
+        """Call `callback(online)` on every change (from the reporting thread)"""
+        self._callbacks.append(callback)
+
+    def wait_online(self, timeout=None):
+        """Block until online. Returns False on timeout"""
+        return self._online.wait(timeout)
+
+    def succeeded(self):
+        """A write or read went through"""
+        with self._lock:
+            if self._online.is_set():
+                return
+            self._online.set()
+            offline_for = time.monotonic() - self._offline_since
+            self._offline_since = None
+        self.backoff.reset()
+        ONLINE.set(1)
+        OFFLINE_SECONDS.inc(offline_for)
+        log.info(f"Connection to Firebase restored after {offline_for:.0f}s offline")
+        self._notify(True)
+
+    def failed(self, error=None):
+        """A write or read failed; go offline and start probing"""
+        with self._lock:
+            if not self._online.is_set() or self._closed:
+                return
+            self._online.clear()
+            self._offline_since = time.monotonic()
+        ONLINE.set(0)
+        CONNECTION_LOSSES.inc()
+        log.warn(f"Connection to Firebase lost ({error}), holding writes until it is back")
+        self._notify(False)
+        self.loop.spawn(self._reconnect())
+
+    def close(self):
+        """Stop probing"""
+        self._closed = True
+
+    def _notify(self, online):
+        for callback in list(self._callbacks):
+            try:
+                callback(online)
+            except Exception as e:
+                log.error(f"Connectivity callback failed: {e}", exc_info=True)
+
+    async def _reconnect(self):
+        """Probe until Firebase answers again"""
+        while not self._online.is_set() and not self._closed:
+            delay = self.backoff.next()
+            log.debug(f"Offline, next connection check in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            if self._online.is_set() or self._closed:
+                return
+            try:
+                await self.loop.blocking(self.probe)
+            except Exception as e:
+                log.debug(f"Still offline: {e}")
+                continue
+            self.succeeded()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+PanelSena Content Cache
+Size-bounded, content-addressed store for downloaded media with LRU eviction
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import log
+
+INDEX_FILE = "cache_index.json"
+INDEX_VERSION = 1
+
+# Persist LRU timestamps at most this often; adds and evictions save immediately
+TOUCH_SAVE_INTERVAL = 60
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _disk_size(path):
+    """Bytes in a file, or in the files of a directory"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _remove(path):
+    """Delete a file or a directory, if it exists"""
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class ContentCache:
+    """Content cache keyed by file hash
+
+    Files are stored once per SHA-256 as `<hash><ext>` in the content directory, and
+    content IDs map onto them, so byte-identical uploads under different IDs share
+    one file. The mapping, sizes and last-use times live in a JSON index next to
+    the files, so startup never has to scan the directory.
+
+    Eviction is least-recently-used and runs before new files are added, until both
+    the byte budget and the free-disk floor are respected. Files referenced by
+    pinned content IDs (the active schedule) are never evicted.
+
+    An object can carry variants: files or directories derived from it, stored
+    as `<hash>.<key><ext>` (transcoded videos, see media.py, and rendered
+    document pages, see documents.py), or None for a key whose check found the
+    original fine. They count against the budget and go with their object.
+    `on_drop(hash)` is called for every object that leaves the cache.
+    """
+
+    def __init__(self, root, max_bytes, min_free_bytes=0, on_drop=None):
+        self.root = root
+        self.on_drop = on_drop
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self._lock = threading.RLock()
+        self._entries = {}   # content_id -> object hash
+        self._objects = {}   # hash -> {'file', 'size', 'lastUsed', 'variants'}
+        self._pinned = set()
+        self._last_save = 0
+
+        os.makedirs(root, exist_ok=True)
+        if not self._load_index():
+            self._adopt_legacy_files()
+            self._save_index()
+
+        log.info(f"Content cache: {len(self._entries)} items, "
+                 f"{self.total_bytes() / (1024 * 1024):.1f} MB of "
+                 f"{max_bytes / (1024 * 1024):.0f} MB")
+
+    def lookup(self, content_id):
+        """Return the cached file path for a content ID, or None"""
+        with self._lock:
+            content_hash = self._entries.get(content_id)
+            if content_hash is None:
+                return None
+            obj = self._objects.get(content_hash)
+            path = os.path.join(self.root, obj['file']) if obj else None
+            if path is None or not os.path.exists(path):
+                # File vanished behind our back, forget about it
+                self._drop_object(content_hash)
+                self._save_index()
+                return None
+            obj['lastUsed'] = int(time.time() * 1000)
+            if time.time() - self._last_save > TOUCH_SAVE_INTERVAL:
+                self._save_index()
+            return path
+
+    def add(self, content_id, src_path, extension):
+        """Move a downloaded file into the cache and return its cached path
+
+        If a byte-identical file is already cached, the new download is discarded
+        and the content ID points at the existing copy.
+        """
+        content_hash = hash_file(src_path)
+        with self._lock:
+            obj = self._objects.get(content_hash)
+            if obj and os.path.exists(os.path.join(self.root, obj['file'])):
+                log.info(f"{content_id} is identical to cached {obj['file']}, deduplicated")
+                os.remove(src_path)
+            else:
+                size = os.path.getsize(src_path)
+                self._make_room(size, keep={content_id})
+                obj = {'file': f"{content_hash}{extension}", 'size': size}
+                os.replace(src_path, os.path.join(self.root, obj['file']))
+                self._objects[content_hash] = obj
+
+            obj['lastUsed'] = int(time.time() * 1000)
+            self._entries[content_id] = content_hash
+            self._save_index()
+            return os.path.join(self.root, obj['file'])
+
+    def content_hash(self, content_id):
+        """SHA-256 of the cached file of a content ID, or None"""
+        with self._lock:
+            return self._entries.get(content_id)
+
+    def variants(self, content_id):
+        """Variant paths of a cached content ID by key (None: original is fine),
+        or None if it isn't cached"""
+        with self._lock:
+            obj = self._objects.get(self._entries.get(content_id))
+            if obj is None:
+                return None
+            return {key: os.path.join(self.root, variant['file']) if variant else None
+                    for key, variant in obj.get('variants', {}).items()}
+
+    def add_variant(self, content_id, key, src_path, extension=".mp4"):
+        """Move a variant file or directory of a cached item into the cache (or,
+        with `src_path` None, record that it needs none). Returns its path, or None"""
+        with self._lock:
+            content_hash = self._entries.get(content_id)
+            obj = self._objects.get(content_hash)
+            if obj is None:
+                # Evicted or replaced while the variant was being made
+                if src_path is not None:
+                    _remove(src_path)
+                return None
+            variants = obj.setdefault('variants', {})
+            self._drop_variant(variants.pop(key, None))
+            if src_path is None:
+                variants[key] = None
+                self._save_index()
+                return None
+            size = _disk_size(src_path)
+            self._make_room(size, keep={content_id})
+            variant = {'file': f"{content_hash}.{key}{extension}", 'size': size}
+            os.replace(src_path, os.path.join(self.root, variant['file']))
+            variants[key] = variant
+            self._save_index()
+            return os.path.join(self.root, variant['file'])
+
+    def reserve(self, size):
+        """Evict ahead of a download of `size` bytes"""
+        with self._lock:
+            if self._make_room(size):
+                self._save_index()
+
+    def remove(self, content_id):
+        """Forget a content ID; its file becomes eligible for eviction"""
+        with self._lock:
+            if self._entries.pop(content_id, None) is not None:
+                self._save_index()
+
+    def set_pinned(self, content_ids):
+        """Protect these content IDs (the active schedule) from eviction"""
+        with self._lock:
+            self._pinned = set(content_ids)
+
+    def total_bytes(self):
+        """Bytes currently used by cached files"""
+        with self._lock:
+            return sum(self._object_bytes(obj) for obj in self._objects.values())
+
+    def save(self):
+        """Persist the index (e.g. on shutdown)"""
+        with self._lock:
+            self._save_index()
+
+    def _make_room(self, incoming, keep=()):
+        """Evict LRU objects until `incoming` bytes fit. Returns True if any were evicted"""
+        protected = {self._entries[cid] for cid in self._pinned | set(keep) if cid in self._entries}
+        candidates = sorted(
+            (h for h in self._objects if h not in protected),
+            key=lambda h: self._objects[h].get('lastUsed', 0)
+        )
+
+        evicted = False
+        total = self.total_bytes()
+        free = shutil.disk_usage(self.root).free
+        for content_hash in candidates:
+            if total + incoming <= self.max_bytes and free - incoming >= self.min_free_bytes:
+                break
+            size = self._object_bytes(self._objects[content_hash])
+            log.info(f"Evicting cached {self._objects[content_hash]['file']} ({size} bytes)")
+            self._drop_object(content_hash)
+            total -= size
+            free += size
+            evicted = True
+
+        if total + incoming > self.max_bytes or free - incoming < self.min_free_bytes:
+            log.warn("Content cache is over budget; everything left is in the active schedule")
+        return evicted
+
+    @staticmethod
+    def _object_bytes(obj):
+        """Size of an object file and its variants"""
+        return obj['size'] + sum(v['size'] for v in obj.get('variants', {}).values() if v)
+
+    def _drop_variant(self, variant):
+        if variant:
+            _remove(os.path.join(self.root, variant['file']))
+
+    def _drop_object(self, content_hash):
+        """Delete an object file, its variants and every content ID pointing at it"""
+        obj = self._objects.pop(content_hash, None)
+        if obj:
+            try:
+                os.remove(os.path.join(self.root, obj['file']))
+            except FileNotFoundError:
+                pass
+            for variant in obj.get('variants', {}).values():
+                self._drop_variant(variant)
+            if self.on_drop is not None:
+                self.on_drop(content_hash)
+        for content_id in [cid for cid, h in self._entries.items() if h == content_hash]:
+            del self._entries[content_id]
+
+    def _load_index(self):
+        """Load the persisted index. Returns False if there is none"""
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (ValueError, OSError) as e:
+            log.warn(f"Content cache index unreadable ({e}), rebuilding")
+            return False
+
+        if index.get('version') != INDEX_VERSION:
+            return False
+        self._entries = index.get('entries', {})
+        self._objects = index.get('objects', {})
+        return True
+
+    def _save_index(self):
+        """Atomically write the index to disk"""
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'entries': self._entries,
+                'objects': self._objects,
+            }, f)
+        os.replace(tmp_path, self.index_path)
+        self._last_save = time.time()
+
+    def _adopt_legacy_files(self):
+        """One-time import of `<content_id><ext>` files cached by older players"""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith('.') or name == INDEX_FILE:
+                continue
+            content_id, extension = os.path.splitext(name)
+            if os.path.isdir(path) or '.' in content_id:
+                # A variant (`<hash>.<key><ext>`) whose index was lost; made again on demand
+                if '.' in name:
+                    _remove(path)
+                continue
+            content_hash = hash_file(path)
+            if content_hash in self._objects:
+                os.remove(path)
+            else:
+                new_name = f"{content_hash}{extension}"
+                os.replace(path, os.path.join(self.root, new_name))
+                self._objects[content_hash] = {
+                    'file': new_name,
+                    'size': os.path.getsize(os.path.join(self.root, new_name)),
+                    'lastUsed': int(os.path.getmtime(os.path.join(self.root, new_name)) * 1000),
+                }
+            self._entries[content_id] = content_hash
+        if self._entries:
+            log.info(f"Imported {len(self._entries)} previously cached files into the content cache")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+PanelSena Device Controls
+System volume, display brightness and reboot on the Raspberry Pi, and a
+virtual stand-in that only records what it was asked to do
+"""
+
+import os
+import subprocess
+import log
+
+
+class SystemControls:
+    """Apply settings to the real hardware"""
+
+    def set_volume(self, volume):
+        """Set the system mixer to `volume` percent. Returns True if a mixer took it"""
+        applied = False
+        # Preferred: PulseAudio/PipeWire
+        try:
+            result = subprocess.run(
+                ['pactl', 'set-sink-volume', '@DEFAULT_SINK@', f'{volume}%'],
+                capture_output=True, text=True, timeout=5
+            )
+            applied = result.returncode == 0
+        except (FileNotFoundError, Exception) as e:
+            log.debug(f"pactl not available: {e}")
+
+        # Fallback: ALSA
+        if not applied:
+            try:
+                result = subprocess.run(
+                    ['amixer', 'set', 'Master', f'{volume}%'],
+                    capture_output=True, text=True, timeout=5
+                )
+                applied = result.returncode == 0
+            except (FileNotFoundError, Exception) as e:
+                log.debug(f"amixer not available: {e}")
+
+        if applied:
+            log.info(f"Volume set to {volume}%")
+        else:
+            log.warn(f"Volume stored at {volume}% but no system mixer (pactl/amixer) available")
+        return applied
+
+    def set_brightness(self, brightness):
+        """Set display brightness (0-100)"""
+        # Convert 0-100 to actual brightness value
+        # For Raspberry Pi official display, brightness is controlled via /sys/class/backlight
+        brightness_path = "/sys/class/backlight/rpi_backlight/brightness"
+        max_brightness_path = "/sys/class/backlight/rpi_backlight/max_brightness"
+
+        # Check if running on Raspberry Pi with official display
+        if os.path.exists(brightness_path) and os.path.exists(max_brightness_path):
+            try:
+                # Read max brightness
+                with open(max_brightness_path, 'r') as f:
+                    max_brightness = int(f.read().strip())
+
+                # Calculate actual brightness value
+                actual_brightness = int((brightness / 100.0) * max_brightness)
+
+                # Write brightness value
+                with open(brightness_path, 'w') as f:
+                    f.write(str(actual_brightness))
+
+                log.info(f"Display brightness set to {brightness}% (value: {actual_brightness}/{max_brightness})")
+            except PermissionError:
+                log.warn(f"Permission denied to set brightness. Run with sudo or add user to video group.")
+                log.warn(f"To fix: sudo usermod -a -G video $USER")
+            except Exception as e:
+                log.error(f"Failed to set hardware brightness: {e}")
+            return
+
+        # Try alternative methods for different displays
+        # Method 1: vcgencmd (for official Raspberry Pi display)
+        try:
+            result = subprocess.run(
+                ['vcgencmd', 'display_power', '1'],
+                capture_output=True,
+                text=True,
+                timeout=5
+            )
+            if result.returncode == 0:
+                log.info(f"Display power on, brightness setting may require additional hardware support")
+        except Exception as e:
+            log.debug(f"vcgencmd not available: {e}")
+
+        # Method 2: ddcutil (for external displays with DDC/CI support)
+        try:
+            result = subprocess.run(
+                ['ddcutil', 'setvcp', '10', str(brightness)],
+                capture_output=True,
+                text=True,
+                timeout=10
+            )
+            if result.returncode == 0:
+                log.info(f"Display brightness set to {brightness}% via DDC/CI")
+            else:
+                log.warn(f"ddcutil failed: {result.stderr}")
+        except FileNotFoundError:
+            log.info(f"Brightness set to {brightness}% (hardware control not available)")
+        except Exception as e:
+            log.debug(f"ddcutil not available: {e}")
+
+    def reboot(self):
+        """Restart the Raspberry Pi"""
+        os.system('sudo reboot')
+
+
+class VirtualControls:
+    """Controls for a virtual device: remember the settings, touch nothing"""
+
+    def __init__(self):
+        self.volume = None
+        self.brightness = None
+        self.reboots = 0
+
+    def set_volume(self, volume):
+        self.volume = volume
+        return True
+
+    def set_brightness(self, brightness):
+        self.brightness = brightness
+
+    def reboot(self):
+        self.reboots += 1
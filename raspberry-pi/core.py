@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+PanelSena Event Loop
+The asyncio loop that drives the player's timers and background jobs, with a
+bounded thread pool for the calls that block (Firebase SDK, disk, subprocesses)
+"""
+
+import signal
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import log
+
+# Threads for blocking calls unless "executor_workers" says otherwise
+DEFAULT_WORKERS = 4
+
+
+class EventLoop:
+    """One asyncio loop and a bounded executor for blocking calls
+
+    `run(main)` runs the loop on the calling thread until `stop()` (or SIGINT/
+    SIGTERM when that is the main thread); `start(main)` runs it on its own
+    thread instead, e.g. for virtual devices, several of which may share one
+    loop. `spawn()`, `call_soon()`, `call_later()` and `submit()` may be used
+    from any thread. Blocking work goes through `blocking()` (awaitable) or
+    `submit()`, which never use more than `workers` threads; further calls
+    queue up.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blocking")
+        self._stop = None               # asyncio.Event, created on the loop
+        self._stop_requested = False
+        self._thread = None
+        self._closed = False
+
+    # Running
+
+    def run(self, main=None):
+        """Run the loop on this thread until stop(). Re-raises main's exception"""
+        asyncio.set_event_loop(self.loop)
+        signals = []
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                self.loop.add_signal_handler(sig, self._on_signal, sig)
+                signals.append(sig)
+        try:
+            self.loop.run_until_complete(self._main(main))
+        finally:
+            for sig in signals:
+                self.loop.remove_signal_handler(sig)
+            self._cancel_all()
+
+    def start(self, main=None):
+        """Run the loop on a daemon thread. Returns a Future for `main`"""
+        future = self.spawn(main) if main is not None else None
+        if self._thread is None and not self.loop.is_running():
+            self._thread = threading.Thread(target=self.run, name="event-loop")
+            self._thread.daemon = True
+            self._thread.start()
+        return future
+
+    def stop(self):
+        """Make run() return (from any thread)"""
+        self._stop_requested = True
+        if self._stop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stop.set)
+
+    def close(self, timeout=5):
+        """Stop the loop and release the executor"""
+        if self._closed:
+            return
+        self._closed = True
+        self.stop()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self.executor.shutdown(wait=False)
+        if not self.loop.is_running():
+            self.loop.close()
+
+    async def _main(self, main):
+        self._stop = asyncio.Event()
+        if self._stop_requested:
+            if main is not None:
+                main.close()
+            return
+        stop = asyncio.ensure_future(self._stop.wait())
+        if main is not None:
+            task = asyncio.ensure_future(main)
+            await asyncio.wait([task, stop], return_when=asyncio.FIRST_COMPLETED)
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is not None:
+                stop.cancel()
+                raise task.exception()
+        await stop
+
+    def _on_signal(self, sig):
+        log.info(f"Received {signal.Signals(sig).name}, shutting down...")
+        self.stop()
+
+    def _cancel_all(self):
+        """Cancel what is left on the loop and let it unwind (as asyncio.run does)"""
+        tasks = [t for t in asyncio.all_tasks(self.loop) if not t.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+    # Scheduling
+
+    def spawn(self, coro):
+        """Run a coroutine on the loop (from any thread). Returns a Future"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def call_soon(self, callback, *args):
+        """Call `callback(*args)` on the loop (from any thread)"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        """Call `callback(*args)` on the loop after `delay` seconds (from any thread)"""
+        self.loop.call_soon_threadsafe(self.loop.call_later, max(0.0, delay), callback, *args)
+
+    async def blocking(self, fn, *args):
+        """Await `fn(*args)` run on the executor"""
+        return await self.loop.run_in_executor(self.executor, fn, *args)
+
+    def submit(self, fn, *args):
+        """Run `fn(*args)` on the executor in the background. Returns a Future"""
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None and not isinstance(error, asyncio.CancelledError):
+            log.error(f"Background job failed: {error}")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+PanelSena Documents
+PDF content rendered once with pdftoppm into one image per page at the
+display's resolution, cached next to the PDF and shown as a timed sequence
+"""
+
+import os
+import re
+import time
+import shutil
+import threading
+import subprocess
+import log
+import metrics
+
+# Pages rendered per document unless "document_max_pages" says otherwise
+DEFAULT_MAX_PAGES = 50
+
+RASTERIZE_SECONDS = metrics.histogram(
+    "panelsena_document_render_seconds", "Time to render all pages of a document",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+
+class DocumentError(Exception):
+    """A document could not be rendered"""
+
+
+def _page_number(name):
+    match = re.search(r'(\d+)\.png$', name)
+    return int(match.group(1)) if match else 0
+
+
+class DocumentRenderer:
+    """Page images for cached PDFs, rendered on first use and kept in the content cache
+
+    Pages are rendered at the screen height (wider pages are letterboxed by
+    the image renderer) into a directory stored as a variant of the PDF, so
+    they are evicted with it and survive restarts. Rendering happens when the
+    document is fetched, normally by the prefetcher, never while it plays.
+    """
+
+    def __init__(self, content_cache, work_dir, screen, max_pages=DEFAULT_MAX_PAGES, timeout=300):
+        self.content_cache = content_cache
+        self.work_dir = work_dir
+        self.screen = screen
+        self.max_pages = max_pages
+        self.timeout = timeout
+        self.available = bool(shutil.which('pdftoppm'))
+        self._lock = threading.Lock()
+        if not self.available:
+            log.info("pdftoppm not found, documents can't be shown (install poppler-utils)")
+        self._cleanup_partials()
+
+    @property
+    def key(self):
+        """Identifies page sets rendered for this screen, e.g. "pages-1920x1080" """
+        return f"pages-{self.screen[0]}x{self.screen[1]}"
+
+    def pages(self, content_id, pdf_path):
+        """Paths of the page images of a cached PDF, in order. Raises DocumentError"""
+        pages = self._cached(content_id)
+        if pages:
+            return pages
+        # One document at a time: pdftoppm is CPU-heavy and playback must keep up
+        with self._lock:
+            pages = self._cached(content_id)
+            if pages:
+                return pages
+            return self._render(content_id, pdf_path)
+
+    def _cached(self, content_id):
+        pages_dir = (self.content_cache.variants(content_id) or {}).get(self.key)
+        if not pages_dir or not os.path.isdir(pages_dir):
+            return None
+        return self._list(pages_dir)
+
+    @staticmethod
+    def _list(pages_dir):
+        names = sorted((n for n in os.listdir(pages_dir) if n.endswith('.png')), key=_page_number)
+        return [os.path.join(pages_dir, name) for name in names]
+
+    def _render(self, content_id, pdf_path):
+        if not self.available:
+            raise DocumentError("pdftoppm is not installed (poppler-utils)")
+        partial = os.path.join(self.work_dir, f"{content_id}.{self.key}.render")
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+        command = ['nice', '-n', '10', 'pdftoppm', '-png', '-l', str(self.max_pages),
+                   '-scale-to-x', '-1', '-scale-to-y', str(self.screen[1]),
+                   pdf_path, os.path.join(partial, 'page')]
+        log.info(f"Rendering document {content_id} at {self.screen[1]}px high")
+        started = time.monotonic()
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=self.timeout)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise DocumentError(f"pdftoppm failed: {e}")
+        pages = self._list(partial)
+        if result.returncode != 0 or not pages:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise DocumentError(f"pdftoppm exited with {result.returncode}: "
+                                f"{result.stderr.strip()[-500:]}")
+        elapsed = time.monotonic() - started
+        RASTERIZE_SECONDS.observe(elapsed)
+        log.info(f"Rendered {len(pages)} pages of {content_id} in {elapsed:.1f}s")
+
+        pages_dir = self.content_cache.add_variant(content_id, self.key, partial, extension="")
+        if pages_dir is None:
+            raise DocumentError(f"{content_id} left the cache while it was being rendered")
+        return self._list(pages_dir)
+
+    def _cleanup_partials(self):
+        """Remove renders interrupted by a previous shutdown"""
+        try:
+            names = os.listdir(self.work_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith('.render'):
+                shutil.rmtree(os.path.join(self.work_dir, name), ignore_errors=True)
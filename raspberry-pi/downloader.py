@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+"""
+PanelSena Content Downloader
+Atomic, resumable downloads from URLs and Firebase Storage with integrity checks,
+a shared connection pool and parallel byte-range segments for large files
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import log
+import metrics
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+PART_SUFFIX = ".part"
+META_SUFFIX = ".part.json"  # sidecar: <dest>.part.json
+
+# Partial downloads nobody resumed for this long are deleted
+STALE_PART_AGE = 7 * 24 * 3600
+
+# Defaults, overridable from config.json (see PanelSenaPlayer)
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_PARALLELISM = 4
+DEFAULT_PARALLEL_MIN_SIZE = 32 * 1024 * 1024
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+
+# Blob segments are fetched in pieces of this size so progress can be saved
+BLOB_PIECE_SIZE = 8 * 1024 * 1024
+
+# Segment progress is written to the sidecar every this many bytes
+PROGRESS_SAVE_BYTES = 8 * 1024 * 1024
+
+# Number of recent downloads kept for throughput reporting
+STATS_HISTORY = 20
+
+
+DOWNLOAD_BYTES = metrics.counter(
+    "panelsena_download_bytes_total", "Bytes transferred by completed downloads")
+DOWNLOAD_SECONDS = metrics.histogram(
+    "panelsena_download_seconds", "Duration of completed downloads",
+    buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+DOWNLOAD_THROUGHPUT = metrics.histogram(
+    "panelsena_download_throughput_mbps", "Throughput of completed downloads in Mbit/s",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+DOWNLOAD_FAILURES = metrics.counter(
+    "panelsena_download_failures_total", "Downloads that failed or were cancelled",
+    labels=("reason",))
+
+
+class DownloadError(Exception):
+    """A download failed or produced a file that didn't verify"""
+
+
+class DownloadCancelled(DownloadError):
+    """A download was cancelled; its partial file is kept for resuming"""
+
+
+def is_url(storage_path):
+    """Whether a content storage path is a full HTTP(S) URL"""
+    return storage_path.startswith('http://') or storage_path.startswith('https://')
+
+
+def blob_path_from_url(url):
+    """Extract the object path from a Firebase Storage download URL, if it is one"""
+    # https://firebasestorage.googleapis.com/v0/b/<bucket>/o/<url-encoded path>?alt=media&token=...
+    parsed = urlparse(url)
+    marker = '/o/'
+    if 'firebasestorage' not in parsed.netloc or marker not in parsed.path:
+        return None
+    return unquote(parsed.path.split(marker, 1)[1])
+
+
+class Downloader:
+    """Download content into place atomically
+
+    Data is written to `<dest>.part` and only renamed to `dest` after its size and
+    MD5 (or CRC32C for composite objects) match the storage metadata. An interrupted
+    download leaves the `.part` file behind and the next attempt resumes it with
+    byte-range requests. A small `.part.json` sidecar remembers the ETag/generation
+    (and segment progress), so a part of an object that has since been replaced is
+    discarded instead of being resumed.
+
+    All HTTP traffic goes through one pooled `requests.Session`, so connections and
+    TLS sessions are reused between files. Files of at least `parallel_min_size`
+    bytes are split into `parallelism` byte-range segments fetched concurrently.
+    """
+
+    def __init__(self, storage_bucket, chunk_size=DEFAULT_CHUNK_SIZE,
+                 parallelism=DEFAULT_PARALLELISM, parallel_min_size=DEFAULT_PARALLEL_MIN_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        self.storage_bucket = storage_bucket
+        self.chunk_size = chunk_size
+        self.parallelism = max(1, parallelism)
+        self.parallel_min_size = parallel_min_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        # One pool for every download; retries cover connection setup and 5xx
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(4, self.parallelism * 2),
+            max_retries=Retry(total=3, backoff_factor=0.5,
+                              status_forcelist=(429, 500, 502, 503, 504))
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.last_stats = None
+        self.history = deque(maxlen=STATS_HISTORY)
+        self._stats_lock = threading.Lock()
+
+    def download(self, storage_path, dest_path, storage_ref=None, cancel=None):
+        """Download `storage_path` (URL or blob path) to `dest_path`
+
+        `storage_ref` is the blob path of a URL's object, used to look up the
+        expected checksums. Setting the `cancel` event stops the transfer with
+        DownloadCancelled. Raises DownloadError on failure.
+        """
+        part_path = dest_path + PART_SUFFIX
+        started = time.time()
+        counter = _ByteCounter(cancel)
+        try:
+            if is_url(storage_path):
+                blob = self._get_blob(storage_ref or blob_path_from_url(storage_path))
+                expected = self._blob_metadata(blob)
+                header_expected, segments = self._fetch_url(storage_path, part_path, expected, counter)
+                expected = expected or header_expected
+            else:
+                if self.storage_bucket is None:
+                    raise DownloadError(f"Storage not connected, cannot download {storage_path}")
+                blob = self.storage_bucket.get_blob(storage_path)
+                if blob is None:
+                    raise DownloadError(f"Object not found in storage: {storage_path}")
+                expected = self._blob_metadata(blob)
+                segments = self._fetch_blob(blob, part_path, counter)
+
+            self.verify(part_path, expected)
+        except DownloadCancelled:
+            DOWNLOAD_FAILURES.inc(reason='cancelled')
+            raise
+        except DownloadError:
+            DOWNLOAD_FAILURES.inc(reason='error')
+            raise
+        except Exception as e:
+            DOWNLOAD_FAILURES.inc(reason='error')
+            raise DownloadError(f"Download failed: {e}") from e
+
+        counter.check()
+        os.replace(part_path, dest_path)
+        self._remove(self._meta_path(part_path))
+        self._record_stats(dest_path, counter.total, time.time() - started, segments)
+        return dest_path
+
+    def verify(self, path, expected):
+        """Check a file against {'size', 'md5', 'crc32c'}; delete it on mismatch"""
+        if not expected:
+            log.warn(f"No storage metadata for {path}, skipping integrity check")
+            return
+
+        size = os.path.getsize(path)
+        problem = None
+        if expected.get('size') is not None and size != expected['size']:
+            problem = f"size {size} != expected {expected['size']}"
+        elif expected.get('md5'):
+            actual = self._digest(path, hashlib.md5())
+            if actual != expected['md5']:
+                problem = "MD5 mismatch"
+        elif expected.get('crc32c') and google_crc32c is not None:
+            actual = self._digest(path, google_crc32c.Checksum())
+            if actual != expected['crc32c']:
+                problem = "CRC32C mismatch"
+
+        if problem:
+            self._remove(path)
+            self._remove(self._meta_path(path))
+            raise DownloadError(f"Integrity check failed for {os.path.basename(path)}: {problem}")
+        log.debug(f"Verified {path} ({size} bytes)")
+
+    def throughput_summary(self):
+        """Median throughput over recent downloads, for tuning chunk/parallelism per site"""
+        with self._stats_lock:
+            rates = sorted(s['mbps'] for s in self.history if s['bytes'] > 0)
+        if not rates:
+            return None
+        return {'downloads': len(rates), 'medianMbps': rates[len(rates) // 2]}
+
+    def cleanup_stale_parts(self, directory, max_age=STALE_PART_AGE):
+        """Delete partial downloads that haven't been touched for `max_age` seconds"""
+        now = time.time()
+        for name in os.listdir(directory):
+            if not (name.endswith(PART_SUFFIX) or name.endswith(META_SUFFIX)):
+                continue
+            path = os.path.join(directory, name)
+            if now - os.path.getmtime(path) > max_age:
+                log.info(f"Removing stale partial download: {name}")
+                self._remove(path)
+
+    def close(self):
+        """Close pooled connections"""
+        self.session.close()
+
+    def _fetch_url(self, url, part_path, expected, counter):
+        """Download a URL into `part_path`, in parallel segments when worthwhile.
+
+        Returns (checksums advertised by the server, number of segments).
+        """
+        meta = self._load_meta(part_path)
+        resuming = os.path.exists(part_path)
+
+        # A segmented part can only be finished segmented; a plain one only plainly
+        if not resuming or meta.get('segments'):
+            probe = self._probe_url(url)
+            size = (expected or {}).get('size') or (probe or {}).get('size')
+            if probe and size and self._should_split(size):
+                segments = self._fetch_segmented(
+                    part_path, size, probe['etag'],
+                    lambda f, start, end, progress: self._read_url_range(
+                        url, probe['etag'], f, start, end, progress),
+                    counter
+                )
+                return probe['expected'], segments
+
+        if meta.get('segments'):
+            # Can't finish a segmented part without range support; start over
+            self._remove(part_path)
+        return self._fetch_url_stream(url, part_path, counter), 1
+
+    def _fetch_url_stream(self, url, part_path, counter):
+        """Stream a URL into `part_path`, resuming from its current size"""
+        meta = self._load_meta(part_path)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        headers = {}
+        if offset > 0:
+            headers['Range'] = f"bytes={offset}-"
+            if meta.get('etag'):
+                # If the object changed, the server answers 200 with the new file
+                headers['If-Range'] = meta['etag']
+
+        response = self.session.get(url, stream=True, headers=headers, timeout=self.timeout)
+        try:
+            if response.status_code == 416 and offset > 0:
+                # Range starts at/after the end: the part is already complete
+                log.info(f"Partial download already complete: {part_path}")
+                return self._header_metadata(response, None)
+
+            response.raise_for_status()
+            if response.status_code == 206:
+                log.info(f"Resuming download at byte {offset}")
+                mode = 'ab'
+            else:
+                if offset > 0:
+                    log.info("Server ignored range request, restarting download")
+                offset = 0
+                mode = 'wb'
+
+            self._save_meta(part_path, {'etag': response.headers.get('ETag')})
+            with open(part_path, mode, buffering=self.chunk_size) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    counter.add(len(chunk))
+
+            return self._header_metadata(response, offset)
+        finally:
+            response.close()
+
+    def _probe_url(self, url):
+        """Ask for the first byte to learn size, ETag and range support"""
+        try:
+            response = self.session.get(url, headers={'Range': 'bytes=0-0'},
+                                        timeout=self.timeout)
+        except requests.RequestException as e:
+            log.debug(f"Range probe failed: {e}")
+            return None
+        try:
+            if response.status_code != 206:
+                return None
+            expected = self._header_metadata(response, None) or {}
+            if not expected.get('size'):
+                return None
+            return {
+                'size': expected['size'],
+                'etag': response.headers.get('ETag'),
+                'expected': expected,
+            }
+        finally:
+            response.close()
+
+    def _read_url_range(self, url, etag, f, start, end, progress):
+        """Fetch bytes start..end (inclusive) of a URL into `f` at its current position"""
+        headers = {'Range': f"bytes={start}-{end}"}
+        with self.session.get(url, stream=True, headers=headers, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise DownloadError("Server stopped honouring range requests")
+            if etag and response.headers.get('ETag') not in (None, etag):
+                raise DownloadError("Object changed during download")
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                f.write(chunk)
+                progress(len(chunk))
+
+    def _fetch_blob(self, blob, part_path, counter):
+        """Download a storage blob into `part_path`. Returns the number of segments"""
+        meta = self._load_meta(part_path)
+        resuming = os.path.exists(part_path)
+
+        if blob.size and self._should_split(blob.size) and (not resuming or meta.get('segments')):
+            def read_range(f, start, end, progress):
+                # Pieces keep resume granularity (and saved progress) bounded
+                for piece_start in range(start, end + 1, BLOB_PIECE_SIZE):
+                    piece_end = min(piece_start + BLOB_PIECE_SIZE - 1, end)
+                    blob.download_to_file(f, start=piece_start, end=piece_end,
+                                          raw_download=True, checksum=None)
+                    progress(piece_end - piece_start + 1)
+
+            return self._fetch_segmented(part_path, blob.size, blob.generation, read_range, counter)
+
+        self._fetch_blob_stream(blob, part_path, counter)
+        return 1
+
+    def _fetch_blob_stream(self, blob, part_path, counter):
+        """Download a storage blob into `part_path`, resuming from its current size"""
+        meta = self._load_meta(part_path)
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        if offset > 0 and meta.get('generation') != blob.generation:
+            log.info("Stored object changed since the partial download, restarting")
+            offset = 0
+
+        if blob.size is not None and offset >= blob.size:
+            return
+
+        self._save_meta(part_path, {'generation': blob.generation})
+        with open(part_path, 'ab' if offset > 0 else 'wb', buffering=self.chunk_size) as f:
+            if offset > 0:
+                log.info(f"Resuming download at byte {offset}")
+            # Checksums are verified over the whole file afterwards, which also
+            # covers resumed ranges the client library can't validate itself
+            if blob.size is None:
+                blob.download_to_file(f, start=offset or None, raw_download=True, checksum=None)
+                return
+            # Fetch in pieces so a cancel doesn't have to wait for the whole file
+            for piece_start in range(offset, blob.size, BLOB_PIECE_SIZE):
+                counter.check()
+                piece_end = min(piece_start + BLOB_PIECE_SIZE, blob.size) - 1
+                blob.download_to_file(f, start=piece_start, end=piece_end,
+                                      raw_download=True, checksum=None)
+                counter.add(piece_end - piece_start + 1)
+
+    def _should_split(self, size):
+        """Whether a file is big enough to download in parallel segments"""
+        return self.parallelism > 1 and size >= self.parallel_min_size
+
+    def _fetch_segmented(self, part_path, size, identity, read_range, counter):
+        """Download `size` bytes as parallel byte-range segments into `part_path`
+
+        `read_range(f, start, end, progress)` writes bytes start..end (inclusive)
+        into `f` at its current position, calling `progress(n)` as data arrives.
+        Segment progress is kept in the sidecar so an interrupted download resumes
+        each segment where it stopped. Returns the number of segments.
+        """
+        meta = self._load_meta(part_path)
+        if (os.path.exists(part_path) and meta.get('segments')
+                and meta.get('size') == size and meta.get('identity') == identity):
+            done = sum(seg[2] for seg in meta['segments'])
+            log.info(f"Resuming segmented download ({done}/{size} bytes done)")
+        else:
+            segment_size = -(-size // self.parallelism)
+            meta = {
+                'size': size,
+                'identity': identity,
+                # [start, end (inclusive), bytes done]
+                'segments': [[start, min(start + segment_size, size) - 1, 0]
+                             for start in range(0, size, segment_size)],
+            }
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+        self._save_meta(part_path, meta)
+
+        lock = threading.Lock()
+        failed = threading.Event()
+        unsaved = [0]
+        files = set()   # Open segment files
+
+        def save_progress():
+            """Persist segment offsets once the bytes they count are on disk (lock held)"""
+            for f in files:
+                f.flush()
+            self._sync(part_path)
+            self._save_meta(part_path, meta)
+
+        def fetch_segment(segment):
+            start, end, _ = segment
+
+            def progress(n):
+                if failed.is_set():
+                    raise _SegmentAborted()
+                with lock:
+                    segment[2] += n
+                    unsaved[0] += n
+                    if unsaved[0] >= PROGRESS_SAVE_BYTES:
+                        unsaved[0] = 0
+                        save_progress()
+                counter.add(n)  # raises DownloadCancelled when cancelled
+
+            with open(part_path, 'r+b', buffering=self.chunk_size) as f:
+                f.seek(start + segment[2])
+                with lock:
+                    files.add(f)
+                try:
+                    read_range(f, start + segment[2], end, progress)
+                except _SegmentAborted:
+                    raise
+                except Exception:
+                    failed.set()
+                    raise
+                finally:
+                    with lock:
+                        files.discard(f)
+
+        pending = [seg for seg in meta['segments'] if seg[0] + seg[2] <= seg[1]]
+        log.info(f"Downloading {size} bytes in {len(meta['segments'])} segments "
+                 f"({len(pending)} remaining)")
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            futures = [pool.submit(fetch_segment, seg) for seg in pending]
+        with lock:
+            save_progress()
+
+        # Report the segment that failed first, not the ones it aborted
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        errors = [e for e in errors if not isinstance(e, _SegmentAborted)] or errors
+        if errors:
+            raise errors[0]
+        return len(meta['segments'])
+
+    def _record_stats(self, dest_path, transferred, elapsed, segments):
+        """Log and remember throughput of a finished download"""
+        elapsed = max(elapsed, 0.001)
+        stats = {
+            'file': os.path.basename(dest_path),
+            'bytes': transferred,
+            'seconds': round(elapsed, 2),
+            'mbps': round(transferred * 8 / elapsed / 1000000, 1),
+            'segments': segments,
+            'chunkSize': self.chunk_size,
+            'parallelism': self.parallelism,
+            'completedAt': int(time.time() * 1000),
+        }
+        with self._stats_lock:
+            self.last_stats = stats
+            self.history.append(stats)
+        DOWNLOAD_BYTES.inc(transferred)
+        DOWNLOAD_SECONDS.observe(elapsed)
+        DOWNLOAD_THROUGHPUT.observe(stats['mbps'])
+        log.info(f"Downloaded {transferred / (1024 * 1024):.1f} MB in {stats['seconds']} s "
+                 f"({stats['mbps']} Mbit/s, {segments} segment{'s' if segments != 1 else ''})")
+
+    def _get_blob(self, blob_path):
+        """Fetch a blob with its metadata, or None"""
+        if not blob_path or self.storage_bucket is None:
+            return None
+        try:
+            return self.storage_bucket.get_blob(blob_path)
+        except Exception as e:
+            log.warn(f"Could not read storage metadata for {blob_path}: {e}")
+            return None
+
+    def _blob_metadata(self, blob):
+        """Expected size and checksums from blob metadata"""
+        if blob is None:
+            return None
+        return {
+            'size': blob.size,
+            'md5': blob.md5_hash,
+            'crc32c': blob.crc32c,
+        }
+
+    def _header_metadata(self, response, offset):
+        """Expected size and checksums from response headers"""
+        expected = {}
+        # x-goog-hash: crc32c=AAAAAA==,md5=BBBBBBBBBBBBBBBBBBBBBB==
+        for part in response.headers.get('x-goog-hash', '').split(','):
+            name, _, value = part.strip().partition('=')
+            if name in ('md5', 'crc32c') and value:
+                expected[name] = value
+
+        content_range = response.headers.get('Content-Range', '')
+        if '/' in content_range and not content_range.endswith('/*'):
+            expected['size'] = int(content_range.rsplit('/', 1)[1])
+        elif (offset is not None and response.headers.get('Content-Length')
+              and not response.headers.get('Content-Encoding')):
+            expected['size'] = offset + int(response.headers['Content-Length'])
+        return expected or None
+
+    def _digest(self, path, hasher):
+        """Base64 digest of a file, as used in storage metadata"""
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+        return base64.b64encode(hasher.digest()).decode('ascii')
+
+    def _meta_path(self, part_path):
+        """Sidecar path of a partial download"""
+        return part_path[:-len(PART_SUFFIX)] + META_SUFFIX
+
+    def _load_meta(self, part_path):
+        """Read the sidecar of a partial download"""
+        try:
+            with open(self._meta_path(part_path), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self, part_path, meta):
+        """Write the sidecar of a partial download"""
+        with open(self._meta_path(part_path), 'w') as f:
+            json.dump(meta, f)
+
+    def _sync(self, path):
+        """Force a file's written data to disk"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _remove(self, path):
+        """Delete a file if it exists"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class _SegmentAborted(Exception):
+    """Raised in segment workers once another segment has failed"""
+
+
+class _ByteCounter:
+    """Thread-safe running byte total that also carries the cancel event"""
+
+    def __init__(self, cancel=None):
+        self.total = 0
+        self.cancel = cancel
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        self.check()
+        with self._lock:
+            self.total += n
+
+    def check(self):
+        """Raise DownloadCancelled if the download was cancelled"""
+        if self.cancel is not None and self.cancel.is_set():
+            raise DownloadCancelled("Download cancelled")
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+PanelSena Playback Engines
+Media playback backends for the player: a persistent in-process libVLC engine
+and the legacy one-`vlc`-process-per-item fallback (still images have their
+own renderer in slideshow.py)
+"""
+
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from supervisor import PlaybackSupervisor, EVENT_STARTED, EVENT_ENDED
+import log
+import metrics
+
+# python-vlc, imported by the first LibVLCEngine (loading libVLC takes a while)
+vlc = None
+
+ENGINE_LIBVLC = "libvlc"
+ENGINE_SUBPROCESS = "subprocess"
+ENGINE_IMAGE = "image"
+
+TRANSITION_GAP_SECONDS = metrics.histogram(
+    "panelsena_transition_gap_seconds",
+    "Time from the end of one item to the start of the next",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+
+class PlaybackEngine:
+    """Base class for playback engines
+
+    Engines report end of media through the `on_end(error)` callback, which always
+    runs on the engine's single supervisor thread. Every call to play() or stop()
+    starts a new generation, so end notifications that belong to a previous item
+    are dropped instead of advancing the queue twice. `on_end` runs with the engine
+    lock held, so a play() from another thread waits for the end handler instead
+    of racing it.
+
+    The time from the end of one item to the start of the next is recorded in
+    `transition_gaps` (milliseconds, most recent last). `on_start()`, if given, is
+    called on the supervisor thread once an item is actually playing.
+    """
+
+    name = None
+    supports_pause = False
+
+    def __init__(self, on_end=None, on_start=None):
+        self.on_end = on_end
+        self.on_start = on_start
+        self._generation = 0
+        self._ended_generation = None
+        self._ended_at = None
+        self._lock = threading.RLock()
+        self.transition_gaps = deque(maxlen=100)
+        self.supervisor = PlaybackSupervisor(self._handle_event)
+
+    def play(self, file_path):
+        """Start playing a file, replacing whatever is playing now"""
+        raise NotImplementedError
+
+    def stop(self):
+        """Stop playback"""
+        raise NotImplementedError
+
+    def pause(self, paused):
+        """Pause or resume playback. Returns False if not supported"""
+        return False
+
+    def set_volume(self, volume):
+        """Set engine volume (0-100)"""
+
+    def close(self):
+        """Release engine resources"""
+        self.stop()
+        self.supervisor.close()
+
+    @property
+    def last_gap_ms(self):
+        """Most recent transition gap in milliseconds, or None"""
+        return self.transition_gaps[-1] if self.transition_gaps else None
+
+    def _begin(self):
+        """Start a new generation (engine lock held). Returns it"""
+        self._generation += 1
+        return self._generation
+
+    def _confirm_end(self, generation):
+        """Whether an end event for the current generation is genuine"""
+        return True
+
+    def _handle_event(self, kind, generation, error, at):
+        """Supervisor callback: record transition gaps and report end of media"""
+        with self._lock:
+            if generation != self._generation:
+                return
+            if kind == EVENT_STARTED:
+                if self._ended_at is not None:
+                    gap = at - self._ended_at
+                    gap_ms = int(gap * 1000)
+                    self._ended_at = None
+                    self.transition_gaps.append(gap_ms)
+                    TRANSITION_GAP_SECONDS.observe(gap)
+                    log.info(f"Transition gap: {gap_ms} ms")
+                if self.on_start is not None:
+                    self.on_start()
+                return
+
+            # Both an end and an error event can arrive for the same item
+            if generation == self._ended_generation or not self._confirm_end(generation):
+                return
+            self._ended_generation = generation
+            self._ended_at = at
+            if self.on_end is not None:
+                self.on_end(error)
+
+
+class LibVLCEngine(PlaybackEngine):
+    """Single long-lived libVLC instance and media player, media swapped in place"""
+
+    name = ENGINE_LIBVLC
+    supports_pause = True
+
+    def __init__(self, on_end=None, on_start=None):
+        global vlc
+        if vlc is None:
+            try:
+                import vlc as vlc_module
+            except (ImportError, OSError) as e:
+                raise RuntimeError(f"python-vlc is not installed ({e})")
+            vlc = vlc_module
+        super().__init__(on_end, on_start)
+
+        # Detect if running in a desktop environment
+        display = os.environ.get('DISPLAY', '')
+        if display:
+            # Running in X11 desktop environment
+            log.info(f"Detected X11 display: {display}")
+            # Let VLC create its own window - simpler and more reliable
+            self.instance = vlc.Instance(
+                '--no-video-title-show',
+                '--video-on-top',
+                '--fullscreen',
+                '--mouse-hide-timeout=0'
+            )
+        else:
+            # Headless or console mode
+            log.info("No X11 display detected, using default output")
+            self.instance = vlc.Instance('--no-video-title-show', '--fullscreen')
+
+        if self.instance is None:
+            self.supervisor.close()
+            raise RuntimeError("Failed to create libVLC instance")
+
+        self.player = self.instance.media_player_new()
+        self.player.set_fullscreen(True)
+        self.current_media = None
+
+        events = self.player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerPlaying, self._on_vlc_event,
+                            (EVENT_STARTED, None))
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, self._on_vlc_event,
+                            (EVENT_ENDED, None))
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError, self._on_vlc_event,
+                            (EVENT_ENDED, "libVLC playback error"))
+
+    def _on_vlc_event(self, event, kind_error):
+        """libVLC event callback (runs on a libVLC thread)"""
+        # Calling back into the media player from its own event thread can deadlock,
+        # so only hand the event to the supervisor here
+        kind, error = kind_error
+        self.supervisor.post(kind, self._generation, error)
+
+    def _confirm_end(self, generation):
+        """Check the player really is finished"""
+        # An end event racing with a skip can carry the new generation; the player
+        # state tells us whether the new media is already opening
+        state = self.player.get_state()
+        return state in (vlc.State.Ended, vlc.State.Error, vlc.State.Stopped)
+
+    def play(self, file_path):
+        media = self.instance.media_new(os.path.abspath(file_path))
+        with self._lock:
+            self._begin()
+            self.player.set_media(media)
+            if self.player.play() == -1:
+                media.release()
+                log.error(f"libVLC failed to start playback of {file_path}")
+                return False
+            if self.current_media is not None:
+                self.current_media.release()
+            self.current_media = media
+        log.info(f"libVLC playing: {file_path}")
+        return True
+
+    def stop(self):
+        with self._lock:
+            self._begin()
+            self._ended_at = None
+            self.player.stop()
+
+    def pause(self, paused):
+        self.player.set_pause(1 if paused else 0)
+        return True
+
+    def set_volume(self, volume):
+        self.player.audio_set_volume(int(volume))
+
+    def close(self):
+        super().close()
+        if self.current_media is not None:
+            self.current_media.release()
+            self.current_media = None
+        self.player.release()
+        self.instance.release()
+
+
+class SubprocessEngine(PlaybackEngine):
+    """Launch a fresh `vlc` process per item and watch it for exit"""
+
+    name = ENGINE_SUBPROCESS
+
+    def __init__(self, on_end=None, on_start=None):
+        super().__init__(on_end, on_start)
+        self.vlc_process = None
+
+    def _terminate(self):
+        """Terminate the current VLC process, if any"""
+        if self.vlc_process:
+            try:
+                self.vlc_process.terminate()
+                self.vlc_process.wait(timeout=2)
+            except:
+                try:
+                    self.vlc_process.kill()
+                except:
+                    pass
+            self.vlc_process = None
+
+    def play(self, file_path):
+        with self._lock:
+            generation = self._begin()
+
+            # Stop any current playback
+            self._terminate()
+
+            # Launch VLC as subprocess with fullscreen
+            vlc_command = [
+                'vlc',
+                '--fullscreen',
+                '--no-video-title-show',
+                '--play-and-exit',
+                '--no-qt-privacy-ask',
+                '--no-qt-system-tray',
+                '--mouse-hide-timeout=0',
+                os.path.abspath(file_path)
+            ]
+
+            log.debug(f"Launching VLC with command: {' '.join(vlc_command)}")
+
+            try:
+                self.vlc_process = subprocess.Popen(
+                    vlc_command,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+            except OSError as e:
+                log.error(f"Failed to launch VLC: {e}")
+                return False
+
+            # An early exit (e.g. unplayable file) arrives as an end event with an
+            # error, so there is no need to sleep here waiting for one
+            self.supervisor.watch(self.vlc_process, generation)
+            self.supervisor.post(EVENT_STARTED, generation)
+            log.info(f"VLC process started (PID: {self.vlc_process.pid})")
+        return True
+
+    def stop(self):
+        with self._lock:
+            self._begin()
+            self._ended_at = None
+            self._terminate()
+
+
+def create_engine(name, on_end=None, on_start=None, **options):
+    """Create the configured playback engine, falling back to subprocess mode.
+
+    ENGINE_IMAGE creates the still image renderer instead, or returns None when
+    it is unavailable (images then go through the video engine).
+    """
+    if name == ENGINE_IMAGE:
+        try:
+            from slideshow import ImageRenderer
+            return ImageRenderer(on_end, on_start, **options)
+        except Exception as e:
+            log.warn(f"Image renderer unavailable ({e}), images will play through VLC")
+            return None
+    if name == ENGINE_LIBVLC:
+        try:
+            return LibVLCEngine(on_end, on_start)
+        except Exception as e:
+            log.warn(f"libVLC engine unavailable ({e}), falling back to subprocess mode")
+    elif name != ENGINE_SUBPROCESS:
+        log.warn(f"Unknown playback engine '{name}', using subprocess mode")
+    return SubprocessEngine(on_end, on_start)
@@ -32,6 +32,11 @@ sudo apt-get install -y \
     libvlc-dev \
     python3 \
     python3-pip \
+    python3-tk \
+    python3-pil \
+    python3-pil.imagetk \
+    ffmpeg \
+    poppler-utils \
     git \
     unclutter
 
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+PanelSena Logging
+Leveled logging to the console with an in-memory ring buffer of recent lines,
+and batched, rate-limited upload of important lines to the Realtime Database
+"""
+
+import time
+import threading
+import traceback
+from collections import deque
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+OFF = 100
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARN: 'WARN', ERROR: 'ERROR'}
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warn': WARN, 'warning': WARN, 'error': ERROR, 'off': OFF}
+
+# Longest message kept in the buffer or uploaded
+MAX_MESSAGE_LENGTH = 2000
+
+
+def parse_level(value, default=INFO):
+    """Level from a config value such as "debug" or "warn" """
+    if isinstance(value, int):
+        return value
+    return LEVELS.get(str(value).lower(), default)
+
+
+class Logger:
+    """Console logger keeping the last `buffer_size` lines in memory
+
+    Lines below `level` are dropped without formatting cost beyond the caller's
+    f-string. Output keeps the `[LEVEL] message` format used throughout the player.
+    """
+
+    def __init__(self, level=INFO, buffer_size=500):
+        self.level = level
+        self.buffer = deque(maxlen=buffer_size)
+        self.uploader = None
+        self._lock = threading.Lock()
+
+    def configure(self, level=None, buffer_size=None):
+        """Change the console level and/or ring buffer size"""
+        with self._lock:
+            if level is not None:
+                self.level = parse_level(level)
+            if buffer_size is not None and buffer_size != self.buffer.maxlen:
+                self.buffer = deque(self.buffer, maxlen=max(1, int(buffer_size)))
+
+    def log(self, level, message, exc_info=False):
+        """Log `message` at `level`; `exc_info` appends the current traceback"""
+        uploader = self.uploader
+        if level < self.level and (uploader is None or level < uploader.level):
+            return
+        if exc_info:
+            message = f"{message}\n{traceback.format_exc().rstrip()}"
+        entry = {'t': int(time.time() * 1000), 'level': LEVEL_NAMES.get(level, str(level)),
+                 'msg': str(message)[:MAX_MESSAGE_LENGTH]}
+
+        if level >= self.level:
+            with self._lock:
+                self.buffer.append(entry)
+                print(f"[{entry['level']}] {message}")
+        if uploader is not None and level >= uploader.level:
+            uploader.add(entry)
+
+    def recent(self, count=None):
+        """Most recent buffered entries, oldest first"""
+        with self._lock:
+            entries = list(self.buffer)
+        return entries if count is None else entries[-count:]
+
+
+class LogUploader:
+    """Ship log entries at or above `level` to an RTDB node in batches
+
+    Entries are collected and pushed as one child per batch,
+    `{timestamp, entries: [{t, level, msg}], dropped}`, at most once every
+    `interval` seconds (sooner, but not more than every `min_interval` seconds,
+    when an error is waiting). A batch carries at most `max_batch` entries; while
+    the device is offline at most `max_pending` are held and older ones are
+    counted as dropped. Only the newest `keep` batches are kept in the database.
+    """
+
+    def __init__(self, logs_ref, level=WARN, interval=60, min_interval=5,
+                 max_batch=200, max_pending=1000, keep=100):
+        self.logs_ref = logs_ref
+        self.level = level
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_batch = max_batch
+        self.keep = keep
+        self.uploaded = 0
+
+        self._cond = threading.Condition()
+        self._pending = deque(maxlen=max_pending)
+        self._dropped = 0
+        self._urgent = False
+        self._running = True
+        self._last_upload = time.monotonic()
+        self._batches_since_prune = keep
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, entry):
+        """Queue an entry for the next batch"""
+        with self._cond:
+            if len(self._pending) == self._pending.maxlen:
+                self._dropped += 1
+            self._pending.append(entry)
+            if entry['level'] == LEVEL_NAMES[ERROR]:
+                self._urgent = True
+                self._cond.notify_all()
+            elif len(self._pending) == 1:
+                # The uploader sleeps without a timeout while nothing is pending
+                self._cond.notify_all()
+
+    def close(self, timeout=None):
+        """Upload what is pending and stop"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _take_batch(self):
+        """Remove the next batch from the pending entries (lock held)"""
+        count = min(len(self._pending), self.max_batch)
+        entries = [self._pending.popleft() for _ in range(count)]
+        dropped, self._dropped = self._dropped, 0
+        self._urgent = any(e['level'] == LEVEL_NAMES[ERROR] for e in self._pending)
+        return entries, dropped
+
+    def _upload(self, entries, dropped):
+        """Push one batch. Returns False on failure"""
+        batch = {'timestamp': int(time.time() * 1000), 'entries': entries}
+        if dropped:
+            batch['dropped'] = dropped
+        try:
+            self.logs_ref.push(batch)
+        except Exception as e:
+            # Not through the logger: this would queue yet another line to upload
+            print(f"[WARN] Log upload failed: {e}")
+            return False
+        self.uploaded += len(entries)
+        self._batches_since_prune += 1
+        if self._batches_since_prune >= max(1, self.keep // 10):
+            self._prune()
+        return True
+
+    def _prune(self):
+        """Delete all but the newest `keep` batches"""
+        self._batches_since_prune = 0
+        try:
+            keys = sorted(self.logs_ref.get(shallow=True) or {})
+            stale = keys[:-self.keep] if len(keys) > self.keep else []
+            if stale:
+                self.logs_ref.update({key: None for key in stale})
+        except Exception as e:
+            print(f"[WARN] Failed to prune uploaded logs: {e}")
+
+    def _run(self):
+        """Uploader thread"""
+        while True:
+            with self._cond:
+                while True:
+                    since = time.monotonic() - self._last_upload
+                    wait = self.min_interval if self._urgent else self.interval
+                    if not self._running or (self._pending and since >= wait):
+                        break
+                    self._cond.wait(max(0.1, wait - since) if self._pending else None)
+                if not self._pending and not self._running:
+                    return
+                entries, dropped = self._take_batch()
+                self._last_upload = time.monotonic()
+
+            if not self._upload(entries, dropped):
+                with self._cond:
+                    if not self._running:
+                        return
+                    # Put the batch back in front for the next attempt
+                    for entry in reversed(entries):
+                        if len(self._pending) == self._pending.maxlen:
+                            dropped += 1
+                        else:
+                            self._pending.appendleft(entry)
+                    self._dropped += dropped
+
+
+_logger = Logger()
+
+
+def configure(level=None, buffer_size=None):
+    """Set the console level ("debug", "info", "warn", "error") and buffer size"""
+    _logger.configure(level, buffer_size)
+
+
+def start_upload(logs_ref, level=WARN, **options):
+    """Start uploading entries at or above `level` to `logs_ref`"""
+    stop_upload()
+    level = parse_level(level, WARN)
+    if level >= OFF:
+        return None
+    uploader = LogUploader(logs_ref, level=level, **options)
+    # Lines logged before the upload started (e.g. while offline) go first
+    for entry in _logger.recent():
+        if parse_level(entry['level'].lower()) >= level:
+            uploader.add(entry)
+    _logger.uploader = uploader
+    return uploader
+
+
+def stop_upload(timeout=None):
+    """Upload pending entries and stop uploading"""
+    uploader, _logger.uploader = _logger.uploader, None
+    if uploader is not None:
+        uploader.close(timeout)
+
+
+def recent(count=None):
+    """Most recent log entries held in memory"""
+    return _logger.recent(count)
+
+
+def debug(message):
+    """Log a line at DEBUG level"""
+    _logger.log(DEBUG, message)
+
+
+def info(message):
+    """Log a line at INFO level"""
+    _logger.log(INFO, message)
+
+
+def warn(message, exc_info=False):
+    """Log a line at WARN level"""
+    _logger.log(WARN, message, exc_info)
+
+
+def error(message, exc_info=False):
+    """Log a line at ERROR level"""
+    _logger.log(ERROR, message, exc_info)
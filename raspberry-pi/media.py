@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+PanelSena Media Normalization
+Probes downloaded videos with ffprobe and, when this board can't decode one in
+hardware, transcodes it once with ffmpeg into a cached variant sized for the
+display
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import log
+import metrics
+
+# Screen size when neither the config nor the framebuffer says otherwise
+DEFAULT_SCREEN = (1920, 1080)
+
+# Video decoding each board does in hardware (or, for H.264 on the Pi 5, fast
+# enough in software): codec -> (max width, max height, max fps, bit depths)
+DECODE_LIMITS = {
+    'pi5': {'hevc': (4096, 2160, 60, (8, 10)), 'h264': (1920, 1080, 60, (8,))},
+    'pi4': {'hevc': (4096, 2160, 60, (8, 10)), 'h264': (1920, 1080, 60, (8,))},
+    'pi3': {'h264': (1920, 1080, 30, (8,))},
+}
+
+# Everything recorded about a file (see media_index.py)
+MEDIA_FIELDS = ('container', 'duration', 'size', 'video_codec', 'video_profile', 'width',
+                'height', 'fps', 'pix_fmt', 'bit_depth', 'audio_codec', 'audio_channels')
+
+# File signatures: (bytes, offset, container) for when ffprobe isn't installed
+MAGIC = (
+    (b'ftyp', 4, 'mp4'),
+    (b'\x1a\x45\xdf\xa3', 0, 'matroska'),
+    (b'\xff\xd8\xff', 0, 'jpeg'),
+    (b'\x89PNG', 0, 'png'),
+    (b'GIF8', 0, 'gif'),
+    (b'WEBP', 8, 'webp'),
+    (b'%PDF', 0, 'pdf'),
+)
+IMAGE_CONTAINERS = ('jpeg', 'png', 'gif', 'webp')
+
+# Extensions by container, as sniffed or as named by ffprobe
+CONTAINER_EXTENSIONS = {
+    'mp4': '.mp4', 'mov,mp4,m4a,3gp,3g2,mj2': '.mp4',
+    'matroska': '.mkv', 'matroska,webm': '.mkv',
+    'avi': '.avi', 'mpegts': '.ts',
+    'jpeg': '.jpg', 'jpeg_pipe': '.jpg', 'png': '.png', 'png_pipe': '.png',
+    'gif': '.gif', 'webp': '.webp', 'webp_pipe': '.webp',
+    'pdf': '.pdf',
+}
+
+# Chroma subsampling the decoders take (4:2:2 and 4:4:4 need software decoding)
+DECODABLE_PIXEL_FORMATS = ('yuv420p', 'yuvj420p', 'nv12', 'yuv420p10le', 'yuv420p10be')
+
+TRANSCODES = metrics.counter(
+    "panelsena_transcodes_total", "Videos transcoded into a hardware-decodable variant",
+    labels=("result",))
+TRANSCODE_SECONDS = metrics.histogram(
+    "panelsena_transcode_seconds", "Time to transcode one video",
+    buckets=(10, 30, 60, 120, 300, 600, 1200, 3600))
+
+
+class MediaError(Exception):
+    """Probing or transcoding a file failed"""
+
+
+def screen_size(config):
+    """Display resolution from "display_resolution" (e.g. "1920x1080") or the framebuffer"""
+    configured = config.get("display_resolution")
+    if configured:
+        try:
+            width, height = (int(n) for n in str(configured).lower().split('x'))
+            return width, height
+        except ValueError:
+            log.warn(f"Ignoring invalid display_resolution '{configured}'")
+    try:
+        with open('/sys/class/graphics/fb0/virtual_size') as f:
+            width, height = (int(n) for n in f.read().strip().split(','))
+        if width > 0 and height > 0:
+            return width, height
+    except (OSError, ValueError):
+        pass
+    return DEFAULT_SCREEN
+
+
+def board_model():
+    """'pi5', 'pi4' or 'pi3' (anything older or unknown is treated as a Pi 3)"""
+    try:
+        with open('/proc/device-tree/model') as f:
+            model = f.read()
+    except OSError:
+        return 'pi3'
+    for board in ('pi5', 'pi4'):
+        if f"Raspberry Pi {board[-1]}" in model or f"Compute Module {board[-1]}" in model:
+            return board
+    return 'pi3'
+
+
+def _frame_rate(value):
+    """ffprobe's "30000/1001" as a number, or None"""
+    try:
+        num, _, den = str(value).partition('/')
+        rate = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+def probe(path, timeout=30):
+    """Describe a media file with ffprobe. Returns a dict of MEDIA_FIELDS
+
+    Only the first video and audio streams are described; fields a file
+    doesn't have are None. Raises MediaError.
+    """
+    command = ['ffprobe', '-v', 'error', '-print_format', 'json',
+               '-show_format', '-show_streams', path]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise MediaError(f"ffprobe failed on {path}: {e}")
+    if result.returncode != 0:
+        raise MediaError(f"ffprobe failed on {path}: {result.stderr.strip()}")
+    try:
+        data = json.loads(result.stdout)
+    except ValueError as e:
+        raise MediaError(f"Unreadable ffprobe output for {path}: {e}")
+
+    fmt = data.get('format', {})
+    info = dict.fromkeys(MEDIA_FIELDS)
+    info['container'] = fmt.get('format_name')
+    info['duration'] = float(fmt['duration']) if fmt.get('duration') else None
+    info['size'] = int(fmt['size']) if fmt.get('size') else os.path.getsize(path)
+    for stream in data.get('streams', []):
+        kind = stream.get('codec_type')
+        if kind == 'video' and info['video_codec'] is None:
+            # Cover art in audio files is a one-frame "video" stream
+            if stream.get('disposition', {}).get('attached_pic'):
+                continue
+            pix_fmt = stream.get('pix_fmt') or ''
+            depth = stream.get('bits_per_raw_sample')
+            info.update({
+                'video_codec': stream.get('codec_name'),
+                'video_profile': stream.get('profile'),
+                'width': stream.get('width'),
+                'height': stream.get('height'),
+                'fps': _frame_rate(stream.get('avg_frame_rate')) or _frame_rate(stream.get('r_frame_rate')),
+                'pix_fmt': pix_fmt,
+                'bit_depth': int(depth) if str(depth).isdigit() else (10 if 'p10' in pix_fmt else 8),
+            })
+        elif kind == 'audio' and info['audio_codec'] is None:
+            info['audio_codec'] = stream.get('codec_name')
+            info['audio_channels'] = stream.get('channels')
+    return info
+
+
+def sniff(path):
+    """Container of a file from its first bytes ('mp4', 'jpeg', 'pdf', ...), or None"""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(16)
+    except OSError:
+        return None
+    for magic, offset, container in MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            return container
+    return None
+
+
+def describe(path):
+    """MEDIA_FIELDS of a file: from ffprobe when installed, otherwise just the
+    size, the sniffed container and, for images, the dimensions"""
+    if shutil.which('ffprobe'):
+        try:
+            return probe(path)
+        except MediaError as e:
+            log.warn(f"{e}")
+    info = dict.fromkeys(MEDIA_FIELDS)
+    info['size'] = os.path.getsize(path)
+    info['container'] = sniff(path)
+    if info['container'] in IMAGE_CONTAINERS:
+        try:
+            from PIL import Image
+            with Image.open(path) as image:
+                info['width'], info['height'] = image.size
+        except Exception as e:
+            log.debug(f"Image size of {path} unknown: {e}")
+    return info
+
+
+def extension_for(container):
+    """File extension for a probed or sniffed container, or None"""
+    return CONTAINER_EXTENSIONS.get(container)
+
+
+class DeviceProfile:
+    """What this board decodes in hardware, and the screen it plays on"""
+
+    def __init__(self, board, screen):
+        self.board = board
+        self.screen = screen
+        self.limits = DECODE_LIMITS[board]
+
+    @classmethod
+    def detect(cls, config):
+        """Profile of this board, or of the one named by "decode_profile" """
+        board = config.get("decode_profile")
+        if board not in DECODE_LIMITS:
+            if board:
+                log.warn(f"Unknown decode_profile '{board}', detecting the board instead")
+            board = board_model()
+        return cls(board, screen_size(config))
+
+    @property
+    def key(self):
+        """Identifies variants made for this profile, e.g. "pi4-1920x1080" """
+        return f"{self.board}-{self.screen[0]}x{self.screen[1]}"
+
+    def unsupported(self, info):
+        """Why a probed file can't be decoded in hardware here (empty if it can)"""
+        codec = info.get('video_codec')
+        if codec is None:
+            return []
+        limits = self.limits.get(codec)
+        if limits is None:
+            return [f"{codec} has no hardware decoder on {self.board}"]
+        max_width, max_height, max_fps, depths = limits
+        reasons = []
+        if info['pix_fmt'] and info['pix_fmt'] not in DECODABLE_PIXEL_FORMATS:
+            reasons.append(f"pixel format {info['pix_fmt']}")
+        if info['bit_depth'] and info['bit_depth'] not in depths:
+            reasons.append(f"{info['bit_depth']}-bit {codec}")
+        # Portrait videos are checked against the rotated limits
+        long_side = max(info['width'] or 0, info['height'] or 0)
+        short_side = min(info['width'] or 0, info['height'] or 0)
+        if long_side > max(max_width, max_height) or short_side > min(max_width, max_height):
+            reasons.append(f"{info['width']}x{info['height']}")
+        if info['fps'] and info['fps'] > max_fps + 0.5:
+            reasons.append(f"{info['fps']:.0f} fps")
+        return reasons
+
+    def target(self, info):
+        """(width, height, fps) of the H.264 variant for a probed file"""
+        max_width, max_height, max_fps, _ = self.limits['h264']
+        width, height = info['width'], info['height']
+        box_width, box_height = min(self.screen[0], max_width), min(self.screen[1], max_height)
+        if height > width:
+            box_width, box_height = box_height, box_width
+        scale = min(1.0, box_width / width, box_height / height)
+        # H.264 wants even dimensions
+        width = max(2, int(width * scale) // 2 * 2)
+        height = max(2, int(height * scale) // 2 * 2)
+        fps = info['fps'] if info['fps'] and info['fps'] <= max_fps + 0.5 else max_fps
+        return width, height, fps
+
+
+def transcode_command(src, dst, width, height, fps, encoder="libx264"):
+    """ffmpeg arguments for an H.264/AAC MP4 of `src` at the given size and rate"""
+    command = ['nice', '-n', '19', 'ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+               '-y', '-i', src, '-map', '0:v:0', '-map', '0:a:0?',
+               '-vf', f"scale={width}:{height},fps={fps:g},format=yuv420p",
+               '-c:v', encoder]
+    if encoder == 'libx264':
+        command += ['-preset', 'veryfast', '-crf', '20', '-profile:v', 'high',
+                    '-level', '4.2' if fps > 30 else '4.1']
+    else:
+        # Hardware encoders take a bitrate rather than a quality
+        command += ['-b:v', '10M' if height > 720 else '5M']
+    command += ['-c:a', 'aac', '-b:a', '160k', '-movflags', '+faststart', '-f', 'mp4', dst]
+    return command
+
+
+class Normalizer:
+    """Makes downloaded videos playable in hardware, one at a time in the background
+
+    `check()` is called for every fetched item and is cheap after the first
+    time: the outcome for this DeviceProfile (a variant, or "the original is
+    fine") is recorded in the content cache, so each file is checked and, if
+    needed, transcoded once. Probe results come from the `media_index` when
+    given (see media_index.py). The original keeps playing until its variant is
+    ready; `best()` then returns the variant. Does nothing without ffmpeg.
+    """
+
+    def __init__(self, content_cache, work_dir, profile, encoder="libx264", enabled=True,
+                 media_index=None):
+        self.content_cache = content_cache
+        self.media_index = media_index
+        self.work_dir = work_dir
+        self.profile = profile
+        self.encoder = encoder
+        self.available = bool(enabled and shutil.which('ffprobe') and shutil.which('ffmpeg'))
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._process = None
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcode")
+        if enabled and not self.available:
+            log.info("ffmpeg not found, videos are played as uploaded")
+        self._cleanup_partials()
+
+    def check(self, content_id, path, content_type):
+        """Queue a fetched item for probing unless this profile has already seen it"""
+        if not self.available or content_type != 'video':
+            return
+        variants = self.content_cache.variants(content_id)
+        if variants is None or self.profile.key in variants:
+            return
+        with self._lock:
+            if content_id in self._queued or not self._running:
+                return
+            self._queued.add(content_id)
+        self._executor.submit(self._normalize, content_id, path)
+
+    def best(self, content_id, path):
+        """The variant of a cached item for this display if there is one, else `path`"""
+        variants = self.content_cache.variants(content_id) or {}
+        return variants.get(self.profile.key) or path
+
+    def close(self):
+        """Abandon queued work and stop a transcode in progress"""
+        with self._lock:
+            self._running = False
+            process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+        self._executor.shutdown(wait=False)
+
+    def _normalize(self, content_id, path):
+        try:
+            if not self._running:
+                return
+            key = self.profile.key
+            info = self.media_index.get(content_id) if self.media_index is not None else None
+            if info is None or info.get('video_codec') is None:
+                info = probe(path)
+            reasons = self.profile.unsupported(info)
+            if not reasons:
+                log.debug(f"{content_id} plays as uploaded on {key}")
+                self.content_cache.add_variant(content_id, key, None)
+                return
+
+            width, height, fps = self.profile.target(info)
+            log.info(f"Transcoding {content_id} to {width}x{height} H.264 at {fps:g} fps "
+                     f"({', '.join(reasons)})")
+            partial = os.path.join(self.work_dir, f"{content_id}.{key}.transcode.mp4")
+            self.content_cache.reserve(info['size'])
+            started = time.monotonic()
+            self._transcode(path, partial, width, height, fps)
+            TRANSCODE_SECONDS.observe(time.monotonic() - started)
+            TRANSCODES.inc(result='ok')
+            log.info(f"Transcoded {content_id} in {time.monotonic() - started:.0f}s")
+            self.content_cache.add_variant(content_id, key, partial)
+        except MediaError as e:
+            if not self._running:
+                return
+            TRANSCODES.inc(result='failed')
+            log.warn(f"Could not normalize {content_id}, playing it as uploaded: {e}")
+            # Don't retry on every play; a new upload gets a new cache entry
+            self.content_cache.add_variant(content_id, self.profile.key, None)
+        except Exception as e:
+            log.error(f"Normalizing {content_id} failed: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._queued.discard(content_id)
+
+    def _transcode(self, src, dst, width, height, fps):
+        command = transcode_command(src, dst, width, height, fps, self.encoder)
+        log.debug(f"Running: {' '.join(command)}")
+        try:
+            with self._lock:
+                if not self._running:
+                    raise MediaError("player is shutting down")
+                self._process = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                                                 stderr=subprocess.PIPE, text=True)
+            _, errors = self._process.communicate()
+            returncode = self._process.returncode
+        except OSError as e:
+            raise MediaError(f"ffmpeg failed to start: {e}")
+        finally:
+            with self._lock:
+                self._process = None
+        if returncode != 0:
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+            if not self._running:
+                raise MediaError("transcode interrupted by shutdown")
+            raise MediaError(f"ffmpeg exited with {returncode}: {errors.strip()[-500:]}")
+
+    def _cleanup_partials(self):
+        """Remove transcodes interrupted by a previous shutdown"""
+        try:
+            names = os.listdir(self.work_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith('.transcode.mp4'):
+                try:
+                    os.remove(os.path.join(self.work_dir, name))
+                except OSError:
+                    pass
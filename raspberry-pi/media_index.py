@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+PanelSena Media Index
+What is known about each cached file (duration, container, codecs, size,
+dimensions and checksum), probed once at download time and kept in SQLite
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from media import MEDIA_FIELDS
+import log
+
+# Bumped when the table layout changes; an index of another version is rebuilt
+SCHEMA_VERSION = 1
+
+COLUMN_TYPES = {
+    'container': 'TEXT', 'duration': 'REAL', 'size': 'INTEGER', 'video_codec': 'TEXT',
+    'video_profile': 'TEXT', 'width': 'INTEGER', 'height': 'INTEGER', 'fps': 'REAL',
+    'pix_fmt': 'TEXT', 'bit_depth': 'INTEGER', 'audio_codec': 'TEXT', 'audio_channels': 'INTEGER',
+}
+
+
+class MediaIndex:
+    """Probed media facts by content ID
+
+    Rows are keyed by the file's SHA-256, the checksum the content cache
+    stores files under, and content IDs map onto them, so a file shared by
+    several content IDs is described once. The whole index is read into memory
+    when opened: get() is a dict lookup, and only writes touch the database.
+    If the database is unusable the index carries on in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._media = {}     # hash -> {MEDIA_FIELDS..., 'hash', 'probedAt'}
+        self._content = {}   # content_id -> hash
+        self._db = None
+        try:
+            self._db = self._open()
+        except sqlite3.DatabaseError as e:
+            log.warn(f"Media index unreadable ({e}), rebuilding")
+            try:
+                os.remove(path)
+                self._db = self._open()
+            except (OSError, sqlite3.DatabaseError) as e:
+                log.error(f"Media index unavailable, keeping it in memory only: {e}")
+        log.info(f"Media index: {len(self._media)} files, {len(self._content)} content items")
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        if db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            db.execute("DROP TABLE IF EXISTS media")
+            db.execute("DROP TABLE IF EXISTS content")
+        columns = ", ".join(f"{name} {COLUMN_TYPES[name]}" for name in MEDIA_FIELDS)
+        db.execute(f"CREATE TABLE IF NOT EXISTS media "
+                   f"(hash TEXT PRIMARY KEY, {columns}, probed_at INTEGER)")
+        db.execute("CREATE TABLE IF NOT EXISTS content (content_id TEXT PRIMARY KEY, hash TEXT)")
+        db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        for row in db.execute(f"SELECT hash, {', '.join(MEDIA_FIELDS)}, probed_at FROM media"):
+            entry = dict(zip(MEDIA_FIELDS, row[1:-1]))
+            entry['hash'] = row[0]
+            entry['probedAt'] = row[-1]
+            self._media[row[0]] = entry
+        self._content = {cid: h for cid, h in db.execute("SELECT content_id, hash FROM content")
+                         if h in self._media}
+        return db
+
+    def get(self, content_id):
+        """What is known about the file of a content ID, or None"""
+        with self._lock:
+            entry = self._media.get(self._content.get(content_id))
+            return dict(entry) if entry is not None else None
+
+    def has(self, content_id, content_hash):
+        """Whether `content_id` is indexed and points at this file"""
+        with self._lock:
+            return content_hash is not None and self._content.get(content_id) == content_hash
+
+    def link(self, content_id, content_hash):
+        """Point a content ID at an already described file. Returns False if it isn't"""
+        with self._lock:
+            if content_hash not in self._media:
+                return False
+            self._content[content_id] = content_hash
+            self._execute("INSERT OR REPLACE INTO content (content_id, hash) VALUES (?, ?)",
+                          (content_id, content_hash))
+            return True
+
+    def record(self, content_id, content_hash, info):
+        """Store the description of a file (see media.describe) under its hash"""
+        if content_hash is None:
+            return
+        entry = {name: info.get(name) for name in MEDIA_FIELDS}
+        entry['hash'] = content_hash
+        entry['probedAt'] = int(time.time() * 1000)
+        with self._lock:
+            self._media[content_hash] = entry
+            self._content[content_id] = content_hash
+            self._execute(
+                f"INSERT OR REPLACE INTO media (hash, {', '.join(MEDIA_FIELDS)}, probed_at) "
+                f"VALUES ({', '.join('?' * (len(MEDIA_FIELDS) + 2))})",
+                (content_hash, *(entry[name] for name in MEDIA_FIELDS), entry['probedAt']))
+            self._execute("INSERT OR REPLACE INTO content (content_id, hash) VALUES (?, ?)",
+                          (content_id, content_hash))
+
+    def forget(self, content_hash):
+        """Drop a file that left the cache, and the content IDs pointing at it"""
+        with self._lock:
+            if self._media.pop(content_hash, None) is None:
+                return
+            for content_id in [cid for cid, h in self._content.items() if h == content_hash]:
+                del self._content[content_id]
+            self._execute("DELETE FROM media WHERE hash = ?", (content_hash,))
+            self._execute("DELETE FROM content WHERE hash = ?", (content_hash,))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _execute(self, sql, params):
+        """Write through to the database (lock held); failures only cost persistence"""
+        if self._db is None:
+            return
+        try:
+            self._db.execute(sql, params)
+        except sqlite3.Error as e:
+            log.warn(f"Media index write failed: {e}")
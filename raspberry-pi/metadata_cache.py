@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+PanelSena Content Metadata Cache
+Batched Firestore lookups of content documents, cached in memory and on disk
+"""
+
+import os
+import json
+import threading
+import log
+
+# Only the fields the player uses are cached
+CACHED_FIELDS = ('name', 'type', 'url', 'storageRef', 'sizeBytes', 'updatedAt', 'duration')
+
+
+class ContentMetadataCache:
+    """Cache of `content/{id}` documents keyed by content ID
+
+    `refresh(ids)` resolves a whole schedule with a single batched `get_all` and
+    reports which items changed (different `updatedAt`) since they were cached.
+    Everything else reads from memory, so looping a schedule makes no Firestore
+    reads. The cache is saved to disk so it survives restarts and can serve
+    metadata while Firestore is unreachable (`firestore_db` may also be None
+    until the player has connected).
+    """
+
+    def __init__(self, firestore_db, path):
+        self.firestore_db = firestore_db
+        self.path = path
+        self._lock = threading.Lock()
+        self._docs = self._load()
+
+    def get(self, content_id):
+        """Return cached metadata for a content ID, fetching it if unknown.
+
+        Returns None if the document does not exist.
+        """
+        with self._lock:
+            doc = self._docs.get(content_id)
+        if doc is not None:
+            return doc
+        self.refresh([content_id])
+        with self._lock:
+            return self._docs.get(content_id)
+
+    def refresh(self, content_ids):
+        """Fetch these documents in one batch. Returns the IDs whose content changed
+
+        A content ID counts as changed when its `updatedAt` differs from the cached
+        one, or when the document was deleted. On network errors the cached
+        metadata is kept and nothing is reported as changed.
+        """
+        content_ids = list(dict.fromkeys(content_ids))
+        if not content_ids or self.firestore_db is None:
+            # Nothing to do, or not connected yet: serve the cached copy
+            return []
+
+        collection = self.firestore_db.collection('content')
+        try:
+            snapshots = list(self.firestore_db.get_all(
+                [collection.document(cid) for cid in content_ids]
+            ))
+        except Exception as e:
+            log.warn(f"Could not refresh content metadata, using cached copy: {e}")
+            return []
+
+        changed = []
+        with self._lock:
+            for snapshot in snapshots:
+                old = self._docs.get(snapshot.id)
+                if not snapshot.exists:
+                    if self._docs.pop(snapshot.id, None) is not None:
+                        changed.append(snapshot.id)
+                    continue
+
+                data = snapshot.to_dict()
+                doc = {field: data.get(field) for field in CACHED_FIELDS if data.get(field) is not None}
+                if 'updatedAt' in doc:
+                    doc['updatedAt'] = str(doc['updatedAt'])
+                if old is not None and old.get('updatedAt') != doc.get('updatedAt'):
+                    changed.append(snapshot.id)
+                self._docs[snapshot.id] = doc
+            self._save()
+
+        log.info(f"Resolved {len(snapshots)} content documents in one batch"
+                 + (f", changed: {changed}" if changed else ""))
+        return changed
+
+    def _load(self):
+        """Load the on-disk cache"""
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warn(f"Content metadata cache unreadable ({e}), starting empty")
+            return {}
+
+    def _save(self):
+        """Atomically write the on-disk cache"""
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._docs, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warn(f"Failed to save content metadata cache: {e}")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+PanelSena Metrics
+Counters, gauges and histograms for player internals, served in the Prometheus
+text format from an optional local HTTP endpoint
+"""
+
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import log
+from startup import process_uptime
+
+# Default buckets for latencies in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values, extra=None):
+    """Render `{name="value",...}`"""
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, v in pairs)
+    return "{" + ",".join(f'{n}="{v}"' for (n, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named metric with optional label names"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """Label values in declaration order"""
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self):
+        """Lines of the text exposition format"""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing value"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labels:
+            values = {(): 0}
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Gauge(Metric):
+    """Value that goes up and down, set directly or read from `function()` at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                log.debug(f"Metric {self.name} unavailable: {e}")
+                return []
+            return [] if value is None else [f"{self.name} {_format_value(value)}"]
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class FunctionCounter(Gauge):
+    """Counter whose value is read from `function()` at scrape time"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, function):
+        super().__init__(name, help, function=function)
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}   # key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = {key: list(data) for key, data in self._values.items()}
+        lines = []
+        for key, data in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = ('le', _format_value(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {data[-1]}")
+        return lines
+
+
+class Registry:
+    """Set of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric; registering the same name again returns the existing one"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """The whole registry in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=()):
+    """Create (or get) a counter in the default registry"""
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def gauge(name, help, labels=(), function=None):
+    """Create (or get) a gauge in the default registry"""
+    return REGISTRY.register(Gauge(name, help, labels, function))
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    """Create (or get) a histogram in the default registry"""
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def _resident_memory_bytes():
+    """RSS of this process from /proc"""
+    with open('/proc/self/statm', 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _cpu_seconds():
+    times = os.times()
+    return round(times.user + times.system, 3)
+
+
+# Standard process metrics, read when scraped
+_PROCESS_START = time.time() - process_uptime()
+REGISTRY.register(FunctionCounter("process_cpu_seconds_total",
+                                  "Total user and system CPU time in seconds", _cpu_seconds))
+gauge("process_resident_memory_bytes", "Resident memory size in bytes",
+      function=_resident_memory_bytes)
+gauge("process_start_time_seconds", "Start time of the process since the epoch in seconds",
+      function=lambda: int(_PROCESS_START))
+gauge("process_threads", "Number of threads in this process", function=threading.active_count)
+
+
+class MetricsServer:
+    """Serve `GET /metrics` from the registry on a background thread"""
+
+    def __init__(self, port, host="0.0.0.0", registry=REGISTRY):
+        registry_ = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry_.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug(f"Metrics request from {self.client_address[0]}: {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        log.info(f"Metrics available at http://{host}:{self.server.server_port}/metrics")
+
+    def close(self):
+        """Stop serving"""
+        self.server.shutdown()
+        self.server.server_close()
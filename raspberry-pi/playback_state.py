@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+PanelSena Playback State
+Local snapshot of what the display is playing, so it can resume straight from
+the content cache after a reboot or power cut, before Firebase is reachable
+"""
+
+import os
+import json
+import time
+import threading
+import log
+
+STATE_VERSION = 1
+
+
+class PlaybackState:
+    """Small JSON file holding the active schedule, queue position and settings
+
+    The snapshot is a dict with `userId`, `displayId`, `schedule` ({id, name} or
+    None), `contentQueue`, `currentIndex`, `contentId` (a single item played
+    without a schedule), `volume` and `brightness`. Content metadata is not
+    duplicated here; it is persisted by the content metadata cache.
+
+    `save()` only touches the disk when the snapshot changed, so calling it on
+    every status update costs nothing while the display is idle.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._saved = None
+
+    def load(self):
+        """Return the saved snapshot, or None"""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warn(f"Playback state unreadable ({e}), ignoring it")
+            return None
+        if not isinstance(data, dict) or data.get('version') != STATE_VERSION:
+            return None
+        snapshot = data.get('snapshot')
+        with self._lock:
+            self._saved = snapshot
+        return snapshot
+
+    def save(self, snapshot):
+        """Atomically write the snapshot if it changed"""
+        with self._lock:
+            if snapshot == self._saved:
+                return
+            data = {'version': STATE_VERSION, 'savedAt': int(time.time() * 1000),
+                    'snapshot': snapshot}
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f)
+                    f.flush()
+                    # Survive a power cut right after the write
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self._saved = snapshot
+            except OSError as e:
+                log.warn(f"Failed to save playback state: {e}")
@@ -8,23 +8,75 @@ import os
 import sys
 import time
 import json
-import subprocess
+import asyncio
 import threading
-import requests
 from datetime import datetime
 from pathlib import Path
-import firebase_admin
-from firebase_admin import credentials, db, storage, firestore
-import vlc
+from engines import ENGINE_LIBVLC, ENGINE_IMAGE, create_engine
+from slideshow import DEFAULT_IMAGE_DURATION
+from prefetch import Prefetcher
+from media import Normalizer, DeviceProfile, describe, extension_for, screen_size
+from documents import DocumentRenderer, DocumentError, DEFAULT_MAX_PAGES
+from media_index import MediaIndex
+from content_cache import ContentCache
+from downloader import Downloader, DownloadError, DownloadCancelled
+from metadata_cache import ContentMetadataCache
+from status_writer import StatusWriter
+from commands import CommandDispatcher, CommandJournal, command_time
+from playback_state import PlaybackState
+from startup import StartupProfile, BackgroundInit
+from tracing import Tracer
+from transport import FirebaseTransport
+from controls import SystemControls
+from core import EventLoop
+from connectivity import Connectivity, Backoff
+from metrics import MetricsServer
+import metrics
+import log
 
 # Configuration
 CONFIG_FILE = "config.json"
 CONTENT_DIR = "content"
 CACHE_DIR = "cache"
+HEARTBEAT_INTERVAL = 10     # Seconds between status heartbeats
+
+CACHE_REQUESTS = metrics.counter(
+    "panelsena_cache_requests_total", "Content cache lookups when fetching content",
+    labels=("result",))
+
+class PlayerError(Exception):
+    """The player cannot start (bad configuration, credentials or device key)"""
+
+class ContentError(Exception):
+    """Content could not be resolved or downloaded"""
+
+class PlaybackCancelled(ContentError):
+    """Preparing content was cancelled by a stop or a newer play command"""
 
 class PanelSenaPlayer:
-    def __init__(self):
-        self.config = self.load_config()
+    """The display player
+
+    By default it reads config.json, talks to Firebase, plays on the screen and
+    controls the Pi's mixer and backlight. For a virtual device pass a `config`
+    dict, a `transport` (see transport.py), an `engine_factory(name, on_end,
+    on_start, **options)` returning a playback engine (or None for no image
+    renderer), `controls` (see controls.py) and a
+    `base_dir` for its content and cache directories. Virtual devices are
+    started with `start()` and may share one `loop` (see core.py).
+    """
+
+    def __init__(self, config=None, transport=None, engine_factory=None, controls=None,
+                 base_dir="", loop=None):
+        # Phase timings up to the first frame, logged to the cache directory
+        self.profile = StartupProfile()
+        self.profile_reported = False
+
+        with self.profile.phase("config"):
+            self.config = config if config is not None else self.load_config()
+
+        # DEBUG lines are off unless "log_level" asks for them
+        log.configure(level=self.config.get("log_level", "info"),
+                      buffer_size=self.config.get("log_buffer_size", 500))
         self.device_id = self.config.get("device_id")
         self.device_key = self.config.get("device_key")
         self.display_name = self.config.get("display_name", "Raspberry Pi Display")
@@ -32,47 +84,91 @@ class PanelSenaPlayer:
         # Will be set after device link verification
         self.user_id = None
         self.display_id = None
+        # Link of the saved playback state, kept there until the link is resolved
+        self.saved_link = (None, None)
+
+        # Set by connect(); everything below works from local state until then
+        self.transport = transport or FirebaseTransport(self.config)
+        self.db = None
+        self.storage_bucket = None
+        self.firestore_db = None
+
+        self.engine_factory = engine_factory or create_engine
+        self.controls = controls or SystemControls()
+        self.controls_lock = threading.Lock()
+
+        # Timers and background jobs run on the event loop, blocking calls on
+        # its bounded executor
+        self.owns_loop = loop is None
+        self.loop = loop or EventLoop(self.config.get("executor_workers", 4))
+        self.tasks = []             # Loop tasks of this player, cancelled on cleanup
+        self.started = False        # Started in the background by start()
+        self.cleanup_lock = threading.Lock()
+
+        # Online/offline state shared by the status and acknowledgement writers
+        self.connectivity = Connectivity(self.loop, self.probe_connection,
+                                         self.reconnect_backoff())
 
         # State
         self.running = True
 
-        # Initialize Firebase
-        self.init_firebase()
-
-        # Authenticate and get device link
-        self.authenticate_device()
-
         # Create content directories
-        Path(CONTENT_DIR).mkdir(exist_ok=True)
-        Path(CACHE_DIR).mkdir(exist_ok=True)
-
-        # VLC process (used for subprocess mode)
-        self.vlc_process = None
-
-        # VLC player instance with fullscreen and other options
-        # For Linux desktop environments (Ubuntu, etc.)
-        # Detect if running in a desktop environment
-        display = os.environ.get('DISPLAY', '')
-        
-        if display:
-            # Running in X11 desktop environment
-            print(f"[INFO] Detected X11 display: {display}")
-            # Let VLC create its own window - simpler and more reliable
-            self.vlc_instance = vlc.Instance(
-                '--no-video-title-show',
-                '--video-on-top',
-                '--fullscreen',
-                '--mouse-hide-timeout=0'
+        self.content_dir = os.path.join(base_dir, CONTENT_DIR)
+        self.cache_dir = os.path.join(base_dir, CACHE_DIR)
+        Path(self.content_dir).mkdir(parents=True, exist_ok=True)
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+
+        # Loading libVLC is slow; let it happen while the caches load and
+        # Firebase connects. The `engine` property waits for it on first use.
+        self._engine_init = BackgroundInit("engine", self.create_engine, self.profile)
+
+        # Still images get their own renderer, created with the first image
+        self._image_renderer = None
+        self.image_renderer_checked = False
+        self.image_renderer_lock = threading.Lock()
+        self.active_engine = None   # Engine of the current item
+
+        # Atomic, resumable, verified downloads (partials live in the cache directory)
+        # over one pooled HTTP session, large files in parallel range segments
+        self.downloader = Downloader(
+            None,
+            chunk_size=self.config.get("download_chunk_kb", 1024) * 1024,
+            parallelism=self.config.get("download_parallelism", 4),
+            parallel_min_size=self.config.get("download_parallel_min_mb", 32) * 1024 * 1024,
+            read_timeout=self.config.get("download_timeout", 60)
+        )
+        self.downloader.cleanup_stale_parts(self.cache_dir)
+
+        # Content documents, resolved in batches and cached in memory and on disk
+        self.metadata_cache = ContentMetadataCache(
+            None, os.path.join(self.cache_dir, "content_metadata.json")
+        )
+
+        # Size-bounded, deduplicating store for downloaded content, and what was
+        # probed about each file when it was downloaded
+        with self.profile.phase("content-cache"):
+            self.media_index = MediaIndex(os.path.join(self.cache_dir, "media_index.db"))
+            self.content_cache = ContentCache(
+                self.content_dir,
+                max_bytes=self.config.get("cache_max_mb", 8192) * 1024 * 1024,
+                min_free_bytes=self.config.get("cache_min_free_mb", 1024) * 1024 * 1024,
+                on_drop=self.media_index.forget
             )
-        else:
-            # Headless or console mode
-            print("[INFO] No X11 display detected, using default output")
-            self.vlc_instance = vlc.Instance('--no-video-title-show', '--fullscreen')
-        
-        self.player = self.vlc_instance.media_player_new()
-        self.player.set_fullscreen(True)
-        
-        self.current_media = None
+
+        # Videos this board can't decode in hardware get a transcoded variant,
+        # made once in the background
+        self.normalizer = Normalizer(
+            self.content_cache, self.cache_dir, DeviceProfile.detect(self.config),
+            encoder=self.config.get("transcode_encoder", "libx264"),
+            enabled=self.config.get("transcode", True),
+            media_index=self.media_index
+        )
+
+        # PDF pages rendered to images once, when the document is fetched
+        self.documents = DocumentRenderer(
+            self.content_cache, self.cache_dir, screen_size(self.config),
+            max_pages=self.config.get("document_max_pages", DEFAULT_MAX_PAGES)
+        )
 
         # State
         self.is_playing = False
@@ -81,67 +177,161 @@ class PanelSenaPlayer:
         self.current_schedule = None
         self.content_queue = []
         self.current_index = 0
+        self.queue_lock = threading.RLock()
+        self.schedule_watch = None  # Firestore listener on the active schedule
+        self.status_writer = None   # Created once the display link is known
+        self.dispatcher = None      # Created when command listening starts
+        self.play_cancel = threading.Event()  # Set to abandon in-flight downloads
         self.volume = 80
         self.brightness = 100  # Default brightness (0-100)
 
-        # Heartbeat thread
-        self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop)
-        self.heartbeat_thread.daemon = True
+        # What is playing, saved on every change so a reboot resumes it offline
+        self.playback_state = PlaybackState(os.path.join(self.cache_dir, "playback_state.json"))
+        self.resume_job = None
+
+        # Timed stages of each play/skip, from the command to the first frame
+        self.tracer = Tracer(os.path.join(self.cache_dir, "transition_traces.jsonl"))
+
+        # Background download of the next "prefetch_count" queue items
+        self.prefetcher = Prefetcher(self.prefetch_content, self.config.get("prefetch_count", 2))
+
+        # Optional Prometheus endpoint for player internals
+        metrics.gauge("panelsena_cache_bytes", "Bytes used by the content cache",
+                      function=self.content_cache.total_bytes)
+        self.metrics_server = None
+        if self.config.get("metrics_port"):
+            try:
+                self.metrics_server = MetricsServer(self.config["metrics_port"],
+                                                    self.config.get("metrics_bind", "0.0.0.0"))
+            except OSError as e:
+                log.warn(f"Metrics endpoint unavailable: {e}")
+
+        log.info(f"PanelSena Player initialized for display: {self.display_name}")
+
+    @property
+    def engine(self):
+        """Playback engine (waits for its creation on first use)"""
+        return self._engine_init.get()
+
+    def create_engine(self):
+        """Create the playback engine: a persistent libVLC player by default, or
+        one `vlc` process per item when "playback_engine" is set to "subprocess"."""
+        engine = self.engine_factory(
+            self.config.get("playback_engine", ENGINE_LIBVLC),
+            on_end=self.handle_content_end,
+            on_start=self.handle_content_start
+        )
+        log.info(f"Using {engine.name} playback engine")
+        return engine
+
+    @property
+    def image_renderer(self):
+        """Renderer for still images (created on first use), or None when
+        "image_renderer" is off or Pillow/Tk/X11 are missing"""
+        with self.image_renderer_lock:
+            if not self.image_renderer_checked:
+                self.image_renderer_checked = True
+                if self.config.get("image_renderer", True):
+                    self._image_renderer = self.engine_factory(
+                        ENGINE_IMAGE,
+                        on_end=self.handle_content_end,
+                        on_start=self.handle_content_start,
+                        cache_mb=self.config.get("image_cache_mb", 64)
+                    )
+            return self._image_renderer
 
-        print(f"[INFO] PanelSena Player initialized for display: {self.display_name}")
+    def engine_for(self, content_type):
+        """Engine that plays this type of content"""
+        if content_type in ('image', 'document'):
+            renderer = self.image_renderer
+            if renderer is not None:
+                return renderer
+        return self.engine
 
     def load_config(self):
         """Load configuration from config.json"""
         if not os.path.exists(CONFIG_FILE):
-            print(f"[ERROR] Configuration file {CONFIG_FILE} not found!")
-            print("Please create a config.json file with your Firebase credentials")
-            sys.exit(1)
+            log.error(f"Configuration file {CONFIG_FILE} not found!")
+            log.error("Please create a config.json file with your Firebase credentials")
+            raise PlayerError(f"Configuration file {CONFIG_FILE} not found")
 
         with open(CONFIG_FILE, 'r') as f:
             return json.load(f)
 
+    async def connect(self):
+        """Initialize Firebase and resolve the device link.
+
+        Raises PlayerError on failure; the caller decides whether to retry or
+        give up (nothing to show without Firebase and an empty cache).
+        """
+        with self.profile.phase("firebase-init"):
+            firestore_init, storage_init = await self.loop.blocking(self.init_firebase)
+
+        # The link may have changed since the saved playback state was written
+        self.user_id = None
+        self.display_id = None
+        with self.profile.phase("device-auth"):
+            await self.loop.blocking(self.authenticate_device)
+            if not self.user_id:
+                await self.wait_for_device_link()
+
+        # Created in parallel with device authentication
+        try:
+            self.firestore_db = await self.loop.blocking(firestore_init.get)
+            self.storage_bucket = await self.loop.blocking(storage_init.get)
+        except Exception as e:
+            log.error(f"Failed to initialize Firebase clients: {e}")
+            raise PlayerError(f"Failed to initialize Firebase clients: {e}") from e
+
+        # Hand the clients to the components that were created offline
+        self.downloader.storage_bucket = self.storage_bucket
+        self.metadata_cache.firestore_db = self.firestore_db
+
     def init_firebase(self):
-        """Initialize Firebase Admin SDK"""
+        """Initialize the transport (the Firebase Admin SDK by default).
+
+        Returns BackgroundInits creating the Firestore client and the Storage
+        bucket, which are slow (gRPC, Cloud Storage imports) and not needed to
+        authenticate the device.
+        """
         try:
-            # Initialize with service account
-            cred = credentials.Certificate(self.config.get("service_account_path"))
-            firebase_admin.initialize_app(cred, {
-                'databaseURL': self.config.get("database_url"),
-                'storageBucket': self.config.get("storage_bucket")
-            })
-
-            # Get database and storage references
-            self.db = db
-            self.storage_bucket = storage.bucket()
-            self.firestore_db = firestore.client()
-
-            print("[INFO] Firebase initialized successfully")
+            firestore_init, storage_init = self.transport.connect(self.profile)
+
+            # Realtime Database references come from the transport
+            self.db = self.transport
+
+            log.info("Firebase initialized successfully")
+            return firestore_init, storage_init
         except Exception as e:
-            print(f"[ERROR] Failed to initialize Firebase: {e}")
-            sys.exit(1)
+            log.error(f"Failed to initialize Firebase: {e}")
+            raise PlayerError(f"Failed to initialize Firebase: {e}") from e
 
     def authenticate_device(self):
-        """Authenticate device and get user/display link"""
+        """Authenticate device and get user/display link (leaves user_id unset
+        if the device isn't linked yet)"""
         try:
-            print(f"[INFO] Authenticating device: {self.device_id}")
+            log.info(f"Authenticating device: {self.device_id}")
 
-            # First, register device in registry (or update last seen)
+            # First, register device in registry (or update last seen). The link
+            # is read at the same time; the two reads don't depend on each other
             device_ref = self.db.reference(f'device_registry/{self.device_id}')
+            link_ref = self.db.reference(f'device_links/{self.device_id}')
+            link_fetch = BackgroundInit("device-link", link_ref.get, self.profile)
             device_data = device_ref.get()
 
             if device_data:
                 # Verify device key
                 if device_data.get('deviceKey') != self.device_key:
-                    print("[ERROR] Invalid device key!")
-                    print("The device key in config.json does not match the registered device.")
-                    sys.exit(1)
+                    log.error("Invalid device key!")
+                    log.error("The device key in config.json does not match the registered device.")
+                    raise PlayerError("Invalid device key")
 
-                # Update last seen
-                device_ref.update({'lastSeen': int(time.time() * 1000)})
-                print("[INFO] Device authenticated successfully")
+                # Update last seen; nothing waits for this write
+                self.loop.submit(self.touch_last_seen, device_ref, int(time.time() * 1000))
+                log.info("Device authenticated successfully")
             else:
                 # Register new device
-                print("[INFO] Registering new device...")
+                log.info("Registering new device...")
                 device_ref.set({
                     'deviceId': self.device_id,
                     'deviceKey': self.device_key,
@@ -151,55 +341,97 @@ class PanelSenaPlayer:
                     'linkedToUser': None,
                     'status': 'registered'
                 })
-                print("[INFO] Device registered. Please link it in the dashboard.")
+                log.info("Device registered. Please link it in the dashboard.")
 
             # Check if device is linked to a user
-            link_ref = self.db.reference(f'device_links/{self.device_id}')
-            link_data = link_ref.get()
+            link_data = link_fetch.get()
 
             if link_data:
                 self.user_id = link_data.get('userId')
                 self.display_id = link_data.get('displayId')
-                print(f"[INFO] Device linked to user: {self.user_id}, display: {self.display_id}")
+                log.info(f"Device linked to user: {self.user_id}, display: {self.display_id}")
             else:
-                print("[WARN] Device not linked to any user yet")
-                print("Please link this device in the dashboard:")
-                print(f"  Device ID:  {self.device_id}")
-                print(f"  Device Key: {self.device_key}")
-                print()
-                print("Waiting for device to be linked...")
-
-                # Wait for link
-                self.wait_for_device_link()
+                log.warn("Device not linked to any user yet")
+                log.warn("Please link this device in the dashboard:")
+                log.warn(f"  Device ID:  {self.device_id}")
+                log.warn(f"  Device Key: {self.device_key}")
+                log.info("Waiting for device to be linked...")
+
+        except PlayerError:
+            raise
+        except Exception as e:
+            log.error(f"Device authentication failed: {e}")
+            raise PlayerError(f"Device authentication failed: {e}") from e
 
+    def touch_last_seen(self, device_ref, timestamp):
+        """Record the registry's lastSeen (run in the background)"""
+        try:
+            device_ref.update({'lastSeen': timestamp})
         except Exception as e:
-            print(f"[ERROR] Device authentication failed: {e}")
-            sys.exit(1)
+            log.warn(f"Failed to update device lastSeen: {e}")
+
+    async def wait_for_device_link(self):
+        """Wait for device to be linked to a user.
 
-    def wait_for_device_link(self):
-        """Wait for device to be linked to a user"""
+        Listens to the device's link node, so the link is picked up as soon as
+        the dashboard writes it.
+        """
         link_ref = self.db.reference(f'device_links/{self.device_id}')
+        changed = asyncio.Event()
+        listener = await self.loop.blocking(
+            link_ref.listen, lambda event: self.loop.call_soon(changed.set))
 
-        print("[INFO] Polling for device link every 5 seconds...")
-        while self.running:
-            link_data = link_ref.get()
-            if link_data:
-                self.user_id = link_data.get('userId')
-                self.display_id = link_data.get('displayId')
-                print(f"[INFO] Device linked! User: {self.user_id}, Display: {self.display_id}")
-                break
-            time.sleep(5)
+        log.info("Waiting for the device link...")
+        try:
+            while self.running:
+                # Events may carry only part of the link; read it whole
+                link_data = await self.loop.blocking(link_ref.get)
+                if link_data and link_data.get('userId') and link_data.get('displayId'):
+                    self.user_id = link_data.get('userId')
+                    self.display_id = link_data.get('displayId')
+                    log.info(f"Device linked! User: {self.user_id}, Display: {self.display_id}")
+                    break
+                await changed.wait()
+                changed.clear()
+        finally:
+            await self.loop.blocking(listener.close)
+
+    def reconnect_backoff(self):
+        """Jittered backoff between reconnection attempts"""
+        return Backoff(base=self.config.get("reconnect_min_seconds", 2),
+                       cap=self.config.get("reconnect_max_seconds", 300))
+
+    def probe_connection(self):
+        """Cheap write telling whether Firebase is reachable again (and
+        refreshing lastSeen while at it)"""
+        self.db.reference(f'device_registry/{self.device_id}').update(
+            {'lastSeen': int(time.time() * 1000)})
 
     def update_status(self, status="online", error_message=None):
-        """Update display status in Firebase Realtime Database"""
+        """Publish display status to Firebase Realtime Database (non-blocking)"""
         try:
-            print(f"[DEBUG] update_status called with status={status}")
-            
+            log.debug(f"update_status called with status={status}")
+
+            # Every playback change passes through here; keep the local snapshot
+            # current (not while shutting down, so a restart resumes playback)
+            if self.running:
+                self.save_playback_state()
+
+            if self.db is None:
+                log.debug("Not connected to Firebase yet, status not sent")
+                return
+
             if not self.user_id or not self.display_id:
-                print("[WARN] Cannot update status - user_id or display_id not set")
+                # Normal until the connectivity manager has resolved the link
+                log.debug("Display not linked yet, status not sent")
                 return
 
-            status_ref = self.db.reference(f'users/{self.user_id}/displays/{self.display_id}/status')
+            if self.status_writer is None:
+                self.status_writer = StatusWriter(
+                    self.db.reference(f'users/{self.user_id}/displays/{self.display_id}/status'),
+                    debounce=self.config.get("status_debounce_ms", 250) / 1000.0,
+                    connectivity=self.connectivity
+                )
 
             status_data = {
                 'displayId': self.display_id,
@@ -210,7 +442,7 @@ class PanelSenaPlayer:
                 'brightness': self.brightness,
             }
 
-            print(f"[DEBUG] Preparing status update: status={status}, lastHeartbeat={status_data['lastHeartbeat']}")
+            log.debug(f"Preparing status update: status={status}, lastHeartbeat={status_data['lastHeartbeat']}")
 
             # Add current content if playing
             if self.current_content:
@@ -221,6 +453,8 @@ class PanelSenaPlayer:
                     'url': self.current_content.get('url'),
                     'startedAt': self.current_content.get('startedAt'),
                 }
+                if self.current_content.get('duration'):
+                    status_data['currentContent']['duration'] = round(self.current_content['duration'], 2)
             else:
                 status_data['currentContent'] = None
 
@@ -229,54 +463,181 @@ class PanelSenaPlayer:
                 status_data['schedule'] = {
                     'id': self.current_schedule.get('id'),
                     'name': self.current_schedule.get('name'),
-                    'contentQueue': self.content_queue,
+                    'contentQueue': list(self.content_queue),
                     'currentIndex': self.current_index,
                 }
             else:
                 status_data['schedule'] = None
 
+            # Throughput of the last download, for tuning download settings per site
+            if self.downloader.last_stats:
+                status_data['lastDownload'] = {
+                    'bytes': self.downloader.last_stats['bytes'],
+                    'seconds': self.downloader.last_stats['seconds'],
+                    'mbps': self.downloader.last_stats['mbps'],
+                    'segments': self.downloader.last_stats['segments'],
+                }
+
+            # Command-to-first-frame latency of recent play/skip commands
+            transitions = self.tracer.summary()
+            if transitions:
+                status_data['transitions'] = transitions
+
             # Add error message if provided
             if error_message:
                 status_data['errorMessage'] = error_message
 
-            print(f"[DEBUG] Setting Firebase status data...")
-            status_ref.set(status_data)
-            print(f"[DEBUG] Firebase status updated successfully with status={status}")
+            # Written in the background; only fields that changed since the last
+            # acknowledged write are sent
+            self.status_writer.publish(status_data)
 
         except Exception as e:
-            print(f"[ERROR] Failed to update status: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error(f"Failed to update status: {e}", exc_info=True)
+
+    def save_playback_state(self):
+        """Write the local playback snapshot (only when it changed)"""
+        with self.queue_lock:
+            queue = list(self.content_queue)
+            index = self.current_index
+        single_id = None
+        if not queue and self.current_content:
+            single_id = self.current_content.get('id')
+        schedule = None
+        if self.current_schedule:
+            schedule = {'id': self.current_schedule.get('id'),
+                        'name': self.current_schedule.get('name')}
+        user_id, display_id = self.user_id, self.display_id
+        if not user_id:
+            # Offline or not linked yet: reconcile_playback_state needs the last known link
+            user_id, display_id = self.saved_link
+        self.playback_state.save({
+            'userId': user_id,
+            'displayId': display_id,
+            'schedule': schedule,
+            'contentQueue': queue,
+            'currentIndex': index,
+            'contentId': single_id,
+            'volume': self.volume,
+            'brightness': self.brightness,
+        })
+
+    def restore_playback_state(self):
+        """Resume the saved playback snapshot from the local cache.
+
+        Returns the snapshot if there was something to resume, else None.
+        """
+        snapshot = self.playback_state.load()
+        if not snapshot:
+            return None
+
+        self.user_id = snapshot.get('userId')
+        self.display_id = snapshot.get('displayId')
+        self.saved_link = (self.user_id, self.display_id)
+        self.set_volume(snapshot.get('volume', self.volume))
+        self.set_brightness(snapshot.get('brightness', self.brightness))
+
+        schedule = snapshot.get('schedule')
+        queue = snapshot.get('contentQueue') or []
+        if schedule and queue:
+            log.info(f"Resuming schedule {schedule.get('name')} from local state")
+            self.current_schedule = dict(schedule)
+            start = snapshot.get('currentIndex', 0) % len(queue)
+            # Offline only cached items can play; start with the first of those
+            for offset in range(len(queue)):
+                index = (start + offset) % len(queue)
+                if self.content_cache.lookup(queue[index]) is not None:
+                    start = index
+                    break
+            with self.queue_lock:
+                self.content_queue = list(queue)
+                self.current_index = start
+            self.content_cache.set_pinned(queue)
+            self.prefetch_upcoming()
+            target = self.play_from_queue
+        elif snapshot.get('contentId'):
+            log.info(f"Resuming content {snapshot['contentId']} from local state")
+            target = lambda: self.play_single_content(snapshot['contentId'])
+        else:
+            return None
 
-    def heartbeat_loop(self):
-        """Send heartbeat every 10 seconds"""
-        print("[INFO] Heartbeat loop started")
-        while self.running:
-            try:
-                if self.is_playing and not self.is_paused:
-                    current_status = "playing"
-                elif self.is_paused:
-                    current_status = "paused"
-                else:
-                    current_status = "online"
-                
-                print(f"[DEBUG] Heartbeat: status={current_status}, is_playing={self.is_playing}, is_paused={self.is_paused}")
-                self.update_status(current_status)
-            except Exception as e:
-                print(f"[ERROR] Heartbeat failed: {e}")
-                import traceback
-                traceback.print_exc()
-                # Don't let heartbeat errors crash the loop
-                pass
+        # Start in the background so connecting to Firebase isn't held up
+        self.resume_job = self.loop.submit(target)
+        return snapshot
 
-            time.sleep(10)
-        
-        print("[INFO] Heartbeat loop ended")
+    def reconcile_playback_state(self, snapshot):
+        """Bring resumed playback in line with Firebase once connected"""
+        if (snapshot.get('userId'), snapshot.get('displayId')) != (self.user_id, self.display_id):
+            log.warn("Display link changed since the last run, stopping resumed playback")
+            self.stop_playback()
+            return
+
+        schedule = snapshot.get('schedule')
+        if not schedule or not self.current_schedule \
+                or self.current_schedule.get('id') != schedule.get('id'):
+            # A single item, or playback changed already: just refresh its metadata
+            if self.current_content:
+                self.refresh_content_metadata([self.current_content.get('id')])
+            return
+
+        log.info(f"Reconciling resumed schedule {schedule.get('id')} with Firestore")
+        with self.queue_lock:
+            queue = list(self.content_queue)
+        self.refresh_content_metadata(queue)
+
+        # Follow the schedule from now on; the first snapshot is applied like any
+        # later edit, so the current item keeps playing
+        schedule_doc = self.subscribe_schedule(schedule['id'])
+        self.apply_schedule_update(schedule['id'], schedule_doc)
+
+        if self.current_schedule and not self.is_playing and self.resume_job.done():
+            # E.g. the resumed item wasn't cached; try again now that we can download
+            self.loop.submit(self.play_from_queue)
+
+    def current_status(self):
+        """Playback status string for the status node"""
+        if self.is_playing and not self.is_paused:
+            return "playing"
+        elif self.is_paused:
+            return "paused"
+        return "online"
+
+    def heartbeat(self):
+        """Send one heartbeat"""
+        current_status = self.current_status()
+        log.debug(f"Heartbeat: status={current_status}, is_playing={self.is_playing}, is_paused={self.is_paused}")
+        self.update_status(current_status)
+
+    async def heartbeat_loop(self):
+        """Send a heartbeat every HEARTBEAT_INTERVAL seconds"""
+        log.info("Heartbeat loop started")
+        try:
+            while self.running:
+                try:
+                    await self.loop.blocking(self.heartbeat)
+                except Exception as e:
+                    # Don't let heartbeat errors crash the loop
+                    log.error(f"Heartbeat failed: {e}", exc_info=True)
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+        finally:
+            log.info("Heartbeat loop ended")
 
     def listen_for_commands(self):
         """Listen for commands from Firebase"""
         commands_ref = self.db.reference(f'users/{self.user_id}/displays/{self.display_id}/commands')
 
+        # Commands run on the dispatcher's worker, never in the listener callback,
+        # so a long download can't hold up a later stop
+        journal = CommandJournal(os.path.join(self.cache_dir, "command_journal.json"))
+        self.dispatcher = CommandDispatcher(
+            self.execute_command, commands_ref, journal=journal,
+            ttl=self.config.get('command_ttl_seconds', 600),
+            retention=self.config.get('command_retention_seconds', 60),
+            connectivity=self.connectivity
+        )
+
+        # The listener starts with a snapshot of the whole node, so shrink it first
+        self.dispatcher.compact()
+
         def command_listener(event):
             """Handle incoming commands"""
             if event.data is None:
@@ -288,187 +649,387 @@ class PanelSenaPlayer:
                 if 'status' in event.data:
                     # Single command object
                     if event.data.get('status') == 'pending':
-                        command_id = event.data.get('commandId', 'unknown')
-                        print(f"[INFO] Received command: {event.data.get('type')}")
-                        self.execute_command(command_id, event.data)
+                        command_id = event.data.get('commandId') or event.path.strip('/')
+                        log.info(f"Received command: {event.data.get('type')}")
+                        self.dispatcher.submit(command_id, event.data)
                 else:
-                    # Multiple commands
-                    for command_id, command in event.data.items():
-                        if isinstance(command, dict) and command.get('status') == 'pending':
-                            print(f"[INFO] Received command: {command.get('type')}")
-                            self.execute_command(command_id, command)
+                    # Multiple commands, submitted oldest first
+                    pending = {
+                        command_id: command for command_id, command in event.data.items()
+                        if isinstance(command, dict) and command.get('status') == 'pending'
+                    }
+                    if pending:
+                        log.info(f"Received {len(pending)} pending command(s)")
+                        self.dispatcher.submit_all(pending)
 
         commands_ref.listen(command_listener)
-        print("[INFO] Listening for commands...")
-
-    def execute_command(self, command_id, command):
-        """Execute a playback command"""
-        command_ref = None
-        try:
-            command_type = command.get('type')
-            payload = command.get('payload', {})
+        log.info("Listening for commands...")
 
-            print(f"[INFO] Executing command: {command_type}")
+    def execute_command(self, command, cancel):
+        """Execute a playback command (called on the dispatcher's worker thread).
 
-            if command_type == 'play':
-                if 'scheduleId' in payload:
-                    self.load_and_play_schedule(payload['scheduleId'])
-                elif 'contentId' in payload:
-                    self.play_single_content(payload['contentId'])
-
-            elif command_type == 'pause':
-                self.pause_playback()
-
-            elif command_type == 'stop':
-                self.stop_playback()
-
-            elif command_type == 'skip':
-                self.skip_content()
+        `cancel` is set when a newer play or a stop supersedes this command.
+        Raises on failure; the dispatcher acknowledges the result.
+        """
+        command_type = command.get('type')
+        payload = command.get('payload', {})
 
-            elif command_type == 'volume':
-                self.set_volume(payload.get('volume', 80))
+        if command_type in ('play', 'skip'):
+            detail = payload.get('scheduleId') or payload.get('contentId')
+            self.tracer.begin(command_type, detail, created=command_time(command))
+        try:
+            self._execute(command_type, payload, cancel)
+        finally:
+            self.tracer.end()
+        return 'Command executed successfully'
+
+    def _execute(self, command_type, payload, cancel):
+        """Run one command (see execute_command)"""
+        if command_type == 'play':
+            # Abandon downloads for whatever was playing; new ones follow this command
+            self.play_cancel.set()
+            self.play_cancel = cancel
+            if 'scheduleId' in payload:
+                self.load_and_play_schedule(payload['scheduleId'])
+            elif 'contentId' in payload:
+                self.play_single_content(payload['contentId'])
+
+        elif command_type == 'pause':
+            self.pause_playback()
+
+        elif command_type == 'stop':
+            self.stop_playback()
 
-            elif command_type == 'brightness':
-                self.set_brightness(payload.get('brightness', 100))
+        elif command_type == 'skip':
+            self.skip_content()
 
-            elif command_type == 'restart':
-                self.restart_device()
+        elif command_type == 'volume':
+            self.set_volume(payload.get('volume', 80))
 
-            # Mark command as executed
-            command_ref = self.db.reference(
-                f'users/{self.user_id}/displays/{self.display_id}/commands/{command_id}'
-            )
-            command_ref.update({
-                'status': 'executed',
-                'result': 'Command executed successfully'
-            })
-            print(f"[INFO] Command {command_type} executed successfully")
+        elif command_type == 'brightness':
+            self.set_brightness(payload.get('brightness', 100))
 
-        except Exception as e:
-            print(f"[ERROR] Failed to execute command: {e}")
-            import traceback
-            traceback.print_exc()
-            
-            # Mark command as failed
-            try:
-                if command_ref is None:
-                    command_ref = self.db.reference(
-                        f'users/{self.user_id}/displays/{self.display_id}/commands/{command_id}'
-                    )
-                command_ref.update({
-                    'status': 'failed',
-                    'result': str(e)
-                })
-            except Exception as update_error:
-                print(f"[ERROR] Failed to update command status: {update_error}")
+        elif command_type == 'restart':
+            self.restart_device()
 
     def load_and_play_schedule(self, schedule_id):
-        """Load schedule from Firestore and start playback"""
+        """Load schedule from Firestore, start playback and follow later edits"""
         try:
-            print(f"[INFO] Loading schedule: {schedule_id}")
+            log.info(f"Loading schedule: {schedule_id}")
 
-            # Fetch schedule from Firestore
-            schedule_ref = self.firestore_db.collection('schedules').document(schedule_id)
-            schedule_doc = schedule_ref.get()
-            
-            if not schedule_doc.exists:
-                print(f"[ERROR] Schedule not found in Firestore: {schedule_id}")
+            # Subscribe to the schedule document; its first snapshot is the load
+            with self.tracer.span("schedule"):
+                schedule_doc = self.subscribe_schedule(schedule_id)
+
+            if schedule_doc is None or not schedule_doc.exists:
+                log.error(f"Schedule not found in Firestore: {schedule_id}")
+                self.unsubscribe_schedule()
+                self.tracer.fail(f"Schedule not found: {schedule_id}")
                 self.update_status("error", f"Schedule not found: {schedule_id}")
                 return
             
             schedule_data = schedule_doc.to_dict()
-            print(f"[INFO] Found schedule: {schedule_data.get('name')}")
-            print(f"[DEBUG] Schedule data: {schedule_data}")
+            log.info(f"Found schedule: {schedule_data.get('name')}")
+            log.debug(f"Schedule data: {schedule_data}")
+
+            # Set current schedule info
+            self.current_schedule = {
+                'id': schedule_id,
+                'name': schedule_data.get('name', f"Schedule {schedule_id}"),
+            }
             
             # Get content IDs from schedule (the field is 'contentIds')
             content_ids = schedule_data.get('contentIds', [])
             if not content_ids or len(content_ids) == 0:
-                print(f"[WARN] Schedule has no content items")
-                print(f"[DEBUG] Available schedule fields: {list(schedule_data.keys())}")
+                # Stay subscribed: playback starts once content is added
+                log.warn(f"Schedule has no content items")
+                log.debug(f"Available schedule fields: {list(schedule_data.keys())}")
+                self.tracer.fail("Schedule has no content")
                 self.update_status("error", "Schedule has no content")
                 return
             
-            # Set the content queue
-            self.content_queue = content_ids
-            print(f"[INFO] Loaded {len(self.content_queue)} content items: {self.content_queue}")
+            # Resolve all content metadata in one batch; drop stale cached files
+            with self.tracer.span("metadata"):
+                self.refresh_content_metadata(content_ids)
 
-            # Set current schedule info
-            self.current_schedule = {
-                'id': schedule_id,
-                'name': schedule_data.get('name', f"Schedule {schedule_id}"),
-            }
+            # Set the content queue
+            with self.queue_lock:
+                self.content_queue = list(content_ids)
+                self.current_index = 0
+            self.content_cache.set_pinned(content_ids)
+            log.info(f"Loaded {len(self.content_queue)} content items: {self.content_queue}")
 
             # Start playing the first content
-            self.current_index = 0
-            print(f"[INFO] Starting playback from index {self.current_index}")
+            log.info(f"Starting playback from index {self.current_index}")
+            # Start fetching what comes next while the first item downloads
+            self.prefetch_upcoming()
             self.play_from_queue()
 
         except Exception as e:
-            print(f"[ERROR] Failed to load schedule: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error(f"Failed to load schedule: {e}", exc_info=True)
+            self.tracer.fail(e)
             self.update_status("error", str(e))
 
-    def play_single_content(self, content_id):
-        """Play a single content item"""
-        try:
-            print(f"[INFO] Playing content: {content_id}")
-            
-            # Fetch content metadata from Firestore (content is stored at root level)
-            content_ref = self.firestore_db.collection('content').document(content_id)
-            content_doc = content_ref.get()
-            
-            if not content_doc.exists:
-                print(f"[ERROR] Content not found in Firestore: {content_id}")
-                print(f"[DEBUG] Checked path: content/{content_id}")
-                self.update_status("error", f"Content not found: {content_id}")
+    def subscribe_schedule(self, schedule_id):
+        """Listen to a schedule document and return its first snapshot.
+
+        Later snapshots are applied to the running queue by apply_schedule_update,
+        so dashboard edits show up without another play command or extra reads.
+        """
+        self.unsubscribe_schedule()
+        schedule_ref = self.firestore_db.collection('schedules').document(schedule_id)
+
+        first_snapshot = threading.Event()
+        initial = {}
+
+        def on_snapshot(docs, changes, read_time):
+            doc = docs[0] if docs else None
+            if not first_snapshot.is_set():
+                initial['doc'] = doc
+                first_snapshot.set()
                 return
-            
-            content_data = content_doc.to_dict()
-            print(f"[INFO] Found content: {content_data.get('name')} ({content_data.get('type')})")
-            
-            # Get storage path
-            storage_path = content_data.get('url', '')
-            if not storage_path:
-                print(f"[ERROR] No storage URL for content: {content_id}")
-                self.update_status("error", "Content has no storage URL")
+            try:
+                self.apply_schedule_update(schedule_id, doc)
+            except Exception as e:
+                log.error(f"Failed to apply schedule update: {e}", exc_info=True)
+
+        self.schedule_watch = schedule_ref.on_snapshot(on_snapshot)
+        if not first_snapshot.wait(timeout=30):
+            # Listener never delivered; keep it for updates but read once directly
+            log.warn("Schedule listener slow to respond, reading schedule directly")
+            first_snapshot.set()
+            return schedule_ref.get()
+        return initial.get('doc')
+
+    def unsubscribe_schedule(self):
+        """Stop listening to the active schedule document"""
+        if self.schedule_watch is not None:
+            try:
+                self.schedule_watch.unsubscribe()
+            except Exception as e:
+                log.debug(f"Failed to unsubscribe schedule listener: {e}")
+            self.schedule_watch = None
+
+    def apply_schedule_update(self, schedule_id, schedule_doc):
+        """Apply an edited schedule to the running queue without restarting playback"""
+        if not self.current_schedule or self.current_schedule.get('id') != schedule_id:
+            return
+
+        # Stopping unsubscribes the listener, which can't be done from its own
+        # thread, so it happens on the executor
+        if schedule_doc is None or not schedule_doc.exists:
+            log.warn(f"Schedule {schedule_id} was deleted, stopping playback")
+            self.loop.submit(self.stop_playback)
+            return
+
+        schedule_data = schedule_doc.to_dict()
+        new_queue = list(schedule_data.get('contentIds', []) or [])
+        self.current_schedule['name'] = schedule_data.get('name', self.current_schedule['name'])
+
+        with self.queue_lock:
+            old_queue = list(self.content_queue)
+            if new_queue == old_queue:
+                log.debug("Schedule update without queue changes")
+                self.update_status(self.current_status())
                 return
-            
-            print(f"[DEBUG] Storage URL: {storage_path}")
-            
-            # Determine file extension from content type or URL
-            content_type = content_data.get('type', 'video')
-            file_extension = self._get_file_extension(storage_path, content_type)
-            
-            # Create local file path
-            local_filename = f"{content_id}{file_extension}"
-            local_path = os.path.join(CONTENT_DIR, local_filename)
-            
-            # Download if not already cached
-            if not os.path.exists(local_path):
-                print(f"[INFO] Downloading content from: {storage_path}")
-                if not self.download_content(storage_path, local_path):
-                    self.update_status("error", "Failed to download content")
-                    return
+
+            added = [cid for cid in new_queue if cid not in old_queue]
+            removed = [cid for cid in old_queue if cid not in new_queue]
+            log.info(f"Schedule updated: +{added} -{removed}")
+
+            if new_queue and old_queue:
+                # Keep the current item playing and continue with whatever followed
+                # it before the edit (or the start of the queue if nothing did)
+                next_id = None
+                for offset in range(1, len(old_queue) + 1):
+                    candidate = old_queue[(self.current_index + offset) % len(old_queue)]
+                    if candidate in new_queue:
+                        next_id = candidate
+                        break
+                next_index = new_queue.index(next_id) if next_id is not None else 0
+                self.current_index = (next_index - 1) % len(new_queue)
             else:
-                print(f"[INFO] Using cached content: {local_path}")
-            
-            # Prepare content info
-            content_info = {
-                'id': content_id,
-                'name': content_data.get('name', 'Unknown'),
-                'type': content_type,
-                'url': storage_path,
-            }
-            
+                self.current_index = 0
+            self.content_queue = new_queue
+
+        if not new_queue:
+            log.warn("Schedule has no content items anymore, stopping playback")
+            self.loop.submit(self.stop_playback)
+            return
+
+        self.refresh_content_metadata(added)
+        self.content_cache.set_pinned(new_queue)
+
+        if self.is_playing:
+            self.prefetch_upcoming(extra=added)
+            self.update_status(self.current_status())
+        else:
+            # Nothing playing (e.g. the schedule was empty): start from the top
+            with self.queue_lock:
+                self.current_index = 0
+            self.prefetch_upcoming()
+            self.loop.submit(self.play_from_queue)
+
+    def play_single_content(self, content_id):
+        """Play a single content item"""
+        try:
+            log.info(f"Playing content: {content_id}")
+            cancel = self.play_cancel
+
+            if not self.content_queue:
+                with self.tracer.span("metadata"):
+                    self.refresh_content_metadata([content_id])
+                self.content_cache.set_pinned([content_id])
+
+            # Normally already on disk thanks to the prefetcher
+            with self.tracer.span("fetch"):
+                local_path, content_info = self.prefetcher.get(content_id)
+            local_path = self.normalizer.best(content_id, local_path)
+
+            if cancel.is_set():
+                raise PlaybackCancelled(f"Playback of {content_id} was cancelled")
+
             # Play the file
-            self.play_file(local_path, content_info)
-            
+            if self.play_file(local_path, content_info):
+                self.prefetch_upcoming()
+
+        except PlaybackCancelled as e:
+            log.info(f"{e}")
+        except ContentError as e:
+            log.error(f"{e}")
+            self.tracer.fail(e)
+            self.update_status("error", str(e))
         except Exception as e:
-            print(f"[ERROR] Failed to play content: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error(f"Failed to play content: {e}", exc_info=True)
+            self.tracer.fail(e)
             self.update_status("error", str(e))
+
+    def fetch_content(self, content_id):
+        """Resolve content metadata and make sure the file is cached locally.
+
+        Returns (local_path, content_info). Raises ContentError on failure.
+        Called from the playback path and from the prefetch worker.
+        """
+        cancel = self.play_cancel
+
+        # Content metadata (content is stored at root level), normally already
+        # resolved in one batch when the schedule was loaded
+        with self.tracer.span("metadata"):
+            content_data = self.metadata_cache.get(content_id)
+
+        if content_data is None:
+            log.debug(f"Checked path: content/{content_id}")
+            raise ContentError(f"Content not found: {content_id}")
+
+        log.info(f"Found content: {content_data.get('name')} ({content_data.get('type')})")
+
+        # Get storage path
+        storage_path = content_data.get('url', '')
+        if not storage_path:
+            raise ContentError(f"Content has no storage URL: {content_id}")
+
+        log.debug(f"Storage URL: {storage_path}")
+
+        # Determine file extension from content type or URL
+        content_type = content_data.get('type', 'video')
+        file_extension = self._get_file_extension(storage_path, content_type)
+
+        # Download if not already cached
+        local_path = self.content_cache.lookup(content_id)
+        CACHE_REQUESTS.inc(result='miss' if local_path is None else 'hit')
+        if local_path is None:
+            # Download next to the cache and let the cache adopt the finished file
+            download_path = os.path.join(self.cache_dir, f"{content_id}{file_extension}")
+            self.content_cache.reserve(content_data.get('sizeBytes') or 0)
+
+            log.info(f"Downloading content from: {storage_path}")
+            with self.tracer.span("download"):
+                downloaded = self.download_content(storage_path, download_path,
+                                                   storage_ref=content_data.get('storageRef'),
+                                                   cancel=cancel)
+            if not downloaded:
+                raise ContentError(f"Failed to download content: {content_id}")
+            # Probe once; the container also settles the extension the URL only hinted at
+            with self.tracer.span("probe"):
+                info = describe(download_path)
+            local_path = self.content_cache.add(
+                content_id, download_path, extension_for(info['container']) or file_extension)
+            self.media_index.record(content_id, self.content_cache.content_hash(content_id), info)
+        else:
+            log.info(f"Using cached content: {local_path}")
+            self.index_media(content_id, local_path)
+        self.normalizer.check(content_id, local_path, content_type)
+
+        # Documents play as their page images
+        pages = None
+        if content_type == 'document':
+            with self.tracer.span("render"):
+                try:
+                    pages = self.documents.pages(content_id, local_path)
+                except DocumentError as e:
+                    raise ContentError(f"Cannot show document {content_id}: {e}")
+
+        # Prepare content info
+        content_info = {
+            'id': content_id,
+            'name': content_data.get('name', 'Unknown'),
+            'type': content_type,
+            'url': storage_path,
+        }
+        if content_type == 'image':
+            content_info['duration'] = (content_data.get('duration')
+                                        or self.config.get("image_duration_seconds",
+                                                           DEFAULT_IMAGE_DURATION))
+        elif pages:
+            content_info['pages'] = pages
+            content_info['pageDuration'] = (content_data.get('duration')
+                                            or self.config.get("document_page_seconds",
+                                                               DEFAULT_IMAGE_DURATION))
+            content_info['duration'] = content_info['pageDuration'] * len(pages)
+        return local_path, content_info
+
+    def index_media(self, content_id, local_path):
+        """Describe a cached file in the media index unless it already is
+        (files cached by older players, or shared with another content ID)"""
+        content_hash = self.content_cache.content_hash(content_id)
+        if content_hash is None or self.media_index.has(content_id, content_hash):
+            return
+        if not self.media_index.link(content_id, content_hash):
+            self.media_index.record(content_id, content_hash, describe(local_path))
+
+    def prefetch_content(self, content_id):
+        """fetch_content() for the prefetcher: images (and the first page of
+        documents) are decoded ahead as well"""
+        local_path, content_info = self.fetch_content(content_id)
+        if content_info['type'] in ('image', 'document'):
+            renderer = self.image_renderer
+            if renderer is not None:
+                renderer.preload(content_info['pages'][0] if content_info.get('pages') else local_path)
+        return local_path, content_info
+
+    def refresh_content_metadata(self, content_ids):
+        """Batch-refresh content metadata and forget files of changed content"""
+        for content_id in self.metadata_cache.refresh(content_ids):
+            log.info(f"Content {content_id} was updated, invalidating cached file")
+            self.content_cache.remove(content_id)
+            self.prefetcher.discard(content_id)
+
+    def prefetch_upcoming(self, extra=()):
+        """Queue the next items of the content queue (and `extra`) for background download"""
+        with self.queue_lock:
+            queue = list(self.content_queue)
+            index = self.current_index
+        if not queue:
+            return
+        current_id = queue[index % len(queue)]
+        upcoming = []
+        for offset in range(1, len(queue)):
+            content_id = queue[(index + offset) % len(queue)]
+            if content_id != current_id and content_id not in upcoming:
+                upcoming.append(content_id)
+        upcoming = upcoming[:self.prefetcher.count]
+        upcoming += [cid for cid in extra if cid != current_id and cid not in upcoming]
+        self.prefetcher.schedule(upcoming)
     
     def _get_file_extension(self, storage_path, content_type):
         """Determine file extension from path or content type"""
@@ -490,155 +1051,119 @@ class PanelSenaPlayer:
         }
         return type_extensions.get(content_type, '.mp4')
 
-    def download_content(self, storage_path, local_path):
-        """Download content from Firebase Storage"""
+    def download_content(self, storage_path, local_path, storage_ref=None, cancel=None):
+        """Download content from Firebase Storage.
+
+        The file only appears at local_path once it is complete and has been
+        verified against the storage metadata; interrupted downloads are resumed.
+        """
         try:
-            print(f"[INFO] Downloading: {storage_path}")
-            
-            # Check if it's a full HTTPS URL or just a path
-            if storage_path.startswith('http://') or storage_path.startswith('https://'):
-                # It's a full URL, download directly with requests
-                print(f"[INFO] Downloading from URL...")
-                response = requests.get(storage_path, stream=True)
-                response.raise_for_status()
-                
-                with open(local_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-            else:
-                # It's a blob path, use Firebase Storage SDK
-                print(f"[INFO] Downloading from blob path...")
-                blob = self.storage_bucket.blob(storage_path)
-                blob.download_to_filename(local_path)
-            
-            print(f"[INFO] Downloaded to: {local_path}")
+            log.info(f"Downloading: {storage_path}")
+            self.downloader.download(storage_path, local_path, storage_ref=storage_ref,
+                                     cancel=cancel)
+            log.info(f"Downloaded to: {local_path}")
             return True
-        except Exception as e:
-            print(f"[ERROR] Failed to download content: {e}")
-            import traceback
-            traceback.print_exc()
+        except DownloadCancelled:
+            raise PlaybackCancelled(f"Download of {storage_path} was cancelled")
+        except DownloadError as e:
+            log.error(f"Failed to download content: {e}")
             return False
 
     def play_file(self, file_path, content_info):
-        """Play a media file using VLC via subprocess"""
+        """Play a media file with the active playback engine"""
         try:
             if not os.path.exists(file_path):
-                print(f"[ERROR] File not found: {file_path}")
+                log.error(f"File not found: {file_path}")
                 return False
 
-            print(f"[INFO] Playing: {file_path}")
-            print(f"[DEBUG] Absolute file path: {os.path.abspath(file_path)}")
-            print(f"[DEBUG] File size: {os.path.getsize(file_path)} bytes")
-            
-            # Verify the file is a valid video
-            try:
-                import mimetypes
-                mime_type, _ = mimetypes.guess_type(file_path)
-                print(f"[DEBUG] MIME type: {mime_type}")
-            except:
-                pass
-            
+            log.info(f"Playing: {file_path}")
+            log.debug(f"Absolute file path: {os.path.abspath(file_path)}")
+
+            # Probed at download time
+            media = self.media_index.get(content_info.get('id')) or {}
+            if media:
+                log.debug(f"Media: {media['container']}, video {media['video_codec']} "
+                          f"{media['width']}x{media['height']}, audio {media['audio_codec']}, "
+                          f"{media['size']} bytes")
+
             # Update state first
             self.current_content = {
                 **content_info,
+                'duration': content_info.get('duration') or media.get('duration'),
                 'startedAt': int(time.time() * 1000)
             }
 
-            # Stop any current playback
-            if hasattr(self, 'vlc_process') and self.vlc_process:
-                try:
-                    self.vlc_process.terminate()
-                    self.vlc_process.wait(timeout=2)
-                except:
-                    try:
-                        self.vlc_process.kill()
-                    except:
-                        pass
-                self.vlc_process = None
-
-            # Get absolute path
-            abs_file_path = os.path.abspath(file_path)
-            
-            # Launch VLC as subprocess with fullscreen
-            vlc_command = [
-                'vlc',
-                '--fullscreen',
-                '--no-video-title-show',
-                '--play-and-exit',
-                '--no-qt-privacy-ask',
-                '--no-qt-system-tray',
-                '--mouse-hide-timeout=0',
-                abs_file_path
-            ]
-            
-            print(f"[DEBUG] Launching VLC with command: {' '.join(vlc_command)}")
-            
-            # Start VLC process
-            self.vlc_process = subprocess.Popen(
-                vlc_command,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL
-            )
-            
-            # Wait a bit to check if it started
-            time.sleep(1)
-            
-            # Check if process is running
-            if self.vlc_process.poll() is not None:
-                print(f"[ERROR] VLC process exited immediately with code {self.vlc_process.returncode}")
+            # Hand the file to the engine; it replaces any current playback. When
+            # the engine changes, the old one stops once the new one has the screen
+            engine = self.engine_for(content_info.get('type'))
+            with self.tracer.span("engine"):
+                pages = content_info.get('pages')
+                if engine is self._image_renderer and pages:
+                    started = engine.play_pages(pages, content_info['pageDuration'])
+                elif engine is self._image_renderer:
+                    started = engine.play(file_path, content_info.get('duration'))
+                else:
+                    # VLC can't open PDFs; without the image renderer show the first page
+                    started = engine.play(pages[0] if pages else file_path)
+                previous, self.active_engine = self.active_engine, engine
+                if previous is not None and previous is not engine:
+                    previous.stop()
+            if not started:
+                self.tracer.fail("Failed to start VLC playback")
                 self.update_status("error", "Failed to start VLC playback")
                 return False
-            
-            print(f"[INFO] VLC process started successfully (PID: {self.vlc_process.pid})")
-            
+
             # Update state
             self.is_playing = True
             self.is_paused = False
 
             self.update_status("playing")
-            
-            # Monitor playback in a separate thread
-            self.monitor_playback()
 
             return True
 
         except Exception as e:
-            print(f"[ERROR] Failed to play file: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error(f"Failed to play file: {e}", exc_info=True)
+            self.tracer.fail(e)
             self.update_status("error", str(e))
             return False
 
-    def monitor_playback(self):
-        """Monitor playback and handle end of media"""
-        def check_playback():
-            while self.is_playing:
-                # Check if VLC process is still running
-                if hasattr(self, 'vlc_process') and self.vlc_process:
-                    returncode = self.vlc_process.poll()
-                    if returncode is not None:
-                        print(f"[INFO] VLC process ended with code {returncode}")
-                        self.handle_content_end()
-                        break
-                else:
-                    # Process not found, stop playback
-                    print("[INFO] VLC process not found")
-                    self.handle_content_end()
-                    break
-                time.sleep(1)
+    def handle_content_start(self):
+        """Called on the engine's supervisor thread once an item is playing"""
+        self.startup_milestone("first frame")
+        if self.tracer.first_frame() is not None:
+            # Publish the new latency summary
+            self.update_status(self.current_status())
 
-        monitor_thread = threading.Thread(target=check_playback)
-        monitor_thread.daemon = True
-        monitor_thread.start()
+    def startup_milestone(self, name):
+        """Record a startup milestone and log the startup profile once complete.
+
+        Startup is complete at the first frame, or when commands are being
+        listened to and there was nothing to resume (the display then waits for
+        the dashboard).
+        """
+        if not self.profile.mark(name):
+            return
+        log.info(f"Startup: {name} after {self.profile.marks[name]:.2f}s")
+        complete = name == "first frame" or (name == "listening" and self.resume_job is None)
+        if complete and not self.profile_reported:
+            self.profile_reported = True
+            self.profile.report(os.path.join(self.cache_dir, "startup_profile.jsonl"))
+
+    def handle_content_end(self, error=None):
+        """Handle end of content playback.
+
+        Called on the engine's supervisor thread with the engine lock held, so a
+        play command arriving meanwhile waits until the next item has started.
+        """
+        if error:
+            log.warn(f"Playback ended with error: {error}")
 
-    def handle_content_end(self):
-        """Handle end of content playback"""
         if self.content_queue and len(self.content_queue) > 0:
             # We have a queue, play next item
             self.skip_content()
         else:
             # No queue, just stop and go to idle state
-            print("[INFO] Content finished, no queue. Going to idle state.")
+            log.info("Content finished, no queue. Going to idle state.")
             self.is_playing = False
             self.is_paused = False
             self.current_content = None
@@ -646,210 +1171,247 @@ class PanelSenaPlayer:
 
     def play_from_queue(self):
         """Play next content from queue"""
-        if self.current_index < len(self.content_queue):
+        with self.queue_lock:
+            if self.current_index >= len(self.content_queue):
+                # Loop back to start
+                self.current_index = 0
+            if not self.content_queue:
+                return
             content_id = self.content_queue[self.current_index]
-            # Play the content
-            self.play_single_content(content_id)
-        else:
-            # Loop back to start
-            self.current_index = 0
-            if self.content_queue:
-                self.play_from_queue()
+        # Play the content
+        self.play_single_content(content_id)
 
     def pause_playback(self):
-        """Pause playback - not supported in subprocess mode"""
+        """Toggle pause/resume of the current item"""
         try:
-            print(f"[DEBUG] pause_playback called. is_playing={self.is_playing}, is_paused={self.is_paused}")
-            print(f"[WARN] Pause/Resume not supported in subprocess VLC mode")
-            # Note: Pausing requires using VLC's RC interface or similar
-            # For simplicity, we'll just report the current state
+            log.debug(f"pause_playback called. is_playing={self.is_playing}, is_paused={self.is_paused}")
+            engine = self.active_engine or self.engine
+            if not engine.supports_pause:
+                log.warn(f"Pause/Resume not supported in {engine.name} playback mode")
+                return
+            if not self.is_playing:
+                log.info("Nothing is playing, ignoring pause")
+                return
+
+            self.is_paused = not self.is_paused
+            engine.pause(self.is_paused)
+            log.info(f"Playback {'paused' if self.is_paused else 'resumed'}")
+            self.update_status("paused" if self.is_paused else "playing")
         except Exception as e:
-            print(f"[ERROR] Failed to pause/resume: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error(f"Failed to pause/resume: {e}", exc_info=True)
 
     def stop_playback(self):
         """Stop playback"""
+        # Abandon in-flight downloads (partials are kept for later)
+        self.play_cancel.set()
         try:
-            # Terminate VLC process if running
-            if hasattr(self, 'vlc_process') and self.vlc_process:
-                try:
-                    self.vlc_process.terminate()
-                    self.vlc_process.wait(timeout=2)
-                except:
-                    try:
-                        self.vlc_process.kill()
-                    except:
-                        pass
-                self.vlc_process = None
+            self.engine.stop()
+            if self._image_renderer is not None:
+                self._image_renderer.stop()
         except Exception as e:
-            print(f"[ERROR] Failed to stop playback: {e}")
+            log.error(f"Failed to stop playback: {e}")
+        self.active_engine = None
         
+        self.unsubscribe_schedule()
         self.is_playing = False
         self.is_paused = False
         self.current_content = None
         self.current_schedule = None
-        self.content_queue = []
-        self.current_index = 0
+        with self.queue_lock:
+            self.content_queue = []
+            self.current_index = 0
+        self.prefetcher.clear()
         self.update_status("online")
-        print("[INFO] Playback stopped")
+        log.info("Playback stopped")
 
     def skip_content(self):
         """Skip to next content"""
         if self.content_queue and len(self.content_queue) > 0:
-            self.current_index += 1
-            if self.current_index >= len(self.content_queue):
-                self.current_index = 0
+            with self.queue_lock:
+                self.current_index += 1
+                if self.current_index >= len(self.content_queue):
+                    self.current_index = 0
             self.play_from_queue()
-            print(f"[INFO] Skipped to index {self.current_index}")
+            log.info(f"Skipped to index {self.current_index}")
         else:
-            print("[INFO] No content queue, stopping playback")
+            log.info("No content queue, stopping playback")
             self.stop_playback()
 
     def set_volume(self, volume):
         """Set playback volume.
 
-        Playback runs as a `vlc` subprocess, so the unused python-vlc media-player
-        instance can't change the volume. Control the system mixer instead so the change
-        applies to the current and future VLC subprocesses.
+        The libVLC engine applies the volume to its media player directly. The system
+        mixer is set as well so the change also reaches VLC subprocesses when running
+        in subprocess mode.
         """
         self.volume = max(0, min(100, volume))
 
-        applied = False
-        # Preferred: PulseAudio/PipeWire
         try:
-            result = subprocess.run(
-                ['pactl', 'set-sink-volume', '@DEFAULT_SINK@', f'{self.volume}%'],
-                capture_output=True, text=True, timeout=5
-            )
-            applied = result.returncode == 0
-        except (FileNotFoundError, Exception) as e:
-            print(f"[DEBUG] pactl not available: {e}")
-
-        # Fallback: ALSA
-        if not applied:
-            try:
-                result = subprocess.run(
-                    ['amixer', 'set', 'Master', f'{self.volume}%'],
-                    capture_output=True, text=True, timeout=5
-                )
-                applied = result.returncode == 0
-            except (FileNotFoundError, Exception) as e:
-                print(f"[DEBUG] amixer not available: {e}")
-
-        if applied:
-            print(f"[INFO] Volume set to {self.volume}%")
-        else:
-            print(f"[WARN] Volume stored at {self.volume}% but no system mixer (pactl/amixer) available")
+            self.engine.set_volume(self.volume)
+        except Exception as e:
+            log.debug(f"Engine volume not applied: {e}")
 
+        # Mixer commands can take seconds; don't hold up the next command
+        self.loop.submit(self.apply_volume)
         self.update_status()
 
+    def apply_volume(self):
+        """Set the system mixer to the current volume (latest value wins)"""
+        with self.controls_lock:
+            self.controls.set_volume(self.volume)
+
     def set_brightness(self, brightness):
         """Set display brightness"""
         try:
             self.brightness = max(0, min(100, brightness))
-            
-            # Convert 0-100 to actual brightness value
-            # For Raspberry Pi official display, brightness is controlled via /sys/class/backlight
-            brightness_path = "/sys/class/backlight/rpi_backlight/brightness"
-            max_brightness_path = "/sys/class/backlight/rpi_backlight/max_brightness"
-            
-            # Check if running on Raspberry Pi with official display
-            if os.path.exists(brightness_path) and os.path.exists(max_brightness_path):
-                try:
-                    # Read max brightness
-                    with open(max_brightness_path, 'r') as f:
-                        max_brightness = int(f.read().strip())
-                    
-                    # Calculate actual brightness value
-                    actual_brightness = int((self.brightness / 100.0) * max_brightness)
-                    
-                    # Write brightness value
-                    with open(brightness_path, 'w') as f:
-                        f.write(str(actual_brightness))
-                    
-                    print(f"[INFO] Display brightness set to {self.brightness}% (value: {actual_brightness}/{max_brightness})")
-                except PermissionError:
-                    print(f"[WARN] Permission denied to set brightness. Run with sudo or add user to video group.")
-                    print(f"[WARN] To fix: sudo usermod -a -G video $USER")
-                except Exception as e:
-                    print(f"[ERROR] Failed to set hardware brightness: {e}")
-            else:
-                # Try alternative methods for different displays
-                # Method 1: vcgencmd (for official Raspberry Pi display)
-                try:
-                    result = subprocess.run(
-                        ['vcgencmd', 'display_power', '1'],
-                        capture_output=True,
-                        text=True,
-                        timeout=5
-                    )
-                    if result.returncode == 0:
-                        print(f"[INFO] Display power on, brightness setting may require additional hardware support")
-                except Exception as e:
-                    print(f"[DEBUG] vcgencmd not available: {e}")
-                
-                # Method 2: ddcutil (for external displays with DDC/CI support)
-                try:
-                    result = subprocess.run(
-                        ['ddcutil', 'setvcp', '10', str(self.brightness)],
-                        capture_output=True,
-                        text=True,
-                        timeout=10
-                    )
-                    if result.returncode == 0:
-                        print(f"[INFO] Display brightness set to {self.brightness}% via DDC/CI")
-                    else:
-                        print(f"[WARN] ddcutil failed: {result.stderr}")
-                except FileNotFoundError:
-                    print(f"[INFO] Brightness set to {self.brightness}% (hardware control not available)")
-                except Exception as e:
-                    print(f"[DEBUG] ddcutil not available: {e}")
-            
+            self.loop.submit(self.apply_brightness)
+
             # Update status regardless of hardware control success
             self.update_status()
-            
+
         except Exception as e:
-            print(f"[ERROR] Failed to set brightness: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error(f"Failed to set brightness: {e}", exc_info=True)
+
+    def apply_brightness(self):
+        """Set the display to the current brightness (latest value wins)"""
+        with self.controls_lock:
+            self.controls.set_brightness(self.brightness)
 
     def restart_device(self):
         """Restart the Raspberry Pi"""
-        print("[INFO] Restarting device...")
+        log.info("Restarting device...")
         self.cleanup()
-        os.system('sudo reboot')
+        self.controls.reboot()
 
     def cleanup(self):
-        """Cleanup before shutdown"""
-        print("[INFO] Cleaning up...")
+        """Cleanup before shutdown (once; later calls wait for the first)"""
+        with self.cleanup_lock:
+            if not self.running:
+                return
+            self._cleanup()
+
+    def _cleanup(self):
+        log.info("Cleaning up...")
         self.running = False
+        self.connectivity.close()
+        for task in self.tasks:
+            task.cancel()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        self.prefetcher.stop()
+        self.normalizer.close()
         self.stop_playback()
         self.update_status("offline")
-
-    def run(self):
-        """Main run loop"""
+        if self.status_writer is not None:
+            self.status_writer.close(timeout=5)
+        log.stop_upload(timeout=5)
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.content_cache.save()
+        self.media_index.close()
+        self.downloader.close()
         try:
-            # Initialize status
-            self.update_status("online")
+            self.engine.close()
+            if self._image_renderer is not None:
+                self._image_renderer.close()
+        except Exception as e:
+            log.debug(f"Failed to release playback engine: {e}")
+        # run() closes its loop itself once it has returned
+        if self.owns_loop and self.started:
+            self.loop.close()
 
-            # Start heartbeat
-            self.heartbeat_thread.start()
+    async def go_online(self, snapshot=None):
+        """Connect to Firebase, reconcile resumed playback and start listening.
 
-            # Listen for commands
-            self.listen_for_commands()
+        Connecting is retried with jittered backoff until it works (or the
+        player stops), so a flaky uplink at boot never ends the process.
+        """
+        backoff = self.reconnect_backoff()
+        while self.running:
+            try:
+                await self.connect()
+                break
+            except Exception as e:
+                delay = backoff.next()
+                log.warn(f"Firebase unreachable ({e}), retrying in {delay:.0f}s")
+                await asyncio.sleep(delay)
+        if not self.running:
+            return
+
+        # Ship warnings and errors to the dashboard in rate-limited batches
+        # (including those logged while offline, from the ring buffer)
+        log.start_upload(
+            self.db.reference(f'users/{self.user_id}/displayLogs/{self.display_id}'),
+            level=self.config.get("log_upload_level", "warn"),
+            interval=self.config.get("log_upload_interval", 60),
+            max_batch=self.config.get("log_upload_batch", 200),
+            keep=self.config.get("log_upload_keep", 100)
+        )
+
+        if snapshot is not None:
+            try:
+                with self.profile.phase("reconcile"):
+                    await self.loop.blocking(self.reconcile_playback_state, snapshot)
+            except Exception as e:
+                log.error(f"Failed to reconcile resumed playback: {e}", exc_info=True)
 
-            # Keep running
-            print("[INFO] Player is running. Press Ctrl+C to exit.")
-            while self.running:
-                time.sleep(1)
+        # Initialize status
+        self.update_status(self.current_status())
+
+        # Listen for commands
+        with self.profile.phase("listen"):
+            await self.loop.blocking(self.listen_for_commands)
+        self.startup_milestone("listening")
+
+    async def main(self):
+        """Resume playback, start the heartbeat and go online.
+
+        Returns once listening for commands, or right away when resuming
+        playback from local state (going online then continues in the
+        background).
+        """
+        # Resume what was playing before the restart, straight from the cache
+        with self.profile.phase("restore"):
+            snapshot = await self.loop.blocking(self.restore_playback_state)
+
+        self.spawn(self.heartbeat_loop())
+
+        if snapshot is None:
+            await self.go_online()
+        else:
+            self.spawn(self.go_online(snapshot))
+
+    def spawn(self, coro):
+        """Run a coroutine of this player on the loop (cancelled on cleanup)"""
+        future = self.loop.spawn(coro)
+        self.tasks.append(future)
+        return future
+
+    def start(self):
+        """Run the player in the background, e.g. as a virtual device.
+
+        Returns a Future that is done once the player is online (see main()).
+        """
+        self.started = True
+        self.loop.start()
+        return self.spawn(self.main())
+
+    def run(self):
+        """Main run loop: runs the event loop until SIGINT/SIGTERM"""
+        try:
+            log.info("Player is running. Press Ctrl+C to exit.")
+            self.loop.run(self.main())
 
         except KeyboardInterrupt:
-            print("\n[INFO] Shutting down...")
+            log.info("Shutting down...")
+        except PlayerError:
+            # Exit with an error so systemd restarts the player
+            raise
         except Exception as e:
-            print(f"[ERROR] Unexpected error: {e}")
+            log.error(f"Unexpected error: {e}")
         finally:
             self.cleanup()
+            self.loop.close()
 
 def main():
     """Main entry point"""
@@ -857,8 +1419,12 @@ def main():
     print("PanelSena Raspberry Pi Player")
     print("=" * 50)
 
-    player = PanelSenaPlayer()
-    player.run()
+    try:
+        player = PanelSenaPlayer()
+        player.run()
+    except PlayerError as e:
+        log.error(f"Player stopped: {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+PanelSena Content Prefetcher
+Downloads upcoming queue items in the background while the current item plays
+"""
+
+import os
+import threading
+import log
+
+
+class Prefetcher:
+    """Background look-ahead for the content queue
+
+    `fetch(content_id)` must return `(local_path, content_info)` and raise on failure.
+    The same content is never fetched twice at once: if playback asks for an item
+    that is still being prefetched, it waits for that download instead of starting
+    a second one.
+    """
+
+    def __init__(self, fetch, count=2):
+        self.fetch = fetch
+        self.count = max(0, int(count))
+        self._cond = threading.Condition()
+        self._pending = []
+        self._inflight = set()
+        self._ready = {}
+        self._running = True
+
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.daemon = True
+        if self.count > 0:
+            self._thread.start()
+
+    def schedule(self, content_ids):
+        """Replace the look-ahead list with these content IDs (in play order)"""
+        if self.count <= 0:
+            return
+        with self._cond:
+            self._pending = [cid for cid in content_ids
+                             if cid not in self._inflight and not self._is_ready(cid)]
+            if self._pending:
+                log.debug(f"Prefetch scheduled: {self._pending}")
+            self._cond.notify_all()
+
+    def clear(self):
+        """Drop pending look-ahead work and prefetched results"""
+        with self._cond:
+            self._pending = []
+            self._ready.clear()
+
+    def discard(self, content_id):
+        """Forget a prefetched result (e.g. because the content changed)"""
+        with self._cond:
+            self._ready.pop(content_id, None)
+
+    def get(self, content_id):
+        """Return `(local_path, content_info)` for an item about to play
+
+        Uses the prefetched result when there is one, waits for an in-flight
+        prefetch of the same item, and otherwise fetches it in the calling thread.
+        """
+        with self._cond:
+            if content_id in self._pending:
+                self._pending.remove(content_id)
+            while content_id in self._inflight:
+                self._cond.wait()
+            if self._is_ready(content_id):
+                log.info(f"Using prefetched content: {content_id}")
+                return self._ready.pop(content_id)
+            self._inflight.add(content_id)
+
+        try:
+            return self.fetch(content_id)
+        finally:
+            with self._cond:
+                self._inflight.discard(content_id)
+                self._cond.notify_all()
+
+    def stop(self):
+        """Stop the background worker"""
+        with self._cond:
+            self._running = False
+            self._pending = []
+            self._cond.notify_all()
+
+    def _is_ready(self, content_id):
+        """Whether a prefetched result exists and its file is still on disk"""
+        result = self._ready.get(content_id)
+        if result is None:
+            return False
+        if not os.path.exists(result[0]):
+            del self._ready[content_id]
+            return False
+        return True
+
+    def _worker(self):
+        """Fetch pending items one at a time"""
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                content_id = self._pending.pop(0)
+                self._inflight.add(content_id)
+
+            result = None
+            try:
+                result = self.fetch(content_id)
+                log.info(f"Prefetched content: {content_id}")
+            except Exception as e:
+                log.warn(f"Prefetch failed for {content_id}: {e}")
+            finally:
+                with self._cond:
+                    self._inflight.discard(content_id)
+                    if result is not None:
+                        self._ready[content_id] = result
+                    self._cond.notify_all()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+PanelSena Slideshow
+Full-screen still images and document pages without a media player: decoded
+and scaled with Pillow, shown in one long-lived Tk window and timed per item,
+with the next slide decoded ahead of time
+"""
+
+import os
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from engines import PlaybackEngine, ENGINE_IMAGE
+from supervisor import EVENT_STARTED, EVENT_ENDED
+import log
+import metrics
+
+# Pillow and tkinter, imported by the first ImageRenderer
+Image = None
+ImageOps = None
+ImageTk = None
+tkinter = None
+
+# Seconds an image stays up when neither the item nor the config says otherwise
+DEFAULT_IMAGE_DURATION = 10
+
+# How often the UI thread runs calls queued by other threads (milliseconds)
+CALL_POLL_MS = 10
+
+# Preloaded slides kept as Tk images (each holds a full-screen bitmap in the X server)
+PREPARED_FRAMES = 2
+
+DECODE_SECONDS = metrics.histogram(
+    "panelsena_image_decode_seconds", "Time to decode and scale an image to the screen",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+FRAME_CACHE_REQUESTS = metrics.counter(
+    "panelsena_frame_cache_requests_total", "Decoded frame lookups when showing an image",
+    labels=("result",))
+
+
+def _import_pillow():
+    global Image, ImageOps, ImageTk, tkinter
+    if Image is not None:
+        return
+    try:
+        import tkinter as tkinter_module
+        from PIL import Image as image_module, ImageOps as ops_module, ImageTk as imagetk_module
+    except ImportError as e:
+        raise RuntimeError(f"Pillow with Tk support is not installed ({e})")
+    tkinter = tkinter_module
+    ImageOps = ops_module
+    ImageTk = imagetk_module
+    Image = image_module
+
+
+def fit_to_screen(path, size):
+    """Decode `path` into an RGB frame of exactly `size`, letterboxed in black"""
+    _import_pillow()
+    with Image.open(path) as image:
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale, much faster for large photos
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    scale = min(size[0] / image.width, size[1] / image.height)
+    fitted = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    if fitted != image.size:
+        image = image.resize(fitted, Image.LANCZOS)
+    if image.size == size:
+        return image
+    frame = Image.new('RGB', size)
+    frame.paste(image, ((size[0] - image.width) // 2, (size[1] - image.height) // 2))
+    return frame
+
+
+class FrameCache:
+    """Decoded frames by file path, least recently used dropped past `max_bytes`
+
+    Content files are never rewritten in place (updated content gets a new
+    file), so the path and modification time identify a frame.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()     # (path, mtime) -> frame
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path):
+        try:
+            return path, os.path.getmtime(path)
+        except OSError:
+            return path, None
+
+    def get(self, path):
+        key = self._key(path)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+            return frame
+
+    def put(self, path, frame):
+        key = self._key(path)
+        size = frame.width * frame.height * 3
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._frames:
+                self._frames.move_to_end(key)
+                return
+            self._frames[key] = frame
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, old = self._frames.popitem(last=False)
+                self._bytes -= old.width * old.height * 3
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._bytes = 0
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+
+class ImageRenderer(PlaybackEngine):
+    """Still images in a full-screen Tk window, each shown for its own duration
+
+    Tk is only touched from the renderer's UI thread (Tcl may be built without
+    thread support): other threads, play(), stop() and pause() included, queue
+    calls that it runs from a short poll. Frames are decoded at screen resolution on a decode
+    thread and kept in a FrameCache; preload() decodes an upcoming slide and
+    turns it into a Tk image ahead of time, so showing it is a pointer swap on
+    the already mapped window rather than a decode or a new window. The end of
+    each slide is a Tk timer posted to the supervisor like any engine's end of
+    media; play_pages() shows several images as one item (document pages),
+    decoding each next page while the current one is up. Raises RuntimeError
+    when Pillow, Tk or an X11 display is missing.
+    """
+
+    name = ENGINE_IMAGE
+    supports_pause = True
+
+    def __init__(self, on_end=None, on_start=None, cache_mb=64):
+        _import_pillow()
+        if not os.environ.get('DISPLAY'):
+            raise RuntimeError("no X11 display")
+        super().__init__(on_end, on_start)
+        self.frames = FrameCache(cache_mb * 1024 * 1024)
+        self.size = None
+        self.root = None
+        self.label = None
+        self._photo = None           # Tk image on screen (Tk needs a reference)
+        self._prepared = OrderedDict()   # path -> Tk image of a preloaded slide
+        self._timer = None
+        self._timer_args = None      # (generation, duration, pages left) of the timer
+        self._deadline = None
+        self._remaining = None       # Seconds left on a paused slide
+        self._decoding = {}          # path -> Future of a preload in progress
+        self._decode_lock = threading.Lock()
+        self._decoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode")
+        self._calls = queue.Queue()  # (fn, args) to run on the UI thread
+
+        self._ready = threading.Event()
+        self._error = None
+        self._ui_thread = threading.Thread(target=self._run_ui, name="slideshow")
+        self._ui_thread.daemon = True
+        self._ui_thread.start()
+        self._ready.wait(10)
+        if self.root is None:
+            self.supervisor.close()
+            self._decoder.shutdown(wait=False)
+            raise RuntimeError(f"cannot open the slideshow window ({self._error or 'timed out'})")
+        log.info(f"Image renderer ready at {self.size[0]}x{self.size[1]}")
+
+    def _run_ui(self):
+        try:
+            root = tkinter.Tk()
+            root.title("PanelSena")
+            root.configure(background='black', cursor='none')
+            label = tkinter.Label(root, background='black', borderwidth=0, highlightthickness=0)
+            label.pack(fill='both', expand=True)
+            root.withdraw()
+            root.after(CALL_POLL_MS, self._run_calls)
+            self.size = (root.winfo_screenwidth(), root.winfo_screenheight())
+            self.label = label
+            self.root = root
+        except Exception as e:
+            self._error = e
+            return
+        finally:
+            self._ready.set()
+        try:
+            root.mainloop()
+        finally:
+            root.destroy()
+
+    def _call(self, fn, *args):
+        """Run `fn(*args)` on the UI thread"""
+        self._calls.put((fn, args))
+
+    def _run_calls(self):
+        """UI thread: run the queued calls, then poll again"""
+        while True:
+            try:
+                fn, args = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception as e:
+                log.error(f"Slideshow call {fn.__name__} failed: {e}", exc_info=True)
+        self.root.after(CALL_POLL_MS, self._run_calls)
+
+    # Decoding
+
+    def _decode(self, path):
+        frame = self.frames.get(path)
+        if frame is None:
+            started = time.monotonic()
+            frame = fit_to_screen(path, self.size)
+            DECODE_SECONDS.observe(time.monotonic() - started)
+            self.frames.put(path, frame)
+        return frame
+
+    def _frame(self, path):
+        """Frame for `path`, from the cache, a preload in progress or a fresh decode"""
+        frame = self.frames.get(path)
+        if frame is not None:
+            FRAME_CACHE_REQUESTS.inc(result='hit')
+            return frame
+        with self._decode_lock:
+            pending = self._decoding.get(path)
+        if pending is not None:
+            FRAME_CACHE_REQUESTS.inc(result='pending')
+            return pending.result()
+        FRAME_CACHE_REQUESTS.inc(result='miss')
+        return self._decode(path)
+
+    def preload(self, path):
+        """Decode `path` in the background and have it ready as the next slide"""
+        with self._decode_lock:
+            if path in self._decoding:
+                return
+            future = self._decoder.submit(self._preload, path)
+            self._decoding[path] = future
+        future.add_done_callback(lambda _: self._preloaded(path))
+
+    def _preload(self, path):
+        frame = self._decode(path)
+        self._call(self._prepare, path, frame)
+        return frame
+
+    def _preloaded(self, path):
+        with self._decode_lock:
+            future = self._decoding.pop(path, None)
+        if future is not None and not future.cancelled() and future.exception() is not None:
+            log.warn(f"Failed to preload image {path}: {future.exception()}")
+
+    # Playback
+
+    def play(self, file_path, duration=None):
+        return self.play_pages([file_path], duration)
+
+    def play_pages(self, paths, duration=None):
+        """Show images one after another as one item, `duration` seconds each"""
+        duration = duration or DEFAULT_IMAGE_DURATION
+        try:
+            frame = self._frame(paths[0])
+        except Exception as e:
+            log.error(f"Failed to decode image {paths[0]}: {e}")
+            return False
+        with self._lock:
+            generation = self._begin()
+        rest = tuple(paths[1:])
+        if rest:
+            self.preload(rest[0])
+        self._call(self._show, paths[0], frame, generation, duration, rest, True)
+        if rest:
+            log.info(f"Showing {len(paths)} pages for {duration}s each: {paths[0]}")
+        else:
+            log.info(f"Showing image for {duration}s: {paths[0]}")
+        return True
+
+    def stop(self):
+        with self._lock:
+            self._begin()
+            self._ended_at = None
+        if self.root is not None:
+            self._call(self._hide)
+
+    def pause(self, paused):
+        self._call(self._pause, paused, self._generation)
+        return True
+
+    def close(self):
+        super().close()
+        self._decoder.shutdown(wait=False)
+        self.frames.clear()
+        self._call(self.root.quit)
+        self._ui_thread.join(5)
+
+    def _prepare(self, path, frame):
+        if path in self._prepared:
+            self._prepared.move_to_end(path)
+            return
+        self._prepared[path] = ImageTk.PhotoImage(frame)
+        while len(self._prepared) > PREPARED_FRAMES:
+            self._prepared.popitem(last=False)
+
+    def _turn_page(self, generation, duration, rest):
+        """Decode thread: show the next page of a sequence"""
+        if generation != self._generation:
+            return
+        try:
+            frame = self._decode(rest[0])
+        except Exception as e:
+            self.supervisor.post(EVENT_ENDED, generation, f"Failed to decode page {rest[0]}: {e}")
+            return
+        if len(rest) > 1:
+            self.preload(rest[1])
+        self._call(self._show, rest[0], frame, generation, duration, rest[1:], False)
+
+    # UI thread
+
+    def _show(self, path, frame, generation, duration, rest, first):
+        if generation != self._generation:
+            return
+        photo = self._prepared.pop(path, None)
+        if photo is None:
+            photo = ImageTk.PhotoImage(frame)
+        self.label.configure(image=photo)
+        self._photo = photo
+        if self.root.state() != 'normal':
+            self.root.deiconify()
+            self.root.attributes('-fullscreen', True)
+            self.root.attributes('-topmost', True)
+        self.root.update_idletasks()
+
+        self._cancel_timer()
+        self._remaining = None
+        self._start_timer(duration, generation, duration, rest)
+        if first:
+            self.supervisor.post(EVENT_STARTED, generation)
+
+    def _start_timer(self, delay, *args):
+        self._deadline = time.monotonic() + delay
+        self._timer_args = args
+        self._timer = self.root.after(int(delay * 1000), self._expired, *args)
+
+    def _expired(self, generation, duration, rest):
+        self._timer = None
+        if rest and generation == self._generation:
+            self._decoder.submit(self._turn_page, generation, duration, rest)
+        else:
+            self.supervisor.post(EVENT_ENDED, generation)
+
+    def _hide(self):
+        self._cancel_timer()
+        self._remaining = None
+        self.root.withdraw()
+        self.label.configure(image='')
+        self._photo = None
+        self._prepared.clear()
+
+    def _pause(self, paused, generation):
+        if generation != self._generation:
+            return
+        if paused and self._timer is not None:
+            self._cancel_timer()
+            self._remaining = max(0.0, self._deadline - time.monotonic())
+        elif not paused and self._remaining is not None:
+            self._start_timer(self._remaining, *self._timer_args)
+            self._remaining = None
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self.root.after_cancel(self._timer)
+            self._timer = None
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+PanelSena Startup Profiling
+Phase timings from process start to the first frame on screen, and a helper
+for running independent initialization steps in parallel
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import log
+
+# Boots kept in the startup profile log
+PROFILE_HISTORY = 50
+
+
+def process_uptime():
+    """Seconds since this process was started (0 if unknown)"""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # The command name may contain spaces; fields after it are fixed
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        start_ticks = int(fields[19])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupProfile:
+    """Collect how long each startup phase took, relative to process start
+
+    Phases may overlap (they run in parallel); each is reported with its start
+    offset and duration. `mark()` records a milestone such as the first frame.
+    """
+
+    def __init__(self):
+        # Include interpreter startup and module imports before we got here
+        self.started = time.monotonic() - process_uptime()
+        self.phases = []    # (name, start offset, duration) in seconds
+        self.marks = {}     # name -> offset in seconds
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as a named phase"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                self.phases.append((name, start - self.started, end - start))
+
+    def mark(self, name):
+        """Record a milestone the first time it happens. Returns True if it was new"""
+        with self._lock:
+            if name in self.marks:
+                return False
+            self.marks[name] = time.monotonic() - self.started
+            return True
+
+    def summary(self):
+        """Timings in milliseconds, as stored in the profile log"""
+        with self._lock:
+            return {
+                'phases': [{'name': name, 'startMs': int(start * 1000), 'ms': int(duration * 1000)}
+                           for name, start, duration in sorted(self.phases, key=lambda p: p[1])],
+                'marks': {name: int(offset * 1000) for name, offset in self.marks.items()},
+            }
+
+    def report(self, path=None):
+        """Print the phase breakdown and append it to the JSON-lines log at `path`"""
+        summary = self.summary()
+        log.info("Startup profile (ms since process start):")
+        for phase in summary['phases']:
+            log.info(f"  {phase['name']:<20} at {phase['startMs']:>6}  took {phase['ms']:>6}")
+        for name, offset in sorted(summary['marks'].items(), key=lambda m: m[1]):
+            log.info(f"  {name:<20} at {offset:>6}")
+
+        if path is None:
+            return
+        summary['bootAt'] = int(time.time() * 1000)
+        try:
+            try:
+                with open(path, 'r') as f:
+                    lines = f.read().splitlines()[-(PROFILE_HISTORY - 1):]
+            except FileNotFoundError:
+                lines = []
+            lines.append(json.dumps(summary))
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warn(f"Failed to save startup profile: {e}")
+
+
+class BackgroundInit:
+    """Run `factory()` on its own thread, timed as a startup phase
+
+    `get()` waits for the result and re-raises the factory's exception.
+    """
+
+    def __init__(self, name, factory, profile=None):
+        self.name = name
+        self._factory = factory
+        self._profile = profile
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name=f"init-{name}")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def get(self, timeout=None):
+        """Wait for the result"""
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise TimeoutError(f"{self.name} initialization still running")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _run(self):
+        try:
+            if self._profile is not None:
+                with self._profile.phase(self.name):
+                    self._result = self._factory()
+            else:
+                self._result = self._factory()
+        except Exception as e:
+            self._error = e
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+PanelSena Status Writer
+Writes the display status node as deltas against the last acknowledged state,
+from a single background thread that coalesces bursts of updates
+"""
+
+import copy
+import json
+import time
+import threading
+import log
+import metrics
+
+# Longest pause between retries of a failed status write
+MAX_RETRY_DELAY = 30
+
+STATUS_WRITE_SECONDS = metrics.histogram(
+    "panelsena_status_write_seconds", "Latency of status writes", labels=("mode",))
+STATUS_WRITE_FAILURES = metrics.counter(
+    "panelsena_status_write_failures_total", "Failed status writes")
+STATUS_WRITE_BYTES = metrics.counter(
+    "panelsena_status_write_bytes_total", "JSON bytes sent in status writes")
+
+
+def status_delta(old, new, prefix=""):
+    """Multi-path update turning `old` into `new`
+
+    Nested dicts are compared field by field and written as `parent/child` paths;
+    anything else (including lists such as the content queue) is written whole
+    when it differs. Fields that disappeared are written as None, which deletes
+    them in the Realtime Database.
+    """
+    delta = {}
+    for key in set(old) | set(new):
+        path = f"{prefix}{key}"
+        if key not in new or new[key] is None:
+            if old.get(key) is not None:
+                delta[path] = None
+        elif isinstance(new[key], dict) and isinstance(old.get(key), dict):
+            delta.update(status_delta(old[key], new[key], prefix=f"{path}/"))
+        elif old.get(key) != new[key]:
+            delta[path] = new[key]
+    return delta
+
+
+class StatusWriter:
+    """Send only the status fields that changed since the last successful write
+
+    The first write (and the first after a failure, when it is unknown what the
+    database holds) replaces the whole node with `set()`. After that every write is
+    an `update()` of just the changed fields, so a heartbeat with nothing else
+    changed carries only `lastHeartbeat`.
+
+    Callers `publish()` the full desired state and return immediately. One writer
+    thread waits `debounce` seconds after the first publish of a burst and then
+    writes only the latest state, so e.g. dragging the volume slider produces a
+    single write instead of dozens. `flush()` waits for pending state to be written.
+
+    With a `connectivity` (see connectivity.py) a failed write marks the display
+    offline and the writer holds the latest state until it is back online, then
+    writes it whole; without one it retries on its own with growing pauses.
+    """
+
+    def __init__(self, status_ref, debounce=0.25, connectivity=None):
+        self.status_ref = status_ref
+        self.debounce = debounce
+        self.connectivity = connectivity
+        self._acked = None
+        self.bytes_written = 0
+        self.writes = 0
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._writing = False
+        self._flushing = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        if connectivity is not None:
+            connectivity.on_change(self._connectivity_changed)
+
+    def publish(self, state):
+        """Queue `state` (the full desired status) for writing; never blocks on the network"""
+        with self._cond:
+            self._pending = state
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Write pending state now and wait for it. Returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            try:
+                while self._pending is not None or self._writing:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                # Later publishes are debounced (and held offline) again
+                self._flushing = False
+
+    def close(self, timeout=None):
+        """Flush and stop the writer thread"""
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        return flushed
+
+    def write(self, state):
+        """Write `state` synchronously. Raises on failure"""
+        started = time.monotonic()
+        try:
+            if self._acked is None:
+                mode = 'set'
+                payload = state
+                self.status_ref.set(payload)
+            else:
+                mode = 'update'
+                payload = status_delta(self._acked, state)
+                if not payload:
+                    return {}
+                self.status_ref.update(payload)
+        except Exception:
+            # We no longer know what the database holds, resend everything next time
+            self._acked = None
+            STATUS_WRITE_FAILURES.inc()
+            raise
+
+        STATUS_WRITE_SECONDS.observe(time.monotonic() - started, mode=mode)
+        self._acked = copy.deepcopy(state)
+        size = len(json.dumps(payload))
+        STATUS_WRITE_BYTES.inc(size)
+        self.bytes_written += size
+        self.writes += 1
+        return payload
+
+    def _offline(self):
+        return self.connectivity is not None and not self.connectivity.online
+
+    def _connectivity_changed(self, online):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _run(self):
+        """Writer thread: coalesce published states and write the latest"""
+        failures = 0
+        while True:
+            with self._cond:
+                # While offline only the latest state is held (a shutdown flush
+                # still gets one attempt)
+                while not self._closed and (self._pending is None or
+                                            (self._offline() and not self._flushing)):
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+
+                # Let the burst settle: later publishes replace the pending state
+                retry_delay = 0
+                if failures and self.connectivity is None:
+                    retry_delay = min(MAX_RETRY_DELAY, 2 ** failures)
+                settle_until = time.monotonic() + max(self.debounce, retry_delay)
+                while not self._flushing and not self._closed:
+                    remaining = settle_until - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                state = self._pending
+                self._pending = None
+                self._writing = True
+
+            try:
+                written = self.write(state)
+                failures = 0
+                if self.connectivity is not None:
+                    self.connectivity.succeeded()
+                log.debug(f"Firebase status updated, fields: {sorted(written)}")
+            except Exception as e:
+                failures += 1
+                if self.connectivity is not None:
+                    self.connectivity.failed(e)
+                log.error(f"Failed to update status (attempt {failures}): {e}")
+                with self._cond:
+                    # Retry unless something newer was published meanwhile
+                    if self._pending is None:
+                        self._pending = state
+                    if self._flushing and (failures >= 3 or self._offline()):
+                        # Don't hold a shutdown flush hostage to a dead network
+                        self._pending = None
+            finally:
+                with self._cond:
+                    self._writing = False
+                    if self._pending is None:
+                        self._flushing = False
+                    self._cond.notify_all()
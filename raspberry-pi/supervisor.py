@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+PanelSena Playback Supervisor
+One long-lived thread that waits for playback events and player process exits
+and hands them to the playback engine in order
+"""
+
+import os
+import time
+import selectors
+import threading
+from collections import deque
+import log
+
+# How often processes are polled when the kernel has no pidfd support
+POLL_INTERVAL = 0.1
+
+EVENT_STARTED = "started"
+EVENT_ENDED = "ended"
+
+
+class PlaybackSupervisor:
+    """Deliver playback events to `handler(kind, generation, error, at)` on one thread
+
+    Engines `post()` events from any thread (e.g. libVLC's event thread) and
+    `watch()` player processes. The thread blocks in a selector on a wake-up pipe
+    and on a pidfd per watched process, so a process exit is noticed as soon as it
+    happens. On kernels without `pidfd_open` watched processes are polled every
+    POLL_INTERVAL seconds instead. `at` is the `time.monotonic()` the event was
+    observed.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self._lock = threading.Lock()
+        self._events = deque()
+        self._polled = []              # (process, generation) without a pidfd
+        self._running = True
+
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def post(self, kind, generation, error=None):
+        """Queue an event for the supervisor thread"""
+        with self._lock:
+            self._events.append((kind, generation, error, time.monotonic()))
+        self._wake()
+
+    def watch(self, process, generation):
+        """Report an EVENT_ENDED for `generation` when `process` exits"""
+        pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(process.pid)
+            except OSError:
+                # Already reaped, or no kernel support (Linux < 5.3)
+                pidfd = None
+
+        with self._lock:
+            if pidfd is not None:
+                self._selector.register(pidfd, selectors.EVENT_READ, (process, generation))
+            else:
+                self._polled.append((process, generation))
+        self._wake()
+
+    def close(self):
+        """Stop the supervisor thread"""
+        self._running = False
+        self._wake()
+        self._thread.join(timeout=2)
+
+    def _wake(self):
+        """Interrupt the selector wait"""
+        try:
+            os.write(self._wake_w, b'\0')
+        except (BlockingIOError, OSError):
+            # Pipe full means a wake-up is pending anyway
+            pass
+
+    def _exited(self, process, generation, at):
+        """Turn a process exit into an EVENT_ENDED"""
+        returncode = process.wait()
+        error = None
+        if returncode and returncode > 0:
+            # Negative codes are signals, i.e. we stopped it ourselves
+            error = f"VLC process exited with code {returncode}"
+        log.info(f"VLC process {process.pid} ended with code {returncode}")
+        self._events.append((EVENT_ENDED, generation, error, at))
+
+    def _run(self):
+        """Supervisor thread"""
+        while self._running:
+            with self._lock:
+                timeout = POLL_INTERVAL if self._polled else None
+            ready = self._selector.select(timeout)
+            now = time.monotonic()
+
+            with self._lock:
+                for key, _ in ready:
+                    if key.data is None:
+                        try:
+                            while os.read(self._wake_r, 4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        continue
+                    # pidfd readable: the process has exited
+                    self._selector.unregister(key.fileobj)
+                    os.close(key.fileobj)
+                    self._exited(key.data[0], key.data[1], now)
+
+                still_running = []
+                for process, generation in self._polled:
+                    if process.poll() is None:
+                        still_running.append((process, generation))
+                    else:
+                        self._exited(process, generation, now)
+                self._polled = still_running
+
+                events = list(self._events)
+                self._events.clear()
+
+            for kind, generation, error, at in events:
+                try:
+                    self.handler(kind, generation, error, at)
+                except Exception as e:
+                    log.error(f"Playback event handler failed: {e}", exc_info=True)
+
+        for key in list(self._selector.get_map().values()):
+            if key.data is not None:
+                os.close(key.fileobj)
+        self._selector.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
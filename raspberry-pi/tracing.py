@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+PanelSena Transition Tracing
+Timed spans for each play or skip, from the dashboard command to the first
+frame on screen, kept locally and summarized for the display status
+"""
+
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import log
+
+# Traces kept in memory for the status summary
+TRACE_HISTORY = 100
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Trace:
+    """One transition: spans timed relative to when the trigger happened
+
+    Spans are (name, start offset, duration) in seconds and may nest, e.g. a
+    `download` inside `fetch`. `delivery` covers the time between the dashboard
+    creating the command and the player starting to execute it (RTDB delivery
+    and queueing), measured against the command's timestamp.
+    """
+
+    def __init__(self, trigger, detail=None, created=None):
+        self.trigger = trigger
+        self.detail = detail
+        self.at = time.time()
+        self.started = time.monotonic()
+        self.spans = []
+        self.status = None
+        self.error = None
+        self.duration = None
+        self._lock = threading.Lock()
+
+        # Clocks may disagree slightly; ignore a command "from the future"
+        if created is not None and 0 <= self.at - created < 24 * 3600:
+            self.started -= self.at - created
+            self.spans.append(('delivery', 0.0, self.at - created))
+
+    def add_span(self, name, start, end):
+        """Record a span between two `time.monotonic()` readings"""
+        with self._lock:
+            self.spans.append((name, start - self.started, end - start))
+
+    def finish(self, status, error=None):
+        """Close the trace. Returns False if it was already closed"""
+        with self._lock:
+            if self.status is not None:
+                return False
+            self.status = status
+            self.error = error
+            self.duration = time.monotonic() - self.started
+            return True
+
+    def to_dict(self):
+        """Milliseconds, as stored in the trace log"""
+        with self._lock:
+            data = {
+                'trigger': self.trigger,
+                'at': int(self.at * 1000),
+                'status': self.status,
+                'totalMs': int((self.duration or 0) * 1000),
+                'spans': [{'name': name, 'startMs': int(start * 1000), 'ms': int(duration * 1000)}
+                          for name, start, duration in sorted(self.spans, key=lambda s: s[1])],
+            }
+        if self.detail:
+            data['detail'] = self.detail
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class Tracer:
+    """Follow the transition in progress and keep the latest finished traces
+
+    `begin()` starts a trace on the calling thread; `span()` blocks on that
+    thread are added to it (and are no-ops elsewhere, e.g. on the prefetch
+    worker). The trace stays pending after the thread is done with it until
+    `first_frame()` or `fail()` closes it, typically on the engine's thread.
+    Finished traces are appended to the JSON-lines file at `path`.
+    """
+
+    def __init__(self, path=None, keep=TRACE_HISTORY):
+        self.path = path
+        self.keep = keep
+        self.traces = deque(maxlen=keep)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = None
+        self._lines = None
+
+    def begin(self, trigger, detail=None, created=None):
+        """Start tracing a transition; a still pending one was superseded"""
+        trace = Trace(trigger, detail, created)
+        with self._lock:
+            previous, self._pending = self._pending, trace
+        if previous is not None:
+            self._close(previous, 'superseded')
+        self._local.trace = trace
+        return trace
+
+    def end(self):
+        """The calling thread is done adding spans"""
+        self._local.trace = None
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block in the calling thread's trace, if any"""
+        trace = getattr(self._local, 'trace', None)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            if trace is not None:
+                trace.add_span(name, start, time.monotonic())
+
+    def first_frame(self):
+        """The new item is on screen: close the pending trace"""
+        with self._lock:
+            trace, self._pending = self._pending, None
+        if trace is not None:
+            # From the end of the last traced step until the engine reported playback
+            with trace._lock:
+                offset = max((start + duration for _, start, duration in trace.spans), default=0.0)
+            trace.add_span('first-frame', trace.started + offset, time.monotonic())
+            self._close(trace, 'ok')
+        return trace
+
+    def fail(self, error):
+        """The transition did not reach the screen"""
+        with self._lock:
+            trace, self._pending = self._pending, None
+        if trace is not None:
+            self._close(trace, 'error', str(error))
+
+    def summary(self):
+        """Latency summary of recent successful traces for the status node, or None"""
+        with self._lock:
+            traces = [t for t in self.traces if t.status == 'ok']
+        if not traces:
+            return None
+        totals = [t.duration * 1000 for t in traces]
+        last = traces[-1].to_dict()
+        spans = {}
+        for span in last['spans']:
+            spans[span['name']] = spans.get(span['name'], 0) + span['ms']
+        return {
+            'count': len(traces),
+            'p50Ms': int(percentile(totals, 0.5)),
+            'p95Ms': int(percentile(totals, 0.95)),
+            'lastMs': last['totalMs'],
+            'lastSpans': spans,
+        }
+
+    def recent(self):
+        """Finished traces, oldest first"""
+        with self._lock:
+            traces = list(self.traces)
+        return [t.to_dict() for t in traces]
+
+    def _close(self, trace, status, error=None):
+        if not trace.finish(status, error):
+            return
+        with self._lock:
+            self.traces.append(trace)
+        data = trace.to_dict()
+        stages = ", ".join(f"{s['name']} {s['ms']}" for s in data['spans'])
+        log.info(f"Transition ({trace.trigger}) {status} in {data['totalMs']} ms: {stages}")
+        self._append(data)
+
+    def _append(self, data):
+        """Append to the trace log, trimming it to `keep` lines now and then"""
+        if self.path is None:
+            return
+        try:
+            with self._lock:
+                if self._lines is None:
+                    try:
+                        with open(self.path, 'r') as f:
+                            self._lines = sum(1 for _ in f)
+                    except FileNotFoundError:
+                        self._lines = 0
+                if self._lines >= 2 * self.keep:
+                    with open(self.path, 'r') as f:
+                        lines = f.read().splitlines()[-(self.keep - 1):]
+                    lines.append(json.dumps(data))
+                    tmp_path = self.path + ".tmp"
+                    with open(tmp_path, 'w') as f:
+                        f.write("\n".join(lines) + "\n")
+                    os.replace(tmp_path, self.path)
+                    self._lines = len(lines)
+                else:
+                    with open(self.path, 'a') as f:
+                        f.write(json.dumps(data) + "\n")
+                    self._lines += 1
+        except OSError as e:
+            log.warn(f"Failed to save transition trace: {e}")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+PanelSena Transport
+Connection to the Firebase backend (Realtime Database, Firestore, Storage),
+kept behind one small interface so the player can be pointed at other backends
+"""
+
+from startup import BackgroundInit
+
+
+class FirebaseTransport:
+    """Firebase Admin SDK clients for one player
+
+    `connect(profile)` initializes the SDK and returns BackgroundInits creating
+    the Firestore client and the Storage bucket; `reference(path)` returns a
+    Realtime Database reference. By default the SDK's default app is used (and
+    reused when `connect()` is retried); give each instance its own `app_name`
+    to run several players with different credentials in one process.
+
+    Any object with the same two methods can be passed to the player instead.
+    """
+
+    def __init__(self, config, app_name=None):
+        self.config = config
+        self.app_name = app_name
+        self.app = None
+        self._db = None
+
+    def connect(self, profile=None):
+        """Initialize the SDK. Returns (firestore_init, storage_init)"""
+        # Imported here so the player can start playing before these load
+        import firebase_admin
+        from firebase_admin import credentials, db, storage, firestore
+
+        if self.app is None:
+            try:
+                self.app = (firebase_admin.get_app(self.app_name) if self.app_name
+                            else firebase_admin.get_app())
+            except ValueError:
+                cred = credentials.Certificate(self.config.get("service_account_path"))
+                options = {
+                    'databaseURL': self.config.get("database_url"),
+                    'storageBucket': self.config.get("storage_bucket")
+                }
+                if self.app_name:
+                    self.app = firebase_admin.initialize_app(cred, options, name=self.app_name)
+                else:
+                    self.app = firebase_admin.initialize_app(cred, options)
+        self._db = db
+
+        app = self.app
+        return (BackgroundInit("firestore-client", lambda: firestore.client(app), profile),
+                BackgroundInit("storage-client", lambda: storage.bucket(app=app), profile))
+
+    def reference(self, path='/'):
+        """Realtime Database reference to `path`"""
+        return self._db.reference(path, app=self.app)